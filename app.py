@@ -5,9 +5,7 @@ import dash_core_components as dcc
 import dash_html_components as html
 import dash_bootstrap_components as dbc
 import flask
-import numpy as np
 import pandas as pd
-import plotly.graph_objects as go
 
 from datetime import timedelta, datetime, date
 from dash.dependencies import Output, Input, State
@@ -16,13 +14,32 @@ from dash_table import DataTable
 
 from webscraper import only_public_profiles
 from webscraper.user_data import MFP_User
-from db import update_db
+from db import prefetch, update_db
+from db.dataset_store import DatasetStore, prepare_dataset
+from dashboard.aggregation import daily_totals
+from dashboard.figures import build_figures, cohort_figure
+from dashboard.stats import ranked_foods, top_foods, STATS_NUTRIENTS
+from dashboard.table_source import TableSourceCache
+import export
+import metrics
+import profiling
 
 server = flask.Flask(__name__)
 app = dash.Dash(__name__,
                 external_stylesheets=[dbc.themes.BOOTSTRAP],
                 server=server)
 server = app.server
+dataset_store = DatasetStore()
+table_sources = TableSourceCache()
+
+@server.route('/metrics')
+def metrics_endpoint():
+    return flask.Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+# Opt-in CPU and allocation profiles of single callback requests
+profiling.init_app(app)
+# Streamed CSV, NDJSON and Parquet downloads of a user's stored history
+export.init_app(app)
 
 from constants import *
 
@@ -109,6 +126,12 @@ def build_input_container():
                     width = 1), 
                 style={'marginTop': '10px'}
                 ),
+                dbc.Row(
+                    dbc.Col(
+                        html.Div(id='export-links')
+                    ),
+                style={'marginTop': '10px'}
+                ),
             ]
         )
     )
@@ -227,6 +250,106 @@ def build_line_plot_container():
         ), className='line_pretty_container',
     )
 
+def build_food_frequency_container():
+    return dbc.Container(
+        [
+        dbc.Row(
+            dbc.Col(
+                html.H4('Your Most Logged Foods', style={'marginTop': 25}),
+            )
+        ),
+        dbc.Row(
+            [
+                dbc.Col(
+                    dcc.Loading(id='loading-most-logged-table',
+                        children = [html.Div(id='most-logged-table')], type='default'),
+                    width=6
+                ),
+                dbc.Col(
+                    dcc.Loading(id='loading-calorie-sources-table',
+                        children = [html.Div(id='calorie-sources-table')], type='default'),
+                    width=6
+                )
+            ]
+        )], className='line_pretty_container',
+    )
+
+def build_population_container():
+    return dbc.Container(
+        [
+        dbc.Row(
+            dbc.Col(
+                html.H4('How You Compare With Everyone', style={'marginTop': 25}),
+            )
+        ),
+        dbc.Row(
+            dbc.Col(
+                dcc.Loading(id='loading-population-table',
+                    children = [html.Div(id='population-table')], type='default'),
+                width=8
+            )
+        )], className='line_pretty_container',
+    )
+
+def build_food_search_container():
+    return dbc.Container(
+        [
+        dbc.Row(
+            dbc.Col(
+                html.H4('What Does Everyone Eat?', style={'marginTop': 25}),
+            )
+        ),
+        dbc.Row(
+            dbc.Col(
+                dbc.Input(
+                    placeholder='Search foods logged by all users...',
+                    id='food-search-input',
+                    type='text',
+                    debounce=True,
+                    className='input-field'
+                ),
+                width=6
+            )
+        ),
+        dbc.Row(
+            dbc.Col(
+                dcc.Loading(id='loading-food-search-table',
+                    children = [html.Div(id='food-search-table')], type='default')
+            )
+        )], className='line_pretty_container',
+    )
+
+def build_group_container():
+    return dbc.Container(
+        [
+        dbc.Row(
+            dbc.Col(
+                html.H4('How Your Groups Eat', style={'marginTop': 25}),
+            )
+        ),
+        dbc.Row(
+            dbc.Col(
+                dcc.Dropdown(id='group-dropdown', placeholder='Select one of your groups...'),
+                width=6
+            )
+        ),
+        dbc.Row(
+            dbc.Col(
+                html.Div(
+                    dcc.Loading(id='loading-cohort-chart',
+                        children = [
+                            dcc.Graph(
+                                id='group-cohort-chart',
+                                config={'displayModeBar': False},
+                                figure={}
+                            )
+                        ], type='default'
+                    )
+                )
+            )
+        )], className='line_pretty_container',
+    )
+
 def build_data_table_container():
     return dbc.Container(
         [
@@ -238,7 +361,37 @@ def build_data_table_container():
         ),
         dbc.Row(
             dbc.Col(
-                html.Div(id='data-table'), 
+                html.Div(
+                    DataTable(
+                        id='nutrition-table',
+                        columns=[],
+                        data=[],
+                        page_current=0,
+                        page_size=TABLE_PAGE_SIZE,
+                        page_action='custom',
+                        sort_action='custom',
+                        sort_mode='multi',
+                        sort_by=[],
+                        filter_action='custom',
+                        filter_query='',
+                        style_data={
+                            'whiteSpace': 'normal',
+                            'height': 'auto'
+                        },
+                        style_as_list_view=True,
+                        style_cell={'textAlign': 'center'},
+                        style_header={
+                            'backgroundColor': '#F1F1F1',
+                            'fontWeight': 'bold'
+                        },
+                        style_cell_conditional=[
+                            {
+                                'if': {'column_id': 'Item'},
+                                'textAlign': 'left'
+                            }
+                        ]
+                    ), id='data-table'
+                ), 
                 width=12, 
                 className='line_pretty_container'  
             )
@@ -254,9 +407,14 @@ app.layout = html.Div(
         html.Div(
             [
                 build_line_plot_container(),
+                build_food_frequency_container(),
+                build_population_container(),
+                build_food_search_container(),
+                build_group_container(),
                 build_data_table_container(), 
                 html.P(id='blank-space', style={'height': '300px'}),
-                html.Div(id='hidden-data', style={'display': 'none'})
+                html.Div(id='hidden-data', style={'display': 'none'}),
+                dcc.Store(id='prefetch-user')
             ]
         )
     ]
@@ -268,15 +426,46 @@ app.layout = html.Div(
     [Input('submit-button', 'n_clicks')],
     state=[State('mfp-username', 'value')]
 )
+@metrics.instrument_callback
 def check_username(click, username):
     if not click or not username:
         raise PreventUpdate
-    valid = only_public_profiles.check_username(username)
+    # A username validated for a prefetch is not checked against MyFitnessPal again
+    valid = prefetch.recently_validated(username) or only_public_profiles.check_username(username)
     if valid:
         return username, False
     return 'Invalid Username', True
 
 
+@app.callback(
+    Output('prefetch-user', 'data'),
+    [Input('mfp-username', 'n_blur'),
+    Input('mfp-username', 'n_submit')],
+    state=[
+        State('mfp-username', 'value'),
+        State('prefetch-user', 'data'),
+        State('date-picker-range', 'start_date'),
+        State('date-picker-range', 'end_date')
+    ]
+)
+@metrics.instrument_callback
+def prefetch_user(blur, enter, username, previous, start_date, end_date):
+    # Start scraping a public username while dates are still being picked, so the
+    # data is usually stored by the time Submit is pressed. The store keeps the
+    # session id and the prefetch job of the username.
+    previous = previous or {'session': prefetch.new_session()}
+    if not prefetch.prefetch_enabled() or username == previous.get('user'):
+        raise PreventUpdate
+    if previous.get('job') is not None:
+        prefetch.cancel(previous['job'], previous['session'])
+    current = {'session': previous['session']}
+    if not username or not only_public_profiles.check_username(username):
+        return current
+    prefetch.mark_validated(username)
+    job_id = prefetch.start(username, *prefetch.likely_range(start_date, end_date), previous['session'])
+    return dict(current, user=username, job=job_id)
+
+
 @app.callback(
     Output('hidden-data', 'children'),
     [Input('dbc-validate-username', 'children'),
@@ -286,6 +475,7 @@ def check_username(click, username):
         State('date-picker-range', 'end_date')
     ]
 )
+@metrics.instrument_callback
 def load_data(username, click, start_date, end_date):
     # Load sample data when the app is loaded
     if not click:
@@ -300,21 +490,27 @@ def load_data(username, click, start_date, end_date):
            datetime.fromisoformat(end_date), '%Y-%m-%d'
         )
 
-        user_exists, last_updated = update_db.db_check_user(username)
-        if user_exists:
-            if (last_updated != YESTERDAY and last_updated != TODAY):
-                print("last updated: %s" % last_updated)
-                # Update the database with the most recent entries
-                update_db.insert_nutrition([username], last_updated)
-        else:
-            # Update the database with all entries
-            print("Scraping all of it: %s" % username)
-            update_db.insert_nutrition([username], START_SCRAPE_DATE)
+        # Scrape the uncovered dates of the range, or wait for a concurrent session
+        # already doing it. The rest of the history is backfilled in the background.
+        update_db.ingest_user(username, start_date, end_date)
         print("user_data:")
         user_data = update_db.return_data(username, start_date, end_date)
         print("done scraping")
-        json_out=user_data.to_json(orient='records', date_format='iso')
-        return json_out
+        # Only the key of the server-side dataset is sent to the browser
+        return dataset_store.put(prepare_dataset(user_data))
+
+
+def load_dataset(data_key):
+    '''
+    Return the dataset stored by load_data under the key held in the hidden-data div
+
+    parameters:
+        data_key (str) -- key returned by dataset_store.put()
+    '''
+    df_data = dataset_store.get(data_key)
+    if df_data is None:
+        raise PreventUpdate
+    return df_data
 
 
 @app.callback(
@@ -323,152 +519,11 @@ def load_data(username, click, start_date, end_date):
     Output('weekly-pie-chart', 'figure')],
     [Input('hidden-data', 'children')]
 )
-def plot_data(json_in):
-    if json_in is None:
+@metrics.instrument_callback
+def plot_data(data_key):
+    if data_key is None:
         raise PreventUpdate
-    df_data = pd.read_json(json_in)
-    df_data['entry_date'] = pd.to_datetime(df_data['entry_date']).dt.date   
-    date_list = sorted(df_data['entry_date'].unique())
-
-    # Add a line plot of Protein, Carbs, Fat, Fiber, Sugar, Calories
-    fig = go.Figure()
-    fig.add_trace(go.Scatter({
-                        'x': date_list, 
-                        'y': df_data.groupby('entry_date')['protein'].sum(),
-                        'type': 'scatter', 
-                        'name': 'Protein',
-                        'line': {'color': '#1C4E80'}
-                    }))
-    fig.add_trace(go.Scatter({
-                        'x': date_list, 
-                        'y': df_data.groupby('entry_date')['carbohydrates'].sum(),
-                        'type': 'scatter', 
-                        'name': 'Carbohydrates',
-                        'line': {'color': '#A5D8DD'}
-                    }))
-    fig.add_trace(go.Scatter({
-                        'x': date_list, 
-                        'y': df_data.groupby('entry_date')['fat'].sum(),
-                        'type': 'scatter', 
-                        'name': 'Fat',
-                        'line': {'color': '#EA6A47'}
-                    }))
-    fig.add_trace(go.Scatter({
-                        'x': date_list, 
-                        'y': df_data.groupby('entry_date')['fiber'].sum(),
-                        'type': 'scatter', 
-                        'name': 'Fiber',
-                        'line': {'color': '#6AB187'}
-                    }))
-    fig.add_trace(go.Scatter({
-                        'x': date_list, 
-                        'y': df_data.groupby('entry_date')['sugar'].sum(),
-                        'type': 'scatter', 
-                        'name': 'Sugar',
-                        'line': {'color': '#7E909A'}
-                    }))
-    fig.add_trace(go.Scatter({
-                        'x': date_list, 
-                        'y': df_data.groupby('entry_date')['calories'].sum(),
-                        'type': 'scatter', 
-                        'name': 'Calories', 
-                        'yaxis': 'y2',
-                        'line': {'color': '#202020'}
-                    }))
-    fig.update_layout(
-                yaxis={'title': 'Grams'}, 
-                yaxis2={
-                    'title':'Calories', 
-                    'overlaying': 'y', 
-                    'side': 'right',
-                    'showgrid': False
-                    },
-                xaxis={'showgrid': False},
-                legend={
-                    'orientation': 'h',
-                    'xanchor': 'center',
-                    'yanchor': 'top',
-                    'x': 0.5,
-                    'y': 1.1
-                    },
-                plot_bgcolor='rgba(0,0,0,0)',
-                paper_bgcolor='rgba(0,0,0,0)',
-                margin={'t': 50},
-                hovermode='x'
-    )
-
-    # Add a Bar plot of Protein, Carbs, Fat
-    fig2 = go.Figure()
-    fig2.add_trace(go.Bar({
-        'x': date_list,
-        'y': df_data.groupby('entry_date')['protein'].sum(),
-        'name': 'Protein',
-        'marker_color': '#1C4E80',
-        'hovertemplate': '%{y} Grams<extra></extra>'
-    }))
-    fig2.add_trace(go.Bar({
-        'x': date_list,
-        'y': df_data.groupby('entry_date')['carbohydrates'].sum(),
-        'name': 'Carbohydrates',
-        'marker_color': '#A5D8DD',
-        'hovertemplate': '%{y} Grams<extra></extra>'
-    }))
-    fig2.add_trace(go.Bar({
-        'x': date_list,
-        'y': df_data.groupby('entry_date')['fat'].sum(),
-        'name': 'Fat',
-        'marker_color': '#EA6A47',
-        'hovertemplate': '%{y} Grams<extra></extra>'
-    }))
-    fig2.update_layout(
-        yaxis={'title': 'Grams'},
-        legend={
-            'orientation': 'h',
-            'xanchor': 'center',
-            'yanchor': 'top',
-            'x': 0.5,
-            'y': 1.1
-            },
-        showlegend=False,
-        height=350,
-        width=600,
-        paper_bgcolor='rgba(0,0,0,0)',
-        plot_bgcolor='rgba(0,0,0,0)',
-        margin={
-            'l': 50, 
-            'r': 150,
-            't': 0,
-            'b': 0
-            },
-    )
-
-    # Add a pie chart of Protein, Carbs, Fat percentages
-    fig3 = go.Figure()
-    fig3.add_trace(go.Pie(
-        labels=['Protein', 'Carbohydrates', 'Fat'], 
-        values=[
-                np.sum(df_data.groupby('entry_date')['protein'].sum()*4),
-                np.sum(df_data.groupby('entry_date')['carbohydrates'].sum()*4),
-                np.sum(df_data.groupby('entry_date')['fat'].sum()*4),
-        ], 
-        textinfo='label+percent', 
-        insidetextorientation='radial',
-        hovertemplate='%{value} Calories of %{label}<extra></extra>',
-        marker_colors=['#1C4E80', '#A5D8DD', '#EA6A47'])
-    )
-    fig3.update_layout(
-        showlegend=False,
-        height=375,
-        width=375,
-        paper_bgcolor='rgba(0,0,0,0)',
-        plot_bgcolor='rgba(0,0,0,0)',
-        margin={
-            'l': 125, 
-            'r': 0,
-            't': 0,
-            'b': 0
-            })
-    return fig, fig2, fig3
+    return build_figures(daily_totals(load_dataset(data_key)))
 
 
 @app.callback(
@@ -479,6 +534,7 @@ def plot_data(json_in):
         State('date-picker-range', 'end_date')
     ]
 )
+@metrics.instrument_callback
 def dropdown(click, start_date, end_date):
     if not click:
         raise PreventUpdate
@@ -496,79 +552,49 @@ def dropdown(click, start_date, end_date):
 
 
 @app.callback(
-    Output('data-table', 'children'),
+    [Output('nutrition-table', 'data'),
+    Output('nutrition-table', 'columns'),
+    Output('nutrition-table', 'page_count')],
     [Input('hidden-data', 'children'),
-    Input('date-dropdown', 'value')]
+    Input('date-dropdown', 'value'),
+    Input('nutrition-table', 'page_current'),
+    Input('nutrition-table', 'page_size'),
+    Input('nutrition-table', 'sort_by'),
+    Input('nutrition-table', 'filter_query')]
 )
-def display_tables(json_in, selected_date):
-    if json_in is None or selected_date is None:
+@metrics.instrument_callback
+def display_tables(data_key, selected_date, page_current, page_size, sort_by, filter_query):
+    if data_key is None or selected_date is None:
         raise PreventUpdate
 
-    df_data = pd.read_json(json_in)
-    df_data['entry_date'] = pd.to_datetime(df_data['entry_date']).dt.date
-    try:
-        out_data = pd.concat(df_data.loc[df_data['entry_date']==datetime.strptime(day, '%Y-%m-%d').date()] for day in selected_date)
-    except:
-        out_data = df_data.loc[df_data['entry_date']==datetime.strptime(selected_date[0], '%Y-%m-%d').date()]
-
-
-    out_data = out_data[[col for col in out_data.columns if col not in DB_ONLY_COLS]]
-
-    return DataTable(
-        data=out_data.to_dict('rows'), 
-        columns=[{'name': i, 'id': i} for i in out_data.columns],
-        style_data={
-            'whiteSpace': 'normal',
-            'height': 'auto'
-        },
-        style_as_list_view=True,
-        style_cell={'textAlign': 'center'},
-        style_header={
-            'backgroundColor': '#F1F1F1',
-            'fontWeight': 'bold'
-        },
-        style_cell_conditional=[
-            {
-                'if': {'column_id': 'Item'},
-                'textAlign': 'left'
-            }
-        ],
-        sort_action='native'
-    )
+    # Only the rows on the visible page are sent to the browser
+    source = table_sources.get(data_key, load_dataset, DB_ONLY_COLS)
+    data, page_count = source.page(selected_date, filter_query, sort_by, page_current, page_size)
+    columns = [{'name': i, 'id': i} for i in source.columns]
+    return data, columns, page_count
     
-def generate_stats_tables(json_in, nutrient):
-    df_data = pd.read_json(json_in)
-    df_data['entry_date'] = pd.to_datetime(df_data['entry_date']).dt.date
+def generate_stats_tables(nutrient, top_items):
+    '''
+    Return the "Foods Highest in" table for the nutrient
+
+    parameters:
+        nutrient (str) -- nutrient column the foods are ranked by
+        top_items (list of tuples) -- (item, value) pairs returned by dashboard.stats.top_foods
+    '''
     table_header = [
         html.Thead(html.Tr([html.Th('Foods Highest in %s' % nutrient), html.Th('Value')]), style={'textAlign': 'center'})
     ]
-    
-    top_3 = df_data.nlargest(3, nutrient)[['item', nutrient]]
 
-    item_1 = top_3.iloc[[0]]
-    item_2 = top_3.iloc[[1]]
-    item_3 = top_3.iloc[[2]]
+    rows = [
+        html.Tr(
+            [
+                html.Td(str(item), style={'padding':'5px 5px 5px 0px'}),
+                html.Td(str(value), style={'textAlign': 'center'})
+            ]
+        ) for item, value in top_items
+    ]
 
-    row1 = html.Tr(
-        [
-        html.Td(str(item_1.loc[:, 'item'].values[0]), style={'padding':'5px 5px 5px 0px'}),
-        html.Td(str(item_1.loc[:, nutrient].values[0]), style={'textAlign': 'center'})      
-        ]
-    )
-    row2 = html.Tr(
-        [       
-            html.Td(str(item_2.loc[:, 'item'].values[0]), style={'padding':'5px 5px 5px 0px'}),
-            html.Td(str(item_2.loc[:, nutrient].values[0]), style={'textAlign': 'center'})
-        ]
-    )
-    row3 = html.Tr(
-        [
-            html.Td(str(item_3.loc[:, 'item'].values[0]), style={'padding':'5px 5px 5px 0px'}), 
-            html.Td(str(item_3.loc[:, nutrient].values[0]), style={'textAlign': 'center'})
-        ]
-    )
-    
-    table_body = [html.Tbody([row1, row2, row3])]
+    table_body = [html.Tbody(rows)]
 
     return dbc.Table(
         table_header + table_body, 
@@ -577,40 +603,200 @@ def generate_stats_tables(json_in, nutrient):
         )
 
 @app.callback(
-    Output('calories-table', 'children'),
+    [Output('calories-table', 'children'),
+    Output('protein-table', 'children'),
+    Output('carbs-table', 'children'),
+    Output('fat-table', 'children')],
     [Input('hidden-data', 'children')]
 )
-def calories_table(json_in):
-    if json_in is None:
+@metrics.instrument_callback
+def stats_tables(data_key):
+    if data_key is None:
         raise PreventUpdate
-    return generate_stats_tables(json_in, 'calories')
+    top_items = top_foods(load_dataset(data_key), STATS_NUTRIENTS, TOP_N_FOODS)
+    return [generate_stats_tables(nutrient, top_items[nutrient]) for nutrient in STATS_NUTRIENTS]
+
+
+def generate_food_frequency_table(title, ranked, column, label):
+    '''
+    Return a table of ranked foods with their value of the column and its share of the total
+
+    parameters:
+        title (str) -- table title
+        ranked (DataFrame) -- output of dashboard.stats.ranked_foods
+        column (str) -- column the foods are ranked by
+        label (str) -- header of the column values
+    '''
+    table_header = [
+        html.Thead(html.Tr([html.Th(title), html.Th(label), html.Th('Share')]), style={'textAlign': 'center'})
+    ]
+
+    rows = [
+        html.Tr(
+            [
+                html.Td(str(row['item']), style={'padding':'5px 5px 5px 0px'}),
+                html.Td(str(row[column]), style={'textAlign': 'center'}),
+                html.Td('{0:.0%}'.format(row['share']), style={'textAlign': 'center'})
+            ]
+        ) for _, row in ranked.iterrows()
+    ]
+
+    return dbc.Table(
+        table_header + [html.Tbody(rows)],
+        responsive=True,
+        style={'fontSize': '13px'},
+        )
 
 @app.callback(
-    Output('protein-table', 'children'),
-    [Input('hidden-data', 'children')]
+    [Output('most-logged-table', 'children'),
+    Output('calorie-sources-table', 'children')],
+    [Input('hidden-data', 'children')],
+    state=[
+        State('dbc-validate-username', 'children'),
+        State('date-picker-range', 'start_date'),
+        State('date-picker-range', 'end_date')
+    ]
 )
-def protein_table(json_in):
-    if json_in is None:
+@metrics.instrument_callback
+def food_frequency_tables(data_key, username, start_date, end_date):
+    if data_key is None or username is None or username == 'Invalid Username':
         raise PreventUpdate
-    return generate_stats_tables(json_in, 'protein')
+    # Whole months are read from the per-user food frequency index
+    food_totals = update_db.return_food_totals(
+        username,
+        datetime.strftime(datetime.fromisoformat(start_date), '%Y-%m-%d'),
+        datetime.strftime(datetime.fromisoformat(end_date), '%Y-%m-%d'))
+    return [
+        generate_food_frequency_table(
+            'Most Logged Foods', ranked_foods(food_totals, 'entries', FOOD_FREQUENCY_TOP_N), 'entries', 'Times'),
+        generate_food_frequency_table(
+            'Biggest Calorie Sources', ranked_foods(food_totals, 'calories', FOOD_FREQUENCY_TOP_N), 'calories', 'Calories'),
+    ]
+
 
 @app.callback(
-    Output('carbs-table', 'children'),
-    [Input('hidden-data', 'children')]
+    Output('population-table', 'children'),
+    [Input('hidden-data', 'children')],
+    state=[
+        State('dbc-validate-username', 'children'),
+        State('date-picker-range', 'start_date'),
+        State('date-picker-range', 'end_date')
+    ]
 )
-def carbs_table(json_in):
-    if json_in is None:
+@metrics.instrument_callback
+def population_table(data_key, username, start_date, end_date):
+    if data_key is None or username is None or username == 'Invalid Username':
         raise PreventUpdate
-    return generate_stats_tables(json_in, 'carbohydrates')
+    # Vectorized over the memory-mapped daily totals of every user
+    percentiles = update_db.return_population_percentiles(
+        username,
+        datetime.strftime(datetime.fromisoformat(start_date), '%Y-%m-%d'),
+        datetime.strftime(datetime.fromisoformat(end_date), '%Y-%m-%d'))
+    if percentiles.empty:
+        return html.P('No logged days in this range')
+    table_header = [
+        html.Thead(html.Tr([html.Th(header) for header in
+            ['Daily Average', 'You', 'Everyone (Median)', 'Percentile']]), style={'textAlign': 'center'})
+    ]
+    rows = [
+        html.Tr(
+            [
+                html.Td(nutrient.capitalize(), style={'padding':'5px 5px 5px 0px'}),
+                html.Td('{0:.0f}'.format(row['user']), style={'textAlign': 'center'}),
+                html.Td('{0:.0f}'.format(row['median']), style={'textAlign': 'center'}),
+                html.Td('{0:.0f}'.format(row['percentile']), style={'textAlign': 'center'})
+            ]
+        ) for nutrient, row in percentiles.iterrows()
+    ]
+    return [
+        dbc.Table(table_header + [html.Tbody(rows)], responsive=True, style={'fontSize': '13px'}),
+        html.P('Compared with %s users who logged food in this range' % int(percentiles['users'].iloc[0]),
+               style={'fontSize': '12px'})
+    ]
+
 
 @app.callback(
-    Output('fat-table', 'children'),
-    [Input('hidden-data', 'children')]
+    Output('food-search-table', 'children'),
+    [Input('food-search-input', 'value')]
+)
+@metrics.instrument_callback
+def food_search(query):
+    if not query:
+        raise PreventUpdate
+    results = update_db.search_foods(query, FOOD_SEARCH_LIMIT)
+    if results.empty:
+        return html.P('No foods found')
+    table_header = [
+        html.Thead(html.Tr([html.Th(header) for header in
+            ['Food', 'Users', 'Times Logged', 'Calories', 'Protein', 'Carbs', 'Fat']]), style={'textAlign': 'center'})
+    ]
+    rows = [
+        html.Tr(
+            [html.Td(str(row['item']), style={'padding':'5px 5px 5px 0px'})] + [
+                html.Td(str(row[column]), style={'textAlign': 'center'})
+                for column in ['users', 'entries', 'calories', 'protein', 'carbohydrates', 'fat']
+            ]
+        ) for _, row in results.iterrows()
+    ]
+    return dbc.Table(table_header + [html.Tbody(rows)], responsive=True, style={'fontSize': '13px'})
+
+
+@app.callback(
+    [Output('group-dropdown', 'options'),
+    Output('group-dropdown', 'value')],
+    [Input('dbc-validate-username', 'children')]
+)
+@metrics.instrument_callback
+def group_dropdown(username):
+    if username is None or username == 'Invalid Username':
+        raise PreventUpdate
+    groups = update_db.return_user_groups(username)
+    return [{'label': group, 'value': group} for group in groups], (groups[0] if groups else None)
+
+
+@app.callback(
+    Output('group-cohort-chart', 'figure'),
+    [Input('group-dropdown', 'value'),
+    Input('hidden-data', 'children')],
+    state=[
+        State('date-picker-range', 'start_date'),
+        State('date-picker-range', 'end_date')
+    ]
+)
+@metrics.instrument_callback
+def plot_group(group_name, data_key, start_date, end_date):
+    if not group_name or not start_date or not end_date:
+        raise PreventUpdate
+    # One indexed read of the group's precomputed daily statistics
+    stats = update_db.return_group_stats(
+        group_name,
+        datetime.strftime(datetime.fromisoformat(start_date), '%Y-%m-%d'),
+        datetime.strftime(datetime.fromisoformat(end_date), '%Y-%m-%d'))
+    df_data = dataset_store.get(data_key)
+    daily = daily_totals(df_data) if df_data is not None else None
+    return cohort_figure(stats, daily)
+
+
+@app.callback(
+    Output('export-links', 'children'),
+    [Input('hidden-data', 'children')],
+    state=[
+        State('dbc-validate-username', 'children'),
+        State('date-picker-range', 'start_date'),
+        State('date-picker-range', 'end_date')
+    ]
 )
-def fat_table(json_in):
-    if json_in is None:
+@metrics.instrument_callback
+def export_links(data_key, username, start_date, end_date):
+    if data_key is None or username is None or username == 'Invalid Username':
         raise PreventUpdate
-    return generate_stats_tables(json_in, 'fat')
+    query = '?start={0}&end={1}'.format(
+        datetime.strftime(datetime.fromisoformat(start_date), '%Y-%m-%d'),
+        datetime.strftime(datetime.fromisoformat(end_date), '%Y-%m-%d'))
+    links = ['Download: ']
+    for label, fmt in [('CSV', 'csv'), ('NDJSON', 'ndjson'), ('Parquet', 'parquet')]:
+        links.append(html.A(label, href='/export/{0}.{1}{2}'.format(username, fmt, query), style={'marginRight': '10px'}))
+    return links
 
 
 if __name__ == '__main__':
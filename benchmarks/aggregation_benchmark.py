@@ -0,0 +1,57 @@
+import sys
+import time
+
+from os import path
+
+module_path = path.abspath(path.join(path.dirname( __file__ ), '..'))
+sys.path.append(module_path)
+
+import numpy as np
+
+from benchmarks.synthetic import nutrition_frame
+from dashboard.aggregation import daily_totals, DAILY_NUTRIENTS, MACROS
+
+YEARS = [1, 2, 4]
+
+def groupby_per_trace(df_data):
+    '''
+    Aggregation as done by plot_data before dashboard.aggregation:
+    one groupby for each of the six lines, three bars and three pie slices
+    '''
+    date_list = sorted(df_data['entry_date'].dt.date.unique())
+    lines = [df_data.groupby('entry_date')[col].sum() for col in DAILY_NUTRIENTS]
+    bars = [df_data.groupby('entry_date')[col].sum() for col in MACROS]
+    pie = [np.sum(df_data.groupby('entry_date')[col].sum()*4) for col in MACROS]
+    return date_list, lines, bars, pie
+
+def single_pass(df_data):
+    daily = daily_totals(df_data)
+    return daily.date_list(), daily.totals, daily.macro_calories
+
+def best_of(func, df_data, repeat=10):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(df_data)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def run(items_per_day=10):
+    '''
+    Print the time spent aggregating year-long and longer ranges for the charts
+    with twelve groupbys and with the single-pass engine.
+
+    parameters:
+        items_per_day (int) -- foods logged on each day
+    '''
+    for years in YEARS:
+        df_data = nutrition_frame(days=365*years, items_per_day=items_per_day)
+        before = best_of(groupby_per_trace, df_data)
+        after = best_of(single_pass, df_data)
+        print('%s year(s), %6s rows: groupby per trace %7.2f ms  single pass %6.2f ms  (%.1fx)'
+              % (years, len(df_data), before*1000, after*1000, before/after))
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,81 @@
+import json
+import sys
+import time
+
+from os import path
+
+module_path = path.abspath(path.join(path.dirname( __file__ ), '..'))
+sys.path.append(module_path)
+
+import plotly
+import plotly.graph_objects as go
+
+from benchmarks.synthetic import nutrition_frame
+from dashboard.aggregation import daily_totals
+from dashboard.figures import build_figures, templates, TRACE_STYLES, LINE_NUTRIENTS, BAR_NUTRIENTS
+from dashboard.figures import LINE_LAYOUT, BAR_LAYOUT, PIE_LAYOUT, PIE_NUTRIENTS
+
+DAYS = [7, 90, 365, 3*365]
+
+def graph_objects_figures(daily):
+    '''
+    Figures built as plot_data did before dashboard.figures: validated
+    go.Figure objects with one add_trace call per trace
+    '''
+    date_list = daily.date_list()
+    fig = go.Figure()
+    for nutrient in LINE_NUTRIENTS:
+        name, color = TRACE_STYLES[nutrient]
+        trace = {'x': date_list, 'y': daily.totals[nutrient], 'type': 'scatter',
+                 'name': name, 'line': {'color': color}}
+        if nutrient == 'calories':
+            trace['yaxis'] = 'y2'
+        fig.add_trace(go.Scatter(trace))
+    fig.update_layout(**LINE_LAYOUT)
+
+    fig2 = go.Figure()
+    for nutrient in BAR_NUTRIENTS:
+        name, color = TRACE_STYLES[nutrient]
+        fig2.add_trace(go.Bar({'x': date_list, 'y': daily.totals[nutrient], 'name': name,
+                               'marker_color': color, 'hovertemplate': '%{y} Grams<extra></extra>'}))
+    fig2.update_layout(**BAR_LAYOUT)
+
+    fig3 = go.Figure()
+    fig3.add_trace(go.Pie(
+        labels=[TRACE_STYLES[n][0] for n in PIE_NUTRIENTS],
+        values=[daily.macro_calories[n] for n in PIE_NUTRIENTS],
+        textinfo='label+percent', insidetextorientation='radial',
+        hovertemplate='%{value} Calories of %{label}<extra></extra>',
+        marker_colors=[TRACE_STYLES[n][1] for n in PIE_NUTRIENTS]))
+    fig3.update_layout(**PIE_LAYOUT)
+    return fig, fig2, fig3
+
+def render(build, daily):
+    '''Build the figures and serialize them the way Dash sends them to the browser'''
+    return json.dumps(build(daily), cls=plotly.utils.PlotlyJSONEncoder)
+
+def best_of(func, *args, repeat=10):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def run():
+    '''
+    Print the per-callback time to build and serialize the three dashboard
+    figures with graph objects and with the cached templates
+    '''
+    templates()
+    for days in DAYS:
+        daily = daily_totals(nutrition_frame(days=days))
+        before = best_of(render, graph_objects_figures, daily)
+        after = best_of(render, build_figures, daily)
+        print('%5s days: graph objects %7.2f ms  templates %6.2f ms  (%.1fx)'
+              % (days, before*1000, after*1000, before/after))
+
+
+if __name__ == '__main__':
+    run()
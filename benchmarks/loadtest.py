@@ -0,0 +1,274 @@
+import argparse
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from os import path
+
+module_path = path.abspath(path.join(path.dirname( __file__ ), '..'))
+sys.path.append(module_path)
+
+import numpy as np
+import requests
+
+FIXTURES_DIR = path.join(path.dirname(path.abspath(__file__)), 'fixtures')
+UPDATE_URL = '/_dash-update-component'
+
+# Dash callback payloads sent by a dashboard session, in the order the browser sends them
+VALIDATE = '..dbc-validate-username.children...dbc-validate-username.is_open..'
+LOAD = 'hidden-data.children'
+DROPDOWN = 'date-dropdown.options'
+PLOT = '..week-at-a-glance.figure...weekly-bar-chart.figure...weekly-pie-chart.figure..'
+STATS = '..calories-table.children...protein-table.children...carbs-table.children...fat-table.children..'
+TABLE = '..nutrition-table.data...nutrition-table.columns...nutrition-table.page_count..'
+CALLBACKS = {
+    VALIDATE: 'check_username',
+    LOAD: 'load_data',
+    DROPDOWN: 'dropdown',
+    PLOT: 'plot_data',
+    STATS: 'stats_tables',
+    TABLE: 'display_tables',
+}
+
+
+class MFPStandIn(BaseHTTPRequestHandler):
+    '''
+    Local stand-in for the MyFitnessPal food diary. Every diary page returns the
+    recorded diary fixture after `latency` seconds, except for usernames starting
+    with "private", which get the page shown for private or unknown users.
+    '''
+    latency = 0.0
+    diary = b''
+    private = b'<html><body><div class="block-1">This Food Diary is Private</div></body></html>'
+
+    def do_GET(self):
+        if not self.path.startswith('/food/diary/'):
+            self.send_error(404)
+            return
+        time.sleep(self.latency)
+        username = self.path.split('/')[3].split('?')[0]
+        body = self.private if username.startswith('private') else self.diary
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_mfp_stand_in(latency):
+    '''
+    Serve the MyFitnessPal stand-in on a free local port and return its base url
+
+    parameters:
+        latency (float) -- seconds to wait before answering each page
+    '''
+    with open(path.join(FIXTURES_DIR, 'diary.html'), 'rb') as f:
+        MFPStandIn.diary = f.read()
+    MFPStandIn.latency = latency
+    server = ThreadingHTTPServer(('127.0.0.1', 0), MFPStandIn)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return 'http://127.0.0.1:%s' % server.server_address[1]
+
+def start_app(mfp_url, port, workers, tmpdir):
+    '''
+    Start the dashboard under gunicorn with an embedded database, scraping the
+    stand-in, and return the process once it answers requests
+
+    parameters:
+        mfp_url (str) -- base url of the MyFitnessPal stand-in
+        port (int) -- local port to serve the dashboard on
+        workers (int) -- gunicorn workers
+        tmpdir (str) -- directory for the database, datasets and metrics
+    '''
+    from db.storage import make_storage
+    storage_path = path.join(tmpdir, 'loadtest.sqlite')
+    make_storage('sqlite', storage_path).create_tables()
+
+    env = dict(os.environ,
+               MFP_URL=mfp_url,
+               MFP_STORAGE='sqlite',
+               MFP_STORAGE_PATH=storage_path,
+               GUNICORN_BIND='127.0.0.1:%s' % port,
+               GUNICORN_WORKERS=str(workers),
+               TMPDIR=tmpdir)
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'wsgi:application'],
+        cwd=module_path, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = 'http://127.0.0.1:%s' % port
+    for _ in range(120):
+        try:
+            requests.get(url, timeout=1)
+            return process, url
+        except requests.ConnectionError:
+            time.sleep(0.5)
+    process.terminate()
+    raise RuntimeError('The dashboard did not start')
+
+def payload(output, inputs, state=()):
+    '''
+    Return the body of a _dash-update-component request
+
+    parameters:
+        output (str) -- output string of the callback
+        inputs (list of tuples) -- (id, property, value) of each input
+        state (list of tuples) -- (id, property, value) of each state
+    '''
+    ids = output.strip('.').split('...')
+    return {
+        'output': output,
+        'outputs': [{'id': i.split('.')[0], 'property': i.split('.')[1]} for i in ids]
+                    if output.startswith('..') else {'id': output.split('.')[0], 'property': output.split('.')[1]},
+        'inputs': [{'id': i, 'property': p, 'value': v} for i, p, v in inputs],
+        'state': [{'id': i, 'property': p, 'value': v} for i, p, v in state],
+        'changedPropIds': ['%s.%s' % (inputs[0][0], inputs[0][1])],
+    }
+
+def output_value(response, component, prop):
+    '''Return one output value from a _dash-update-component response'''
+    body = response.json()['response']
+    if component in body:
+        return body[component][prop]
+    # Single output callbacks of older Dash versions
+    return body['props'][prop]
+
+
+class Recorder:
+    '''
+    Thread-safe collection of request latencies and errors per callback
+    '''
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+        self._lock = threading.Lock()
+
+    def record(self, callback, seconds, ok):
+        with self._lock:
+            self.latencies.setdefault(callback, []).append(seconds)
+            if not ok:
+                self.errors[callback] = self.errors.get(callback, 0) + 1
+
+def session(url, username, recorder, rng):
+    '''
+    Run one dashboard session: validate the username, load a date range, then
+    request the charts, tables and the per-day table like the browser does
+
+    parameters:
+        url (str) -- base url of the dashboard
+        username (str) -- MyFitnessPal username
+        recorder (Recorder) -- collects the latencies
+        rng (random.Random) -- random source for the date range
+    '''
+    s = requests.Session()
+
+    def call(output, inputs, state=()):
+        start = time.perf_counter()
+        ok = False
+        try:
+            response = s.post(url + UPDATE_URL, json=payload(output, inputs, state), timeout=600)
+            # 204 is returned when the callback raised PreventUpdate
+            ok = response.status_code in (200, 204)
+            return response if response.status_code == 200 else None
+        except requests.RequestException:
+            return None
+        finally:
+            recorder.record(CALLBACKS[output], time.perf_counter() - start, ok)
+
+    end = date(2020, 6, 30) - timedelta(rng.randint(0, 150))
+    start = end - timedelta(rng.randint(6, 30))
+    dates = [('date-picker-range', 'start_date', start.isoformat()),
+             ('date-picker-range', 'end_date', end.isoformat())]
+
+    response = call(VALIDATE, [('submit-button', 'n_clicks', 1)], [('mfp-username', 'value', username)])
+    if response is None:
+        return
+    validated = output_value(response, 'dbc-validate-username', 'children')
+    call(DROPDOWN, [('submit-button', 'n_clicks', 1)], dates)
+    response = call(LOAD, [('dbc-validate-username', 'children', validated), ('submit-button', 'n_clicks', 1)], dates)
+    if response is None:
+        return
+    data_key = output_value(response, 'hidden-data', 'children')
+    call(PLOT, [('hidden-data', 'children', data_key)])
+    call(STATS, [('hidden-data', 'children', data_key)])
+    selected = [(end - timedelta(day)).isoformat() for day in range(rng.randint(1, 3))]
+    call(TABLE, [('hidden-data', 'children', data_key), ('date-dropdown', 'value', selected),
+                 ('nutrition-table', 'page_current', 0), ('nutrition-table', 'page_size', 25),
+                 ('nutrition-table', 'sort_by', []), ('nutrition-table', 'filter_query', '')])
+
+def run_level(url, concurrency, duration, users, seed=0):
+    '''
+    Run dashboard sessions from `concurrency` clients for `duration` seconds and
+    return the Recorder and the elapsed time
+
+    parameters:
+        url (str) -- base url of the dashboard
+        concurrency (int) -- simultaneous sessions
+        duration (float) -- seconds to keep starting new sessions
+        users (list of str) -- usernames the sessions pick from
+        seed (int) -- random seed
+    '''
+    recorder = Recorder()
+    deadline = time.perf_counter() + duration
+
+    def client(i):
+        rng = random.Random(seed * 1000 + i)
+        while time.perf_counter() < deadline:
+            session(url, rng.choice(users), recorder, rng)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(client, range(concurrency)))
+    return recorder, time.perf_counter() - start
+
+def report(concurrency, recorder, elapsed):
+    '''Print throughput, latency percentiles and errors per callback'''
+    print('\nconcurrency %s (%.1fs)' % (concurrency, elapsed))
+    print('%-16s %8s %8s %9s %9s %9s %9s' % ('callback', 'requests', 'errors', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms'))
+    for callback in CALLBACKS.values():
+        latencies = recorder.latencies.get(callback)
+        if not latencies:
+            continue
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) * 1000
+        print('%-16s %8s %8s %9.1f %9.1f %9.1f %9.1f' % (
+            callback, len(latencies), recorder.errors.get(callback, 0),
+            len(latencies) / elapsed, p50, p95, p99))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(
+        description='Load test the dashboard callbacks with concurrent sessions')
+    parser.add_argument('--url', help='dashboard to test. Default: start one with a local MFP stand-in and database')
+    parser.add_argument('--concurrency', default='1,2,4,8,16', help='comma separated concurrency levels')
+    parser.add_argument('--duration', type=float, default=30, help='seconds per concurrency level')
+    parser.add_argument('--users', type=int, default=20, help='distinct usernames, a first visit triggers a full scrape')
+    parser.add_argument('--private-users', type=int, default=2, help='usernames that fail validation')
+    parser.add_argument('--mfp-latency', type=float, default=0.05, help='seconds the stand-in waits per page')
+    parser.add_argument('--workers', type=int, default=2, help='gunicorn workers of the started dashboard')
+    parser.add_argument('--port', type=int, default=8050)
+    args = parser.parse_args()
+
+    users = ['loadtest_user_%s' % i for i in range(args.users)]
+    users += ['private_user_%s' % i for i in range(args.private_users)]
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        process = None
+        url = args.url
+        if url is None:
+            mfp_url = start_mfp_stand_in(args.mfp_latency)
+            process, url = start_app(mfp_url, args.port, args.workers, tmpdir)
+        try:
+            for level, concurrency in enumerate(int(c) for c in args.concurrency.split(',')):
+                recorder, elapsed = run_level(url, concurrency, args.duration, users, seed=level)
+                report(concurrency, recorder, elapsed)
+        finally:
+            if process is not None:
+                process.terminate()
+                process.wait()
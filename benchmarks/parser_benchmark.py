@@ -0,0 +1,81 @@
+import re
+import sys
+import time
+
+from os import path
+
+module_path = path.abspath(path.join(path.dirname( __file__ ), '..'))
+sys.path.append(module_path)
+
+from bs4 import BeautifulSoup
+
+from webscraper.parsing import available_parsers, make_parser
+
+FIXTURES_DIR = path.join(path.dirname(path.abspath(__file__)), 'fixtures')
+# Minimum CPU time spent on each page and backend
+CPU_SECONDS = 1.0
+
+def full_parse_members(content):
+    '''
+    Member parsing as done by GroupScraper before webscraper.parsing:
+    the whole page is built with html.parser and the pattern compiled per page
+    '''
+    page_html = BeautifulSoup(content, 'html.parser')
+    user_ids = page_html.find_all('a', attrs={'class': 'Title', 'href': re.compile(r'\/en\/profile\/usercard\/\d+')})
+    return [user_ids[i].contents[0].strip() for i in range(len(user_ids))]
+
+def full_parse_private(content):
+    '''Private diary check as done by check_username before webscraper.parsing'''
+    html = BeautifulSoup(content, 'html.parser')
+    return html.find('div', attrs={'class': "block-1"}) is not None
+
+def fixture(filename):
+    with open(path.join(FIXTURES_DIR, filename), 'rb') as f:
+        return f.read()
+
+def pages_per_cpu_second(func, content, cpu_seconds=CPU_SECONDS):
+    '''
+    Return how many times func parsed the page per second of process CPU time
+
+    parameters:
+        func (callable) -- parser called with the page content
+        content (bytes) -- html page
+        cpu_seconds (float) -- minimum CPU time to spend
+    '''
+    pages = 0
+    start = time.process_time()
+    while time.process_time() - start < cpu_seconds:
+        func(content)
+        pages += 1
+    return pages / (time.process_time() - start)
+
+def run(cpu_seconds=CPU_SECONDS):
+    '''
+    Print the pages parsed per CPU-second by every installed parser backend for
+    group member pages, group browse pages and the private diary check, next to
+    the full html.parser parse used before, after checking that every backend
+    extracts the same values.
+
+    parameters:
+        cpu_seconds (float) -- minimum CPU time spent on each page and backend
+    '''
+    pages = {
+        'member page': ('group_members.html', 'member_names', full_parse_members),
+        'group page': ('group_list.html', 'groups', None),
+        'diary privacy': ('diary.html', 'is_private', full_parse_private),
+    }
+    parsers = [make_parser(name) for name in available_parsers()]
+    for label, (filename, method, before) in pages.items():
+        content = fixture(filename)
+        expected = getattr(parsers[-1], method)(content)
+        print('%s (%s, %.0f KB)' % (label, filename, len(content) / 1024))
+        if before is not None:
+            print('  %-24s %8.0f pages/CPU-s' % ('html.parser, full tree', pages_per_cpu_second(before, content, cpu_seconds)))
+        for parser in parsers:
+            func = getattr(parser, method)
+            assert func(content) == expected, '%s extracts different values' % parser.name
+            print('  %-24s %8.0f pages/CPU-s' % (parser.name, pages_per_cpu_second(func, content, cpu_seconds)))
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,79 @@
+import os
+import sys
+import tempfile
+import time
+
+from os import path
+
+module_path = path.abspath(path.join(path.dirname( __file__ ), '..'))
+sys.path.append(module_path)
+
+from benchmarks.synthetic import nutrition_rows
+from db.storage import make_storage, duckdb, psycopg2
+
+USER = 'benchmark_user'
+RANGES = [('2017-01-01', '2017-01-31'), ('2017-01-01', '2017-12-31'), ('2017-01-01', '2019-12-31')]
+
+def available_backends(tmpdir):
+    '''
+    Return every storage backend that can be benchmarked in this environment.
+    PostgreSQL is only included when database.ini is configured.
+
+    parameters:
+        tmpdir (str) -- directory for the embedded database files
+    '''
+    backends = [make_storage('sqlite', path.join(tmpdir, 'bench.sqlite'))]
+    if duckdb is not None:
+        backends.append(make_storage('duckdb', path.join(tmpdir, 'bench.duckdb')))
+    if psycopg2 is not None:
+        try:
+            postgres = make_storage('postgresql')
+            postgres.connect().close()
+            backends.append(postgres)
+        except Exception as error:
+            print('Skipping postgresql: %s' % error)
+    return backends
+
+def time_call(func, *args, repeat=5):
+    '''
+    Return the best wall time in seconds of func(*args) over `repeat` runs
+    '''
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+def run(days=3*365, items_per_day=8):
+    '''
+    Load the same synthetic history into every backend and print ingest,
+    range read and per-day aggregation latency.
+
+    parameters:
+        days (int) -- number of days of history to load
+        items_per_day (int) -- foods logged on each day
+    '''
+    rows = nutrition_rows(USER, '2017-01-01', days, items_per_day)
+    print('%s rows (%s days x %s items)\n' % (len(rows), days, items_per_day))
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for storage in available_backends(tmpdir):
+            storage.create_tables()
+            if storage.name == 'postgresql':
+                storage.executemany('DELETE FROM nutrition WHERE mfp_username = %s;', [(USER,)])
+            start = time.perf_counter()
+            storage.insert_nutrition(rows)
+            print('%-10s ingest %8.1f ms' % (storage.name, (time.perf_counter()-start)*1000))
+            for date_start, date_end in RANGES:
+                read = time_call(storage.read_nutrition, USER, date_start, date_end)
+                agg = time_call(storage.daily_totals, USER, date_start, date_end)
+                print('%-10s %s..%s  read %8.2f ms  daily totals %8.2f ms'
+                      % (storage.name, date_start, date_end, read*1000, agg*1000))
+            if storage.name == 'postgresql':
+                storage.executemany('DELETE FROM nutrition WHERE mfp_username = %s;', [(USER,)])
+            print('')
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,173 @@
+import argparse
+import json
+import statistics
+import sys
+import time
+
+from os import path
+
+module_path = path.abspath(path.join(path.dirname( __file__ ), '..'))
+sys.path.append(module_path)
+
+from benchmarks.synthetic import nutrition_frame
+
+FIXTURES_DIR = path.join(path.dirname(path.abspath(__file__)), 'fixtures')
+BASELINES = path.join(path.dirname(path.abspath(__file__)), 'baselines.json')
+# A case regresses when its median is this much slower than the baseline
+THRESHOLD = 0.25
+
+CASES = {}
+
+def case(name):
+    '''
+    Register a benchmark case. The decorated function does the setup and
+    returns the callable that is timed.
+    '''
+    def register(setup):
+        CASES[name] = setup
+        return setup
+    return register
+
+def fixture(filename):
+    with open(path.join(FIXTURES_DIR, filename), 'rb') as f:
+        return f.read()
+
+def callback(name):
+    '''Return the undecorated Dash callback so it can be called outside a request'''
+    import app
+    return getattr(app, name).__wrapped__
+
+def dataset_key(years):
+    '''Store a synthetic dataset of the given length and return its key'''
+    import app
+    from db.dataset_store import prepare_dataset
+    df = nutrition_frame(days=365*years, items_per_day=10)
+    return app.dataset_store.put(prepare_dataset(df))
+
+
+@case('parse_diary')
+def parse_diary():
+    from webscraper.user_data import MFP_User
+    content = fixture('diary.html')
+    user = MFP_User.__new__(MFP_User)
+    return lambda: user._parse_diary(content)
+
+@case('parse_group_members')
+def parse_group_members():
+    from webscraper.GroupScraper import GroupScraper
+    content = fixture('group_members.html')
+    scraper = GroupScraper.__new__(GroupScraper)
+    return lambda: scraper._parse_members(content)
+
+@case('parse_group_list')
+def parse_group_list():
+    from webscraper.GroupScraper import GroupScraper
+    content = fixture('group_list.html')
+    scraper = GroupScraper.__new__(GroupScraper)
+    return lambda: scraper._parse_groups(content)
+
+@case('plot_data_1y')
+def plot_data_1y():
+    key, plot_data = dataset_key(1), callback('plot_data')
+    return lambda: plot_data(key)
+
+@case('plot_data_3y')
+def plot_data_3y():
+    key, plot_data = dataset_key(3), callback('plot_data')
+    return lambda: plot_data(key)
+
+@case('stats_tables_3y')
+def stats_tables_3y():
+    key, stats_tables = dataset_key(3), callback('stats_tables')
+    return lambda: stats_tables(key)
+
+@case('display_tables_3y')
+def display_tables_3y():
+    import app
+    key, display_tables = dataset_key(3), callback('display_tables')
+    days = ['2018-06-%02d' % day for day in range(1, 15)]
+    sort_by = [{'column_id': 'calories', 'direction': 'desc'}]
+
+    def run():
+        # Rebuild the date index as on the first request for a new dataset
+        app.table_sources = type(app.table_sources)()
+        return display_tables(key, days, 0, 25, sort_by, '')
+    return run
+
+
+def measure(func, repeat, min_time=0.2):
+    '''
+    Return the median seconds per call of func over `repeat` samples, each sample
+    running enough calls to last at least min_time / repeat seconds
+    '''
+    func()
+    calls = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(calls):
+            func()
+        if time.perf_counter() - start >= min_time / repeat:
+            break
+        calls *= 2
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(calls):
+            func()
+        samples.append((time.perf_counter() - start) / calls)
+    return statistics.median(samples)
+
+def load_baselines():
+    if not path.exists(BASELINES):
+        return {}
+    with open(BASELINES) as f:
+        return json.load(f)
+
+def run(names=None, repeat=7, threshold=THRESHOLD, update=False):
+    '''
+    Time every case, compare it with the stored baseline and return the names
+    of the cases slower than the baseline by more than `threshold`
+
+    parameters:
+        names (list of str) -- cases to run. Default: all cases
+        repeat (int) -- samples per case
+        threshold (float) -- allowed slowdown as a fraction of the baseline
+        update (bool) -- store the measured times as the new baselines
+    '''
+    baselines = load_baselines()
+    regressions = []
+    for name in names or CASES:
+        seconds = measure(CASES[name](), repeat)
+        baseline = baselines.get(name)
+        if baseline is None:
+            status = 'no baseline'
+        else:
+            change = seconds / baseline - 1
+            status = '%+6.1f%%' % (change*100)
+            if change > threshold:
+                status += '  REGRESSION'
+                regressions.append(name)
+        print('%-22s %10.3f ms  %s' % (name, seconds*1000, status))
+        if update:
+            baselines[name] = seconds
+
+    if update:
+        with open(BASELINES, 'w') as f:
+            json.dump(baselines, f, indent=4, sort_keys=True)
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmark the scrapers, aggregation and dashboard callbacks')
+    parser.add_argument('cases', nargs='*', help='cases to run (default: all of %s)' % ', '.join(CASES))
+    parser.add_argument('--repeat', type=int, default=7, help='samples per case')
+    parser.add_argument('--threshold', type=float, default=THRESHOLD,
+                        help='allowed slowdown over the baseline, as a fraction')
+    parser.add_argument('--update-baselines', action='store_true',
+                        help='store the measured times as the new baselines')
+    args = parser.parse_args()
+
+    regressions = run(args.cases, args.repeat, args.threshold, args.update_baselines)
+    if regressions:
+        print('\nRegressions: %s' % ', '.join(regressions))
+        sys.exit(1)
@@ -0,0 +1,48 @@
+import numpy as np
+import pandas as pd
+
+from datetime import date, datetime, timedelta
+
+from db.storage import NUTRITION_COLUMNS
+
+FOODS = [
+    'Chicken Breast', 'Brown Rice', 'Broccoli', 'Eggs', 'Oatmeal', 'Banana',
+    'Greek Yogurt', 'Almonds', 'Salmon', 'Sweet Potato', 'Protein Bar', 'Apple',
+    'Peanut Butter', 'Whole Wheat Bread', 'Milk', 'Cheddar Cheese', 'Spinach',
+    'Ground Beef', 'Pasta', 'Olive Oil'
+]
+
+def nutrition_rows(user='benchmark_user', date_start='2017-01-01', days=365, items_per_day=8, seed=0):
+    '''
+    Return a list of synthetic nutrition rows ordered as storage.NUTRITION_COLUMNS
+
+    parameters:
+        user (str) -- username stored in every row
+        date_start (str) -- first date of the generated history
+        days (int) -- number of consecutive days to generate
+        items_per_day (int) -- foods logged on each day
+        seed (int) -- random seed so every run produces the same data
+    '''
+    rng = np.random.RandomState(seed)
+    start = datetime.strptime(date_start, '%Y-%m-%d').date()
+    values = rng.randint(0, 500, size=(days*items_per_day, len(NUTRITION_COLUMNS)-3))
+    rows = []
+    for i in range(days*items_per_day):
+        day = datetime.strftime(start + timedelta(i // items_per_day), '%Y-%m-%d')
+        item = '%s %s' % (FOODS[rng.randint(len(FOODS))], i % items_per_day)
+        rows.append((user, day, item) + tuple(int(v) for v in values[i]))
+    return rows
+
+def nutrition_frame(user='benchmark_user', date_start='2017-01-01', days=365, items_per_day=8, seed=0):
+    '''
+    Return synthetic nutrition rows as a dataframe shaped like update_db.return_data output
+
+    parameters:
+        see nutrition_rows()
+    '''
+    df = pd.DataFrame(
+        nutrition_rows(user, date_start, days, items_per_day, seed),
+        columns=NUTRITION_COLUMNS)
+    df.insert(0, 'id', np.arange(1, len(df)+1))
+    df['entry_date'] = pd.to_datetime(df['entry_date'])
+    return df
@@ -1,2 +1,2 @@
 #!/bin/sh
-exec gunicorn -b :80 --access-logfile - --error-logfile - wsgi:app
\ No newline at end of file
+exec gunicorn -c gunicorn.conf.py wsgi:application
\ No newline at end of file
@@ -1,6 +1,15 @@
+import os
 from datetime import timedelta, datetime, date
 
 DB_ONLY_COLS = ['mfp_username', 'entry_date', 'id']
 START_SCRAPE_DATE='2016-01-01'
+# Base url of the food diaries, overridden to point the scrapers at a local stand-in
+MFP_URL = os.environ.get('MFP_URL', 'https://www.myfitnesspal.com')
 YESTERDAY = datetime.strftime((date.today()-timedelta(1)), '%Y-%m-%d')
-TODAY = datetime.strftime(date.today(), '%Y-%m-%d')
\ No newline at end of file
+TODAY = datetime.strftime(date.today(), '%Y-%m-%d')
+TOP_N_FOODS = 3
+# Rows of the most logged foods and biggest calorie sources tables
+FOOD_FREQUENCY_TOP_N = 10
+# Foods listed by the food search
+FOOD_SEARCH_LIMIT = 15
+TABLE_PAGE_SIZE = 25
\ No newline at end of file
@@ -0,0 +1,228 @@
+import numpy as np
+import plotly.graph_objects as go
+
+from dashboard import rollups
+
+# Name and color of each nutrient trace
+TRACE_STYLES = {
+    'protein': ('Protein', '#1C4E80'),
+    'carbohydrates': ('Carbohydrates', '#A5D8DD'),
+    'fat': ('Fat', '#EA6A47'),
+    'fiber': ('Fiber', '#6AB187'),
+    'sugar': ('Sugar', '#7E909A'),
+    'calories': ('Calories', '#202020'),
+}
+LINE_NUTRIENTS = ['protein', 'carbohydrates', 'fat', 'fiber', 'sugar', 'calories']
+BAR_NUTRIENTS = ['protein', 'carbohydrates', 'fat']
+PIE_NUTRIENTS = ['protein', 'carbohydrates', 'fat']
+
+LEGEND = {
+    'orientation': 'h',
+    'xanchor': 'center',
+    'yanchor': 'top',
+    'x': 0.5,
+    'y': 1.1
+}
+
+LINE_LAYOUT = {
+    'yaxis': {'title': 'Grams'},
+    'yaxis2': {
+        'title': 'Calories',
+        'overlaying': 'y',
+        'side': 'right',
+        'showgrid': False
+    },
+    'xaxis': {'showgrid': False},
+    'legend': LEGEND,
+    'plot_bgcolor': 'rgba(0,0,0,0)',
+    'paper_bgcolor': 'rgba(0,0,0,0)',
+    'margin': {'t': 50},
+    'hovermode': 'x'
+}
+
+BAR_LAYOUT = {
+    'yaxis': {'title': 'Grams'},
+    'legend': LEGEND,
+    'showlegend': False,
+    'height': 350,
+    'width': 600,
+    'paper_bgcolor': 'rgba(0,0,0,0)',
+    'plot_bgcolor': 'rgba(0,0,0,0)',
+    'margin': {'l': 50, 'r': 150, 't': 0, 'b': 0},
+}
+
+PIE_LAYOUT = {
+    'showlegend': False,
+    'height': 375,
+    'width': 375,
+    'paper_bgcolor': 'rgba(0,0,0,0)',
+    'plot_bgcolor': 'rgba(0,0,0,0)',
+    'margin': {'l': 125, 'r': 0, 't': 0, 'b': 0}
+}
+
+COHORT_BAND_COLOR = 'rgba(28, 78, 128, 0.2)'
+COHORT_LAYOUT = {
+    'yaxis': {'title': 'Calories'},
+    'xaxis': {'showgrid': False},
+    'legend': LEGEND,
+    'plot_bgcolor': 'rgba(0,0,0,0)',
+    'paper_bgcolor': 'rgba(0,0,0,0)',
+    'margin': {'t': 50},
+    'hovermode': 'x'
+}
+
+
+def _line_trace(nutrient):
+    name, color = TRACE_STYLES[nutrient]
+    trace = {'type': 'scatter', 'name': name, 'line': {'color': color}}
+    if nutrient == 'calories':
+        trace['yaxis'] = 'y2'
+    return go.Scatter(trace)
+
+def _bar_trace(nutrient):
+    name, color = TRACE_STYLES[nutrient]
+    return go.Bar({
+        'name': name,
+        'marker_color': color,
+        'hovertemplate': '%{y} Grams<extra></extra>'
+    })
+
+def _pie_trace():
+    return go.Pie(
+        labels=[TRACE_STYLES[nutrient][0] for nutrient in PIE_NUTRIENTS],
+        textinfo='label+percent',
+        insidetextorientation='radial',
+        hovertemplate='%{value} Calories of %{label}<extra></extra>',
+        marker_colors=[TRACE_STYLES[nutrient][1] for nutrient in PIE_NUTRIENTS])
+
+def _cohort_traces():
+    # The 25th-75th percentile band is drawn by filling the p75 line down to the p25 line
+    return [
+        go.Scatter(name='25th percentile', line={'width': 0}, showlegend=False,
+                   hovertemplate='%{y:.0f}<extra>25th percentile</extra>'),
+        go.Scatter(name='Middle 50% of members', line={'width': 0}, fill='tonexty',
+                   fillcolor=COHORT_BAND_COLOR,
+                   hovertemplate='%{y:.0f}<extra>75th percentile</extra>'),
+        go.Scatter(name='Group median', line={'color': TRACE_STYLES['protein'][1]},
+                   hovertemplate='%{y:.0f} (%{customdata} active members)<extra>Group median</extra>'),
+        go.Scatter(name='Group mean', line={'color': TRACE_STYLES['protein'][1], 'dash': 'dot'},
+                   hovertemplate='%{y:.0f}<extra>Group mean</extra>'),
+        go.Scatter(name='You', line={'color': TRACE_STYLES['calories'][1]},
+                   hovertemplate='%{y:.0f}<extra>You</extra>'),
+    ]
+
+def _validated(traces, layout):
+    '''Return a figure template validated once by plotly, as plain dicts'''
+    return go.Figure(data=traces, layout=layout).to_plotly_json()
+
+_templates = {}
+
+def templates():
+    '''
+    Return the line, bar, pie and cohort figure templates, validating them on first use.
+    Figures are then built by copying a template and injecting the data arrays.
+    '''
+    if not _templates:
+        _templates['line'] = _validated([_line_trace(n) for n in LINE_NUTRIENTS], LINE_LAYOUT)
+        _templates['bar'] = _validated([_bar_trace(n) for n in BAR_NUTRIENTS], BAR_LAYOUT)
+        _templates['pie'] = _validated([_pie_trace()], PIE_LAYOUT)
+        _templates['cohort'] = _validated(_cohort_traces(), COHORT_LAYOUT)
+    return _templates
+
+def _figure(template, data):
+    '''
+    Return a plain dict figure with each template trace updated by the matching data dict.
+    Nested template values are shared between figures, so replace rather than modify them.
+    '''
+    return {
+        'data': [dict(trace, **values) for trace, values in zip(template['data'], data)],
+        'layout': dict(template['layout'])
+    }
+
+BAR_HOVERTEMPLATES = {
+    'day': '%{y} Grams<extra></extra>',
+    'week': '%{y:.0f} Grams/day, week of %{x|%b %d}<extra></extra>',
+    'month': '%{y:.0f} Grams/day in %{x|%b %Y}<extra></extra>',
+}
+
+def x_values(dates):
+    '''Return datetime64 dates as ISO date strings'''
+    return np.datetime_as_string(dates, unit='D').tolist()
+
+def line_figure(series):
+    '''
+    Return the line plot of Protein, Carbs, Fat, Fiber, Sugar and Calories per day
+
+    parameters:
+        series (dict) -- nutrient: (dates, values) as returned by dashboard.rollups.downsample
+    '''
+    return _figure(templates()['line'], [
+        {'x': x_values(series[nutrient][0]), 'y': series[nutrient][1]}
+        for nutrient in LINE_NUTRIENTS])
+
+def bar_figure(totals, resolution='day'):
+    '''
+    Return the bar plot of Protein, Carbs and Fat per day, or their daily
+    average per week or month for long ranges
+
+    parameters:
+        totals (DailyTotals) -- sums from dashboard.aggregation, rolled up to the resolution
+        resolution (str) -- 'day', 'week' or 'month'
+    '''
+    x = x_values(totals.dates)
+    return _figure(templates()['bar'], [
+        {'x': x, 'y': totals.totals[nutrient], 'hovertemplate': BAR_HOVERTEMPLATES[resolution]}
+        for nutrient in BAR_NUTRIENTS])
+
+def pie_figure(daily):
+    '''
+    Return the pie chart of the calories from Protein, Carbs and Fat
+
+    parameters:
+        daily (DailyTotals) -- per-day sums from dashboard.aggregation
+    '''
+    return _figure(templates()['pie'], [
+        {'values': [daily.macro_calories[nutrient] for nutrient in PIE_NUTRIENTS]}])
+
+def build_figures(daily):
+    '''
+    Return the line, bar and pie figures of the dashboard. The number of points
+    sent to the browser is bounded by the chart widths: the line plot is
+    downsampled with LTTB and the bar chart is rolled up to weeks or months.
+
+    parameters:
+        daily (DailyTotals) -- per-day sums from dashboard.aggregation
+    '''
+    series = rollups.downsample(
+        daily, LINE_NUTRIENTS, rollups.max_points(rollups.LINE_CHART_WIDTH, rollups.LINE_PX_PER_POINT))
+
+    span_days = int((daily.dates[-1] - daily.dates[0]).astype(int)) + 1 if len(daily.dates) else 0
+    resolution = rollups.choose_resolution(
+        span_days, rollups.max_points(rollups.BAR_CHART_WIDTH, rollups.BAR_PX_PER_GROUP))
+
+    return line_figure(series), bar_figure(rollups.rollup(daily, resolution), resolution), pie_figure(daily)
+
+def cohort_figure(stats, daily=None, nutrient='calories'):
+    '''
+    Return the line plot of a group's median and mean daily intake with the band
+    of its middle 50% of members, and the user's own intake when given
+
+    parameters:
+        stats (DataFrame) -- group statistics from update_db.return_group_stats
+        daily (DailyTotals) -- per-day sums of the user from dashboard.aggregation
+        nutrient (str) -- one of storage.GROUP_STAT_NUTRIENTS
+    '''
+    x = x_values(stats['entry_date'].values)
+    column = lambda stat: stats['%s_%s' % (nutrient, stat)].tolist()
+    user = {'x': [], 'y': []}
+    if daily is not None and nutrient in daily.totals:
+        user = {'x': x_values(daily.dates), 'y': daily.totals[nutrient]}
+    figure = _figure(templates()['cohort'], [
+        {'x': x, 'y': column('p25')},
+        {'x': x, 'y': column('p75')},
+        {'x': x, 'y': column('p50'), 'customdata': stats['active_members'].tolist()},
+        {'x': x, 'y': column('mean')},
+        user])
+    if nutrient != 'calories':
+        figure['layout']['yaxis'] = dict(figure['layout']['yaxis'], title={'text': 'Grams'})
+    return figure
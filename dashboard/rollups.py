@@ -0,0 +1,130 @@
+import numpy as np
+
+from dashboard.aggregation import DailyTotals
+
+# Plot area widths in pixels and the minimum pixels needed per point.
+# The bar chart has a fixed width (600px less its margins) and three bars per
+# period; the line chart fills its container.
+LINE_CHART_WIDTH = 1100
+LINE_PX_PER_POINT = 2
+BAR_CHART_WIDTH = 400
+BAR_PX_PER_GROUP = 12
+
+# Calendar resolutions tried in order for the bar chart, with their length in days
+RESOLUTIONS = [('day', 1), ('week', 7), ('month', 365.25/12)]
+
+
+def max_points(width, px_per_point):
+    '''Return the number of points that fit in a chart of the given width'''
+    return max(2, int(width // px_per_point))
+
+def choose_resolution(span_days, points):
+    '''
+    Return the finest calendar resolution ('day', 'week' or 'month') that shows
+    the span in at most `points` periods
+
+    parameters:
+        span_days (int) -- number of days between the first and last date
+        points (int) -- maximum number of periods
+    '''
+    for resolution, days in RESOLUTIONS:
+        if span_days / days <= points:
+            return resolution
+    return RESOLUTIONS[-1][0]
+
+def period_starts(dates, resolution):
+    '''
+    Return the first day of the week (Monday) or month containing each date
+
+    parameters:
+        dates (numpy array of datetime64[D]) -- dates to map
+        resolution (str) -- 'day', 'week' or 'month'
+    '''
+    if resolution == 'month':
+        return dates.astype('datetime64[M]').astype('datetime64[D]')
+    if resolution == 'week':
+        days = dates.astype('int64')
+        # 1970-01-01 was a Thursday, so (days + 3) % 7 is the weekday with Monday = 0
+        return (days - (days + 3) % 7).astype('datetime64[D]')
+    return dates
+
+def rollup(daily, resolution):
+    '''
+    Return the average per logged day of every nutrient for each week or month.
+    Daily totals are returned unchanged for the 'day' resolution.
+
+    parameters:
+        daily (DailyTotals) -- per-day sums from dashboard.aggregation
+        resolution (str) -- 'day', 'week' or 'month'
+    '''
+    if resolution == 'day' or len(daily.dates) == 0:
+        return daily
+    periods = period_starts(daily.dates, resolution)
+    # Dates are sorted, so every period is a contiguous run
+    starts = np.flatnonzero(np.r_[True, periods[1:] != periods[:-1]])
+    counts = np.diff(np.r_[starts, len(periods)])
+    totals = {
+        nutrient: np.add.reduceat(values, starts) / counts
+        for nutrient, values in daily.totals.items()
+    }
+    return DailyTotals(periods[starts], totals, daily.macro_calories)
+
+def lttb(x, y, threshold):
+    '''
+    Return the indices of the points kept by Largest-Triangle-Three-Buckets
+    downsampling, which preserves the visual shape (peaks and troughs) of a series.
+    Every column of a 2-D y is downsampled independently over the same buckets,
+    and the returned indices then have one column per series.
+
+    parameters:
+        x (numpy array of numbers) -- sorted x values
+        y (numpy array of numbers) -- y values, one column per series
+        threshold (int) -- number of points to keep
+    '''
+    n = len(x)
+    y = np.asarray(y, dtype=float)
+    if y.ndim == 1:
+        return lttb(x, y[:, None], threshold)[:, 0]
+    columns = np.arange(y.shape[1])
+    if threshold >= n or threshold < 3:
+        return np.repeat(np.arange(n)[:, None], y.shape[1], axis=1)
+
+    x = x.astype(float)
+    indices = np.zeros((threshold, y.shape[1]), dtype=int)
+    # The first and last points are always kept; the rest are split into buckets
+    edges = np.linspace(1, n - 1, threshold - 1).astype(int)
+    a = np.zeros(y.shape[1], dtype=int)
+    for i in range(threshold - 2):
+        start, end = edges[i], edges[i + 1]
+        next_end = edges[i + 2] if i + 2 < len(edges) else n
+        avg_x = x[end:next_end].mean()
+        avg_y = y[end:next_end].mean(axis=0)
+        # Keep the point forming the largest triangle with the previous point
+        # and the average of the next bucket
+        x_a, y_a = x[a], y[a, columns]
+        areas = np.abs(
+            (x_a - avg_x) * (y[start:end] - y_a)
+            - (x_a - x[start:end, None]) * (avg_y - y_a))
+        a = start + np.argmax(areas, axis=0)
+        indices[i + 1] = a
+    indices[-1] = n - 1
+    return indices
+
+def downsample(daily, nutrients, points):
+    '''
+    Return {nutrient: (dates, values)} with each series reduced to at most
+    `points` points by LTTB. Short ranges are returned unchanged.
+
+    parameters:
+        daily (DailyTotals) -- per-day sums from dashboard.aggregation
+        nutrients (list of str) -- nutrients to return
+        points (int) -- maximum number of points per series
+    '''
+    if len(daily.dates) <= points:
+        return {nutrient: (daily.dates, daily.totals[nutrient]) for nutrient in nutrients}
+    values = np.column_stack([daily.totals[nutrient] for nutrient in nutrients])
+    keep = lttb(daily.dates.astype('int64'), values, points)
+    return {
+        nutrient: (daily.dates[keep[:, i]], values[keep[:, i], i])
+        for i, nutrient in enumerate(nutrients)
+    }
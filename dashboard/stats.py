@@ -0,0 +1,63 @@
+import numpy as np
+import pandas as pd
+
+# Nutrients with a "Foods Highest in" table, in the order of the tables on the page
+STATS_NUTRIENTS = ['calories', 'protein', 'carbohydrates', 'fat']
+
+
+def top_foods(df_data, nutrients=STATS_NUTRIENTS, n=3):
+    '''
+    Return the n foods highest in every nutrient, found in one pass over the
+    stacked (rows x nutrients) matrix. Ranges with fewer than n logged foods
+    return every food, and rows without a logged food are ignored.
+
+    Returns a dict of nutrient: list of (item, value) sorted by value, highest first.
+
+    parameters:
+        df_data (DataFrame) -- dataset with item and nutrient columns
+        nutrients (list of str) -- nutrient columns to rank
+        n (int) -- number of foods returned per nutrient
+    '''
+    if 'item' not in df_data.columns or n <= 0:
+        return {nutrient: [] for nutrient in nutrients}
+    items = df_data['item'].to_numpy()
+    # Days without entries are stored with an empty item (filled with 0 by return_data)
+    logged = pd.notna(items) & (items != 0)
+    rows = np.flatnonzero(logged)
+
+    values = df_data.reindex(columns=nutrients).to_numpy(dtype=float, na_value=np.nan)[rows]
+    values[np.isnan(values)] = -np.inf
+    k = min(n, len(rows))
+    if k == 0:
+        return {nutrient: [] for nutrient in nutrients}
+
+    # Unordered top k of every column, then order those k by value (ties by row)
+    top = np.argpartition(-values, k-1, axis=0)[:k]
+    top_values = np.take_along_axis(values, top, axis=0)
+    order = np.lexsort((top, -top_values), axis=0)
+    top = np.take_along_axis(top, order, axis=0)
+
+    result = {}
+    for i, nutrient in enumerate(nutrients):
+        column = df_data[nutrient].to_numpy() if nutrient in df_data.columns else None
+        result[nutrient] = [
+            (items[rows[j]], column[rows[j]])
+            for j in top[:, i] if np.isfinite(values[j, i])
+        ]
+    return result
+
+def ranked_foods(food_totals, column, n):
+    '''
+    Return the n foods with the largest value of the column, highest first (ties by
+    name), as a dataframe with the share of the column total each food accounts for
+
+    parameters:
+        food_totals (DataFrame) -- output of update_db.return_food_totals, indexed by item
+        column (str) -- column the foods are ranked by, e.g. 'entries' or 'calories'
+        n (int) -- number of foods returned
+    '''
+    total = food_totals[column].sum()
+    ranked = food_totals.rename_axis('item').reset_index().sort_values(
+        [column, 'item'], ascending=[False, True]).head(n)
+    ranked['share'] = ranked[column] / total if total else 0.0
+    return ranked.reset_index(drop=True)
@@ -0,0 +1,204 @@
+import math
+import threading
+import numpy as np
+import pandas as pd
+
+from collections import OrderedDict
+
+# Dash DataTable filter operators, longest first so '>=' is matched before '>'
+FILTER_OPERATORS = [
+    ['ge ', '>='],
+    ['le ', '<='],
+    ['lt ', '<'],
+    ['gt ', '>'],
+    ['ne ', '!='],
+    ['eq ', '='],
+    ['contains '],
+    ['datestartswith ']
+]
+
+
+class DateIndexedTable:
+    '''
+    Server-side source of the per-day DataTable. Rows are sorted by entry_date
+    once so the rows of any selected day are a contiguous slice found by binary
+    search, and only the requested page is ever converted to records.
+
+    instance variables:
+        df (DataFrame) -- dataset sorted by entry_date
+        columns (list of str) -- columns shown in the table
+    '''
+    def __init__(self, df_data, hidden_columns=()):
+        self.df = df_data.sort_values('entry_date', kind='mergesort').reset_index(drop=True)
+        self.columns = [col for col in self.df.columns if col not in hidden_columns]
+        self._dates = self.df['entry_date'].to_numpy().astype('datetime64[D]')
+
+    def rows_for_days(self, days):
+        '''
+        Return the row positions of the given days, in the order the days were given
+
+        parameters:
+            days (list of str) -- dates formatted %Y-%m-%d
+        '''
+        days = np.array(days, dtype='datetime64[D]')
+        starts = np.searchsorted(self._dates, days, side='left')
+        ends = np.searchsorted(self._dates, days, side='right')
+        if len(days) == 0:
+            return np.array([], dtype=int)
+        return np.concatenate([np.arange(s, e) for s, e in zip(starts, ends)])
+
+    def page(self, days, filter_query='', sort_by=None, page_current=0, page_size=25):
+        '''
+        Return the records on the requested page and the number of pages
+
+        parameters:
+            days (list of str) -- selected dates formatted %Y-%m-%d
+            filter_query (str) -- DataTable filter_query
+            sort_by (list of dicts) -- DataTable sort_by
+            page_current (int) -- zero based page number
+            page_size (int) -- rows per page
+        '''
+        out_data = self.df.iloc[self.rows_for_days(days)]
+        out_data = apply_filter(out_data, filter_query)
+        if sort_by:
+            out_data = sort_rows(out_data, sort_by)
+        page_count = max(1, math.ceil(len(out_data) / page_size))
+        # A new day selection can leave the current page past the end
+        start = min(page_current or 0, page_count - 1) * page_size
+        page = out_data.iloc[start:start + page_size][self.columns]
+        return page.to_dict('records'), page_count
+
+
+def sort_rows(df, sort_by):
+    '''
+    Return the rows of df in the order of a DataTable sort_by. The sort runs on
+    helper columns holding sort_key of each sorted column, since sort_values only
+    takes a key function from pandas 1.1 on.
+
+    parameters:
+        df (DataFrame) -- rows to sort
+        sort_by (list of dicts) -- DataTable sort_by
+    '''
+    keys = pd.DataFrame({i: sort_key(df[col['column_id']]) for i, col in enumerate(sort_by)}, index=df.index)
+    keys = keys.reset_index(drop=True).sort_values(
+        list(range(len(sort_by))),
+        ascending=[col['direction'] == 'asc' for col in sort_by],
+        kind='mergesort')
+    return df.iloc[keys.index]
+
+def sort_key(column):
+    '''
+    Return the column as sorted by the table. Text columns are compared as strings,
+    since days without logged food hold 0 in place of a food name.
+
+    parameters:
+        column (Series) -- column to sort on
+    '''
+    if column.dtype == object:
+        return column.astype(str)
+    return column
+
+def filter_value(column, value):
+    '''
+    Return the filter value converted to the type of the column, or None if the
+    clause cannot apply to the column, e.g. "{calories} < abc"
+
+    parameters:
+        column (Series) -- filtered column
+        value (float or str) -- value returned by split_filter_part
+    '''
+    if pd.api.types.is_numeric_dtype(column):
+        value = pd.to_numeric(value, errors='coerce')
+    elif pd.api.types.is_datetime64_any_dtype(column):
+        value = pd.to_datetime(value, errors='coerce') if isinstance(value, str) else pd.NaT
+    else:
+        return value if isinstance(value, str) else '%g' % value
+    return None if pd.isna(value) else value
+
+def split_filter_part(filter_part):
+    '''
+    Split one clause of a DataTable filter_query into (column, operator, value)
+
+    parameters:
+        filter_part (str) -- clause such as "{calories} > 100"
+    '''
+    for operator_type in FILTER_OPERATORS:
+        for operator in operator_type:
+            if operator in filter_part:
+                name_part, value_part = filter_part.split(operator, 1)
+                name = name_part[name_part.find('{') + 1: name_part.rfind('}')]
+
+                value_part = value_part.strip()
+                v0 = value_part[0] if value_part else ''
+                if v0 and v0 == value_part[-1] and v0 in ("'", '"', '`'):
+                    value = value_part[1: -1].replace('\\' + v0, v0)
+                else:
+                    try:
+                        value = float(value_part)
+                    except ValueError:
+                        value = value_part
+
+                return name, operator_type[0].strip(), value
+
+    return None, None, None
+
+def apply_filter(df, filter_query):
+    '''
+    Return the rows of df matching every clause of a DataTable filter_query.
+    Clauses on unknown columns or with a value of the wrong type are skipped.
+
+    parameters:
+        df (DataFrame) -- rows to filter
+        filter_query (str) -- DataTable filter_query
+    '''
+    if not filter_query:
+        return df
+    for filter_part in filter_query.split(' && '):
+        col_name, operator, value = split_filter_part(filter_part)
+        if col_name not in df.columns:
+            continue
+        if operator in ('eq', 'ne', 'lt', 'le', 'gt', 'ge'):
+            value = filter_value(df[col_name], value)
+            if value is None:
+                continue
+            column = df[col_name].astype(str) if df[col_name].dtype == object else df[col_name]
+            df = df.loc[getattr(column, operator)(value)]
+        elif operator == 'contains':
+            df = df.loc[df[col_name].astype(str).str.contains(str(value), case=False, regex=False)]
+        elif operator == 'datestartswith':
+            df = df.loc[df[col_name].astype(str).str.startswith(str(value))]
+    return df
+
+
+class TableSourceCache:
+    '''
+    Keeps the DateIndexedTable of the most recently viewed datasets so paging,
+    sorting and filtering do not rebuild the date index on every request.
+
+    instance variables:
+        max_entries (int) -- number of table sources kept
+    '''
+    def __init__(self, max_entries=8):
+        self.max_entries = max_entries
+        self._sources = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, data_key, load, hidden_columns=()):
+        '''
+        Return the table source of the dataset, building it on first use
+
+        parameters:
+            data_key (str) -- dataset key
+            load (callable) -- returns the dataset of data_key
+            hidden_columns (list of str) -- columns not shown in the table
+        '''
+        with self._lock:
+            if data_key in self._sources:
+                self._sources.move_to_end(data_key)
+                return self._sources[data_key]
+        source = DateIndexedTable(load(data_key), hidden_columns)
+        with self._lock:
+            self._sources[data_key] = source
+            while len(self._sources) > self.max_entries:
+                self._sources.popitem(last=False)
+        return source
@@ -0,0 +1,161 @@
+import threading
+import pandas as pd
+
+from collections import OrderedDict
+
+# Default limits of the query result cache in front of update_db.return_data
+MAX_ENTRIES = 128
+MAX_BYTES = 64 * 1024 * 1024
+
+
+class QueryCache:
+    '''
+    LRU cache of nutrition range reads keyed by (user, date_start, date_end).
+
+    A lookup is served from any cached entry of the same user whose range covers
+    the requested one, so repeat views and narrowed ranges skip the database.
+    Entries are evicted least recently used first once either the entry count or
+    the total in-memory size of the cached dataframes exceeds its limit, and
+    invalidate() drops every entry of a user that overlaps newly written dates.
+
+    The cache lives in the process that created it, so invalidate() only reaches
+    that process. Entries are therefore stamped with the user's version from the
+    user_versions table, which every ingest bumps, and an entry read under an older
+    version than the one passed to get() is dropped as stale.
+
+    instance variables:
+        max_entries (int) -- maximum number of cached ranges
+        max_bytes (int) -- maximum total size in bytes of the cached dataframes
+        stats (dict) -- counters for hits, misses, evictions and invalidations
+    '''
+    def __init__(self, max_entries=MAX_ENTRIES, max_bytes=MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._sizes = {}
+        self._versions = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'evictions': 0, 'invalidations': 0}
+
+    def get(self, user, date_start, date_end, version=None):
+        '''
+        Return a copy of the cached rows for the user between the given dates,
+        or None if no cached range covers them.
+
+        parameters:
+            user (str) -- username
+            date_start (str) -- start date formatted %Y-%m-%d
+            date_end (str) -- end date formatted %Y-%m-%d
+            version (int) -- current version of the user. Entries of other versions are dropped
+        '''
+        with self._lock:
+            if version is not None:
+                stale = [key for key in self._entries if key[0] == user and self._versions[key] != version]
+                for key in stale:
+                    self._remove(key)
+                self.stats['invalidations'] += len(stale)
+            key = (user, date_start, date_end)
+            if key in self._entries:
+                df = self._entries[key]
+            else:
+                key = self._covering_key(user, date_start, date_end)
+                df = self._entries[key] if key is not None else None
+            if df is None:
+                self.stats['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats['hits'] += 1
+
+        if key[1:] == (date_start, date_end):
+            return df.copy()
+        # Slice the covering entry down to the requested range
+        dates = pd.to_datetime(df['entry_date'])
+        mask = (dates >= pd.Timestamp(date_start)) & (dates <= pd.Timestamp(date_end))
+        return df.loc[mask].reset_index(drop=True)
+
+    def put(self, user, date_start, date_end, df, version=None):
+        '''
+        Cache the rows read for the user between the given dates
+
+        parameters:
+            user (str) -- username
+            date_start (str) -- start date formatted %Y-%m-%d
+            date_end (str) -- end date formatted %Y-%m-%d
+            df (DataFrame) -- rows returned by the storage backend
+            version (int) -- version of the user read before the rows
+        '''
+        size = int(df.memory_usage(index=True, deep=True).sum())
+        if size > self.max_bytes:
+            return
+        key = (user, date_start, date_end)
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = df.copy()
+            self._sizes[key] = size
+            self._versions[key] = version
+            self._bytes += size
+            while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self.stats['evictions'] += 1
+
+    def invalidate(self, user, date_start=None, date_end=None):
+        '''
+        Drop every cached range of the user that overlaps the given dates.
+        Without dates, every range of the user is dropped.
+
+        parameters:
+            user (str) -- username
+            date_start (str) -- first written date formatted %Y-%m-%d
+            date_end (str) -- last written date formatted %Y-%m-%d
+        '''
+        with self._lock:
+            stale = [
+                key for key in self._entries
+                if key[0] == user
+                and (date_end is None or key[1] <= date_end)
+                and (date_start is None or key[2] >= date_start)
+            ]
+            for key in stale:
+                self._remove(key)
+            self.stats['invalidations'] += len(stale)
+
+    def clear(self):
+        '''Drop every cached range'''
+        with self._lock:
+            self._entries.clear()
+            self._sizes.clear()
+            self._versions.clear()
+            self._bytes = 0
+
+    def hit_rate(self):
+        '''Return the fraction of lookups served from the cache'''
+        lookups = self.stats['hits'] + self.stats['misses']
+        return self.stats['hits'] / lookups if lookups else 0.0
+
+    def report(self):
+        '''Return the cache counters together with its current size and hit rate'''
+        with self._lock:
+            report = dict(self.stats)
+            report.update({
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'hit_rate': self.hit_rate()
+            })
+        return report
+
+    def _covering_key(self, user, date_start, date_end):
+        '''Return the most recently used key of the user whose range covers the given dates'''
+        for key in reversed(self._entries):
+            if key[0] == user and key[1] <= date_start and key[2] >= date_end:
+                return key
+        return None
+
+    def _remove(self, key):
+        del self._entries[key]
+        del self._versions[key]
+        self._bytes -= self._sizes.pop(key)
+
+
+query_cache = QueryCache()
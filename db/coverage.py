@@ -0,0 +1,129 @@
+from datetime import datetime, timedelta
+
+from db.storage import get_storage, to_date_string
+
+# Longest interval scraped at once, so long backfills are recorded in steps
+MAX_SCRAPE_DAYS = 365
+
+
+def _day(value):
+    return datetime.strptime(value, '%Y-%m-%d').date()
+
+def _string(day):
+    return datetime.strftime(day, '%Y-%m-%d')
+
+def merge_intervals(intervals):
+    '''
+    Return the union of the date intervals as a sorted list of disjoint intervals.
+    Overlapping and adjacent intervals are merged.
+
+    parameters:
+        intervals (iterable of tuples) -- (date_start, date_end) formatted %Y-%m-%d, inclusive
+    '''
+    merged = []
+    for start, end in sorted((_day(start), _day(end)) for start, end in intervals):
+        if merged and start <= merged[-1][1] + timedelta(1):
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return [(_string(start), _string(end)) for start, end in merged]
+
+def missing_intervals(covered, date_start, date_end):
+    '''
+    Return the intervals between the given dates that are not covered
+
+    parameters:
+        covered (list of tuples) -- disjoint sorted intervals, as returned by merge_intervals
+        date_start (str) -- first date formatted %Y-%m-%d
+        date_end (str) -- last date formatted %Y-%m-%d
+    '''
+    start, end = _day(date_start), _day(date_end)
+    gaps = []
+    for covered_start, covered_end in covered:
+        covered_start, covered_end = _day(covered_start), _day(covered_end)
+        if covered_end < start:
+            continue
+        if covered_start > end:
+            break
+        if covered_start > start:
+            gaps.append((start, covered_start - timedelta(1)))
+        start = max(start, covered_end + timedelta(1))
+    if start <= end:
+        gaps.append((start, end))
+    return [(_string(gap_start), _string(gap_end)) for gap_start, gap_end in gaps]
+
+def covered_days(covered, date_start, date_end):
+    '''
+    Return every covered date between the given dates formatted %Y-%m-%d
+
+    parameters:
+        covered (list of tuples) -- disjoint sorted intervals, as returned by merge_intervals
+        date_start (str) -- first date formatted %Y-%m-%d
+        date_end (str) -- last date formatted %Y-%m-%d
+    '''
+    days = []
+    for covered_start, covered_end in covered:
+        start = max(_day(covered_start), _day(date_start))
+        end = min(_day(covered_end), _day(date_end))
+        days.extend(_string(start + timedelta(i)) for i in range((end - start).days + 1))
+    return days
+
+def split_interval(date_start, date_end, max_days=MAX_SCRAPE_DAYS):
+    '''
+    Return the interval split into consecutive intervals of at most max_days, newest first
+
+    parameters:
+        date_start (str) -- first date formatted %Y-%m-%d
+        date_end (str) -- last date formatted %Y-%m-%d
+        max_days (int) -- maximum length of each interval
+    '''
+    start, end = _day(date_start), _day(date_end)
+    chunks = []
+    while end >= start:
+        chunk_start = max(start, end - timedelta(max_days - 1))
+        chunks.append((_string(chunk_start), _string(end)))
+        end = chunk_start - timedelta(1)
+    return chunks
+
+def user_coverage(user, first_date, storage=None):
+    '''
+    Return the merged intervals already scraped for the user. Users ingested before
+    coverage was recorded were scraped from first_date through their last stored entry.
+
+    parameters:
+        user (str) -- username
+        first_date (str) -- start date of the legacy full history scrape
+        storage (Storage) -- storage backend. Default: get_storage()
+    '''
+    storage = storage or get_storage()
+    covered = storage.read_coverage(user)
+    if not covered:
+        last_entry = storage.last_entry_date(user)
+        if last_entry is not None and last_entry >= first_date:
+            covered = [(first_date, last_entry)]
+    return merge_intervals(covered)
+
+def add_coverage(user, intervals, covered, storage=None):
+    '''
+    Record the intervals as scraped for the user, merged with the intervals covered
+    before the scrape. These are read before the scraped rows are written, since the
+    legacy fallback of user_coverage would count the new rows as a full history.
+
+    parameters:
+        user (str) -- username
+        intervals (list of tuples) -- (date_start, date_end) scraped, formatted %Y-%m-%d, inclusive
+        covered (list of tuples) -- output of user_coverage before the scrape was written
+        storage (Storage) -- storage backend. Default: get_storage()
+    '''
+    if not intervals:
+        return
+    storage = storage or get_storage()
+    storage.replace_coverage(user, merge_intervals(list(covered) + list(intervals)))
+
+def today():
+    '''Return the current date formatted %Y-%m-%d'''
+    return to_date_string(datetime.today())
+
+def yesterday():
+    '''Return the previous date formatted %Y-%m-%d'''
+    return to_date_string(datetime.today() - timedelta(1))
@@ -0,0 +1,148 @@
+import os
+import re
+import tempfile
+import threading
+import time
+import uuid
+import pandas as pd
+
+from collections import OrderedDict
+
+# Default location and limits of the dataset store shared by the dashboard workers
+STORE_DIR = os.path.join(tempfile.gettempdir(), 'mfp-dash-datasets')
+TTL = 60 * 60
+MAX_BYTES = 512 * 1024 * 1024
+MEMORY_ENTRIES = 32
+
+KEY_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+
+
+class DatasetStore:
+    '''
+    Server-side store for the dataframes behind a dashboard session.
+
+    The browser only holds the key returned by put(). Datasets are written as
+    pickles to a directory shared by every gunicorn worker on the host, and the
+    most recently used ones are also kept in memory by each worker. Datasets
+    expire `ttl` seconds after they were written, and the oldest files are
+    removed once the directory grows past `max_bytes`.
+
+    instance variables:
+        directory (str) -- directory holding the pickled datasets
+        ttl (int) -- lifetime of a dataset in seconds
+        max_bytes (int) -- maximum total size of the pickled datasets
+        memory_entries (int) -- number of datasets kept in memory by this process
+    '''
+    def __init__(self, directory=STORE_DIR, ttl=TTL, max_bytes=MAX_BYTES, memory_entries=MEMORY_ENTRIES):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.memory_entries = memory_entries
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+
+    def put(self, df):
+        '''
+        Store the dataframe and return the key used to load it
+
+        parameters:
+            df (DataFrame) -- dataset to store
+        '''
+        key = uuid.uuid4().hex
+        path = self._path(key)
+        # Write to a temporary file first so other workers never read a partial pickle
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        os.close(fd)
+        df.to_pickle(tmp_path)
+        os.replace(tmp_path, path)
+        self._remember(key, df, time.time() + self.ttl)
+        self.evict()
+        return key
+
+    def get(self, key):
+        '''
+        Return the dataset stored under the key, or None if it is unknown or expired.
+        The returned dataframe is shared, so callers must not modify it in place.
+
+        parameters:
+            key (str) -- key returned by put()
+        '''
+        if not key or not KEY_PATTERN.match(key):
+            return None
+        now = time.time()
+        with self._lock:
+            if key in self._memory:
+                df, expires = self._memory[key]
+                if expires > now:
+                    self._memory.move_to_end(key)
+                    return df
+                del self._memory[key]
+
+        path = self._path(key)
+        try:
+            expires = os.path.getmtime(path) + self.ttl
+            if expires <= now:
+                os.remove(path)
+                return None
+            df = pd.read_pickle(path)
+        except (OSError, EOFError):
+            return None
+        self._remember(key, df, expires)
+        return df
+
+    def evict(self):
+        '''
+        Remove expired datasets, then the oldest ones until the store fits in max_bytes
+        '''
+        now = time.time()
+        files = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            if stat.st_mtime + self.ttl <= now:
+                self._remove_file(path)
+            elif name.endswith('.pkl'):
+                files.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_bytes:
+                break
+            self._remove_file(path)
+            total -= size
+
+        with self._lock:
+            for key in [k for k, (_, expires) in self._memory.items() if expires <= now]:
+                del self._memory[key]
+
+    def _remember(self, key, df, expires):
+        with self._lock:
+            self._memory[key] = (df, expires)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_entries:
+                self._memory.popitem(last=False)
+
+    def _remove_file(self, path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def _path(self, key):
+        return os.path.join(self.directory, '%s.pkl' % key)
+
+
+def prepare_dataset(df):
+    '''
+    Return the query output with entry_date parsed once, so callbacks can use it directly
+
+    parameters:
+        df (DataFrame) -- output of update_db.return_data
+    '''
+    df = df.copy()
+    df['entry_date'] = pd.to_datetime(df['entry_date']).dt.normalize()
+    return df
@@ -0,0 +1,122 @@
+import pandas as pd
+
+from datetime import datetime, timedelta
+
+from db.storage import get_storage, to_date_string, FOOD_FREQUENCY_COLUMNS
+
+# Counts and sums summed over a period by food_totals
+TOTAL_COLUMNS = FOOD_FREQUENCY_COLUMNS[3:]
+
+
+def _day(value):
+    return datetime.strptime(value, '%Y-%m-%d').date()
+
+def month_start(value):
+    '''
+    Return the first day of the month of the date formatted %Y-%m-%d
+
+    parameters:
+        value (str) -- date formatted %Y-%m-%d
+    '''
+    return value[:8] + '01'
+
+def month_end(value):
+    '''
+    Return the last day of the month of the date formatted %Y-%m-%d
+
+    parameters:
+        value (str) -- date formatted %Y-%m-%d
+    '''
+    next_month = (_day(month_start(value)) + timedelta(32)).replace(day=1)
+    return to_date_string(next_month - timedelta(1))
+
+def summarize(user, daily):
+    '''
+    Return one food_frequency row per month and food (ordered as
+    storage.FOOD_FREQUENCY_COLUMNS) from the per-day totals of each food
+
+    parameters:
+        user (str) -- username
+        daily (DataFrame) -- output of Storage.food_daily_totals
+    '''
+    if daily.empty:
+        return []
+    months = pd.to_datetime(daily['entry_date']).dt.to_period('M').dt.start_time
+    grouped = daily[TOTAL_COLUMNS[:1] + TOTAL_COLUMNS[2:]].fillna(0).astype('int64').groupby(
+        [months.values, daily['item'].values])
+    totals = grouped.sum()
+    # Each row of the daily totals is one day the food was logged
+    totals.insert(1, 'days', grouped.size())
+    return [
+        (user, to_date_string(month), item) + tuple(int(value) for value in values)
+        for (month, item), values in zip(totals.index, totals.itertuples(index=False))
+    ]
+
+def refresh_user(user, date_start, date_end, storage=None):
+    '''
+    Recompute the food frequency rows of the months overlapping the given dates from
+    the user's nutrition rows and return the number of rows written. Called after
+    every ingest, so only the touched months of the user are rewritten.
+
+    parameters:
+        user (str) -- username whose rows were written
+        date_start (str) -- first written date formatted %Y-%m-%d
+        date_end (str) -- last written date formatted %Y-%m-%d
+        storage (Storage) -- storage backend. Default: get_storage()
+    '''
+    storage = storage or get_storage()
+    first, last = month_start(date_start), month_start(date_end)
+    rows = summarize(user, storage.food_daily_totals(user, first, month_end(date_end)))
+    return storage.replace_food_frequency(user, first, last, rows)
+
+def food_totals(user, date_start, date_end, storage=None):
+    '''
+    Return the entries, days logged and nutrient sums of every food the user logged
+    between the given dates, as a dataframe indexed by item. Whole months are read
+    from food_frequency, so only the partial months at the ends of the range are
+    summed from the nutrition rows.
+
+    parameters:
+        user (str) -- username
+        date_start (str) -- first date formatted %Y-%m-%d
+        date_end (str) -- last date formatted %Y-%m-%d
+        storage (Storage) -- storage backend. Default: get_storage()
+    '''
+    storage = storage or get_storage()
+    parts = []
+    first_full = date_start if date_start == month_start(date_start) else \
+        to_date_string(_day(month_end(date_start)) + timedelta(1))
+    last_full = date_end if date_end == month_end(date_end) else \
+        to_date_string(_day(month_start(date_end)) - timedelta(1))
+    if first_full <= last_full:
+        parts.append(storage.read_food_frequency(user, first_full, month_start(last_full)))
+        edges = [(date_start, to_date_string(_day(first_full) - timedelta(1))),
+                 (to_date_string(_day(last_full) + timedelta(1)), date_end)]
+    else:
+        edges = [(date_start, date_end)]
+    for edge_start, edge_end in edges:
+        if edge_start <= edge_end:
+            daily = storage.food_daily_totals(user, edge_start, edge_end)
+            daily.insert(3, 'days', 1)
+            parts.append(daily.drop(columns='entry_date'))
+
+    totals = pd.concat(parts, ignore_index=True) if parts else pd.DataFrame(columns=['item'] + TOTAL_COLUMNS)
+    totals = totals.reindex(columns=['item'] + TOTAL_COLUMNS)
+    totals[TOTAL_COLUMNS] = totals[TOTAL_COLUMNS].fillna(0).astype('int64')
+    return totals.groupby('item')[TOTAL_COLUMNS].sum()
+
+def rebuild_users(users, storage=None):
+    '''
+    Recompute the whole food frequency history of the users, used to fill
+    food_frequency for rows ingested before it existed
+
+    parameters:
+        users (iterable of str) -- usernames
+        storage (Storage) -- storage backend. Default: get_storage()
+    '''
+    storage = storage or get_storage()
+    for user in users:
+        first = storage.fetchall('SELECT MIN(entry_date) FROM nutrition WHERE mfp_username = %s;', (user,))
+        last = storage.last_entry_date(user)
+        if last is not None:
+            refresh_user(user, to_date_string(first[0][0]), last, storage)
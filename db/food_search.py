@@ -0,0 +1,212 @@
+import bisect
+import re
+import threading
+import time
+import unicodedata
+import numpy as np
+
+from db.storage import get_storage, FOOD_STAT_NUTRIENTS
+
+# Candidates of a fuzzy query need this trigram similarity to the query (as pg_trgm)
+SIMILARITY_THRESHOLD = 0.3
+# Seconds before the names are reloaded to pick up foods logged by other processes
+REFRESH_SECONDS = 600
+# Ranking scores of names starting with the query and of names with words starting
+# with every query word; fuzzy matches score their trigram similarity, below these
+NAME_PREFIX_SCORE = 2.0
+WORD_PREFIX_SCORE = 1.5
+
+# Any run of characters that are not letters or digits of any script
+NON_WORD = re.compile(r'[\W_]+')
+
+
+def normalize(name):
+    '''
+    Return the case-folded words of a food name separated by single spaces. Accents
+    are removed by NFKD decomposition, so "Crème Brûlée" and "creme brulee" match,
+    and letters of other scripts are kept.
+
+    parameters:
+        name (str) -- food name
+    '''
+    decomposed = unicodedata.normalize('NFKD', name.casefold())
+    folded = ''.join(char for char in decomposed if not unicodedata.combining(char))
+    return NON_WORD.sub(' ', folded).strip()
+
+def trigrams(text):
+    '''
+    Return the set of trigrams of the words of normalized text, each word padded
+    with two spaces in front and one behind as pg_trgm does
+
+    parameters:
+        text (str) -- normalized text
+    '''
+    grams = set()
+    for word in text.split():
+        padded = '  %s ' % word
+        grams.update(padded[i:i+3] for i in range(len(padded) - 2))
+    return grams
+
+
+class FoodSearchIndex:
+    '''
+    In-memory inverted index over the distinct food names logged by every user.
+
+    Prefix queries look up the sorted words of all names by binary search, and fuzzy
+    queries count the trigrams each name shares with the query from the trigram
+    postings, so neither scans the names.
+
+    instance variables:
+        names (list of str) -- indexed food names
+        built_at (float) -- epoch time the index was built
+    '''
+    def __init__(self, names):
+        self.names = sorted(set(name for name in names if name))
+        self.built_at = time.time()
+        self._name_set = set(self.names)
+        normalized = [normalize(name) for name in self.names]
+        self._normalized = normalized
+        self._words = sorted(
+            (word, i) for i, text in enumerate(normalized) for word in set(text.split()))
+        postings = {}
+        self._gram_counts = np.zeros(len(self.names), dtype=np.int32)
+        for i, text in enumerate(normalized):
+            grams = trigrams(text)
+            self._gram_counts[i] = len(grams)
+            for gram in grams:
+                postings.setdefault(gram, []).append(i)
+        self._postings = {gram: np.array(ids, dtype=np.int32) for gram, ids in postings.items()}
+
+    def __contains__(self, name):
+        return name in self._name_set
+
+    def _word_prefix(self, prefix):
+        # Names with a word starting with the prefix
+        ids = set()
+        i = bisect.bisect_left(self._words, (prefix,))
+        while i < len(self._words) and self._words[i][0].startswith(prefix):
+            ids.add(self._words[i][1])
+            i += 1
+        return ids
+
+    def prefix_matches(self, query):
+        '''
+        Return {name index: score} of the names with a word starting with every query word
+
+        parameters:
+            query (str) -- normalized query
+        '''
+        words = query.split()
+        if not words:
+            return {}
+        ids = self._word_prefix(words[0])
+        for word in words[1:]:
+            ids &= self._word_prefix(word)
+        return {
+            i: NAME_PREFIX_SCORE if self._normalized[i].startswith(query) else WORD_PREFIX_SCORE
+            for i in ids
+        }
+
+    def fuzzy_matches(self, query, threshold=SIMILARITY_THRESHOLD):
+        '''
+        Return {name index: similarity} of the names whose trigram similarity to the
+        query is at least the threshold
+
+        parameters:
+            query (str) -- normalized query
+            threshold (float) -- minimum similarity
+        '''
+        grams = trigrams(query)
+        arrays = [self._postings[gram] for gram in grams if gram in self._postings]
+        if not arrays:
+            return {}
+        shared = np.bincount(np.concatenate(arrays), minlength=len(self.names))
+        candidates = np.flatnonzero(shared)
+        similarity = shared[candidates] / (len(grams) + self._gram_counts[candidates] - shared[candidates])
+        keep = similarity >= threshold
+        return dict(zip(candidates[keep].tolist(), similarity[keep].tolist()))
+
+    def search(self, query, limit=20, fuzzy=True):
+        '''
+        Return up to limit (name, score) pairs matching the query, best first. Prefix
+        matches rank above fuzzy matches; ties are broken by the shorter name.
+
+        parameters:
+            query (str) -- food name or its beginning, possibly misspelled
+            limit (int) -- maximum number of names returned
+            fuzzy (bool) -- include names similar to the query
+        '''
+        query = normalize(query)
+        if not query or not self.names:
+            return []
+        scores = self.fuzzy_matches(query) if fuzzy else {}
+        scores.update(self.prefix_matches(query))
+        best = sorted(scores.items(), key=lambda item: (-item[1], len(self.names[item[0]]), self.names[item[0]]))
+        return [(self.names[i], score) for i, score in best[:limit]]
+
+
+_index = None
+_index_lock = threading.Lock()
+_refreshing = False
+
+def get_index(storage=None):
+    '''
+    Return the search index of this process. It is built on first use and rebuilt in
+    the background, while the previous one keeps serving queries, once it is older
+    than REFRESH_SECONDS.
+
+    parameters:
+        storage (Storage) -- storage backend. Default: get_storage()
+    '''
+    global _index, _refreshing
+    storage = storage or get_storage()
+    with _index_lock:
+        if _index is None:
+            _index = FoodSearchIndex(storage.distinct_food_items())
+        elif time.time() - _index.built_at > REFRESH_SECONDS and not _refreshing:
+            _refreshing = True
+            threading.Thread(target=_rebuild, args=(storage,), daemon=True).start()
+        return _index
+
+def _rebuild(storage):
+    global _index, _refreshing
+    try:
+        index = FoodSearchIndex(storage.distinct_food_items())
+        with _index_lock:
+            _index = index
+    except Exception as error:
+        print(error)
+    finally:
+        with _index_lock:
+            _refreshing = False
+
+def add_items(names):
+    '''
+    Mark the index stale if any of the newly ingested food names is not indexed yet,
+    so the next query rebuilds it in the background
+
+    parameters:
+        names (iterable of str) -- food names written by an ingest
+    '''
+    index = _index
+    if index is not None and any(name not in index for name in names):
+        index.built_at = 0
+
+def search(query, limit=20, storage=None):
+    '''
+    Return the foods matching the query, best first, with the number of users who
+    logged them, their entries and their average nutrients per entry, as a dataframe
+
+    parameters:
+        query (str) -- food name or its beginning, possibly misspelled
+        limit (int) -- maximum number of foods returned
+        storage (Storage) -- storage backend. Default: get_storage()
+    '''
+    storage = storage or get_storage()
+    matches = get_index(storage).search(query, limit)
+    stats = storage.food_item_stats([name for name, _ in matches]).set_index('item')
+    results = stats.reindex([name for name, _ in matches])
+    results.insert(0, 'score', [score for _, score in matches])
+    for nutrient in FOOD_STAT_NUTRIENTS:
+        results[nutrient] = (results[nutrient] / results['entries']).round(1)
+    return results.rename_axis('item').reset_index()
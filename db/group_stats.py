@@ -0,0 +1,118 @@
+import pandas as pd
+
+from db.coverage import merge_intervals, split_interval
+from db.storage import (
+    get_storage, to_date_string,
+    DAILY_TOTAL_COLUMNS, GROUP_STAT_NUTRIENTS, GROUP_STAT_PERCENTILES
+)
+
+# Date bounds used to rebuild the whole history of a group
+FIRST_DATE = '0001-01-01'
+LAST_DATE = '9999-12-31'
+# Longest run of changed days recomputed by one query per group
+REFRESH_CHUNK_DAYS = 92
+
+
+def summarize(group_name, member_totals, members):
+    '''
+    Return one group_daily_stats row per day (ordered as storage.GROUP_STAT_COLUMNS)
+    with the number of active members and the mean and percentiles of their
+    daily totals. Days without an active member are left out.
+
+    parameters:
+        group_name (str) -- group name
+        member_totals (DataFrame) -- output of Storage.group_member_daily_totals
+        members (int) -- number of members of the group
+    '''
+    if member_totals.empty:
+        return []
+    dates = pd.to_datetime(member_totals['entry_date']).dt.normalize()
+    grouped = member_totals[GROUP_STAT_NUTRIENTS].astype(float).groupby(dates.values)
+    means = grouped.mean()
+    quantiles = grouped.quantile([p / 100 for p in GROUP_STAT_PERCENTILES]).unstack()
+
+    stats = pd.DataFrame({'active_members': grouped.size()})
+    for nutrient in GROUP_STAT_NUTRIENTS:
+        stats['%s_mean' % nutrient] = means[nutrient]
+        for p in GROUP_STAT_PERCENTILES:
+            stats['%s_p%s' % (nutrient, p)] = quantiles[(nutrient, p / 100)]
+    # Plain Python values, with None for nutrients no active member logged
+    stats = stats.astype(object).where(stats.notna(), None)
+
+    return [
+        (group_name, to_date_string(day), members, int(values[0])) + tuple(values[1:])
+        for day, values in zip(stats.index, stats.itertuples(index=False))
+    ]
+
+def refresh_group(group_name, date_start=FIRST_DATE, date_end=LAST_DATE, storage=None):
+    '''
+    Recompute the stored statistics of the group between the given dates from
+    its members' nutrition rows and return the number of days written
+
+    parameters:
+        group_name (str) -- group name
+        date_start (str) -- first date to refresh formatted %Y-%m-%d. Default: whole history
+        date_end (str) -- last date to refresh formatted %Y-%m-%d. Default: whole history
+        storage (Storage) -- storage backend. Default: get_storage()
+    '''
+    storage = storage or get_storage()
+    members = storage.group_member_count(group_name)
+    member_totals = storage.group_member_daily_totals(group_name, date_start, date_end)
+    rows = summarize(group_name, member_totals, members)
+    return storage.replace_group_daily_stats(group_name, date_start, date_end, rows)
+
+def changed_days(before, after):
+    '''
+    Return the sorted dates formatted %Y-%m-%d on which the user's daily totals
+    differ, including days that gained or lost every row
+
+    parameters:
+        before (DataFrame) -- output of Storage.daily_totals before the rows were written
+        after (DataFrame) -- output of Storage.daily_totals after the rows were written
+    '''
+    def by_day(totals):
+        totals = totals.set_index(totals['entry_date'].map(to_date_string))[DAILY_TOTAL_COLUMNS]
+        return totals.astype(float).round(6)
+    before, after = by_day(before), by_day(after)
+    days = before.index.union(after.index)
+    before, after = before.reindex(days), after.reindex(days)
+    # Days missing on one side are all NaN there, so they compare as changed
+    same = ((before == after) | (before.isna() & after.isna())).all(axis=1)
+    same &= before.notna().any(axis=1) == after.notna().any(axis=1)
+    return sorted(days[~same.to_numpy()])
+
+def refresh_user_groups(user, before, after, storage=None):
+    '''
+    Recompute the statistics of every group of the user on the days whose daily
+    totals of the user changed with newly written rows. The statistics of other
+    days cannot have changed, so runs of changed days are recomputed in chunks of
+    at most REFRESH_CHUNK_DAYS and an unchanged re-scrape writes nothing.
+
+    parameters:
+        user (str) -- username whose rows were written
+        before (DataFrame) -- output of Storage.daily_totals over the written dates,
+            read before the rows were written
+        after (DataFrame) -- output of Storage.daily_totals over the same dates afterwards
+        storage (Storage) -- storage backend. Default: get_storage()
+    '''
+    storage = storage or get_storage()
+    days = changed_days(before, after)
+    if not days:
+        return
+    chunks = [chunk for run_start, run_end in merge_intervals((day, day) for day in days)
+              for chunk in split_interval(run_start, run_end, REFRESH_CHUNK_DAYS)]
+    for group_name in storage.user_groups(user):
+        for chunk_start, chunk_end in chunks:
+            refresh_group(group_name, chunk_start, chunk_end, storage)
+
+def rebuild_groups(groups, storage=None):
+    '''
+    Recompute the whole history of the groups, used after their members change
+
+    parameters:
+        groups (iterable of str) -- group names
+        storage (Storage) -- storage backend. Default: get_storage()
+    '''
+    storage = storage or get_storage()
+    for group_name in groups:
+        refresh_group(group_name, storage=storage)
@@ -0,0 +1,116 @@
+import argparse
+import os
+import sys
+import time
+
+from os import path
+
+module_path = path.abspath(path.join(path.dirname( __file__ ), '..'))
+sys.path.append(module_path)
+
+import metrics
+from db.storage import get_storage
+
+# Job kinds and their priorities: lower values are claimed first, so scrapes a
+# dashboard session is waiting on run ahead of speculative prefetches, and both
+# ahead of history backfills
+INTERACTIVE = 'interactive'
+PREFETCH = 'prefetch'
+BACKFILL = 'backfill'
+PRIORITIES = {INTERACTIVE: 0, PREFETCH: 5, BACKFILL: 10}
+
+MAX_ATTEMPTS = 5
+# A running job whose lease is not extended for this long is handed to another worker
+LEASE_SECONDS = 300
+HEARTBEAT_SECONDS = 60
+# Retries wait RETRY_BASE_SECONDS, doubled after each failed attempt
+RETRY_BASE_SECONDS = 30
+RETRY_MAX_SECONDS = 3600
+# How long a dashboard session waits for its interactive job
+WAIT_SECONDS = float(os.environ.get('MFP_SCRAPE_QUEUE_WAIT', 240))
+WAIT_POLL_SECONDS = 0.5
+
+metrics.describe('mfp_scrape_jobs_enqueued_total', 'counter', 'Scrape jobs queued, by kind')
+metrics.describe('mfp_scrape_queue_wait_seconds', 'histogram',
+                 'Time a runnable scrape job waited for a worker, by kind', metrics.LATENCY_BUCKETS)
+metrics.describe('mfp_scrape_job_seconds', 'histogram',
+                 'Time a worker spent on a scrape job attempt, by kind', metrics.LATENCY_BUCKETS)
+metrics.describe('mfp_scrape_job_wait_seconds', 'histogram',
+                 'Time dashboard sessions waited for their queued scrape job', metrics.LATENCY_BUCKETS)
+metrics.describe('mfp_scrape_jobs_total', 'counter',
+                 'Scrape job attempts by kind and result: done, retried, failed, expired, lost or cancelled')
+
+
+def queue_enabled():
+    '''
+    Return True if scrapes are run by scrape workers (db/scrape_worker.py) instead of
+    the web process, which is selected by setting MFP_SCRAPE_QUEUE=1
+    '''
+    return os.environ.get('MFP_SCRAPE_QUEUE', '0').lower() in ('1', 'true', 'yes')
+
+def enqueue(user, date_start, date_end, kind, storage=None):
+    '''
+    Queue a scrape of the user's dates and return the job id. A queued or running
+    job of the same kind covering the dates is reused.
+
+    parameters:
+        user (str) -- username
+        date_start (str) -- first date formatted %Y-%m-%d
+        date_end (str) -- last date formatted %Y-%m-%d
+        kind (str) -- INTERACTIVE, PREFETCH or BACKFILL
+        storage (Storage) -- storage backend. Default: get_storage()
+    '''
+    storage = storage or get_storage()
+    job_id = storage.enqueue_job(user, date_start, date_end, kind, PRIORITIES[kind], MAX_ATTEMPTS, time.time())
+    metrics.inc('mfp_scrape_jobs_enqueued_total', {'kind': kind})
+    return job_id
+
+def wait_for_job(job_id, timeout=WAIT_SECONDS, storage=None):
+    '''
+    Wait until the job is done or failed, or until the timeout, and return its last state
+
+    parameters:
+        job_id (int) -- job id
+        timeout (float) -- seconds to wait
+        storage (Storage) -- storage backend. Default: get_storage()
+    '''
+    storage = storage or get_storage()
+    with metrics.timed('mfp_scrape_job_wait_seconds'):
+        deadline = time.time() + timeout
+        while True:
+            state = storage.job_state(job_id)
+            if state in ('done', 'failed', 'cancelled', None) or time.time() >= deadline:
+                return state
+            time.sleep(WAIT_POLL_SECONDS)
+
+def retry_delay(attempts):
+    '''
+    Return the seconds to wait before retrying a job that failed its attempts-th attempt
+
+    parameters:
+        attempts (int) -- attempts made so far
+    '''
+    return min(RETRY_BASE_SECONDS * 2 ** (attempts - 1), RETRY_MAX_SECONDS)
+
+def print_status(storage=None):
+    '''
+    Print the number of jobs of every kind and state, with the age of the oldest one
+
+    parameters:
+        storage (Storage) -- storage backend. Default: get_storage()
+    '''
+    storage = storage or get_storage()
+    now = time.time()
+    print('%-12s %-8s %8s %12s' % ('kind', 'state', 'jobs', 'oldest (s)'))
+    for kind, state, count, oldest in storage.job_counts():
+        print('%-12s %-8s %8d %12.0f' % (kind, state, count, now - oldest))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Show the scrape job queue')
+    parser.add_argument('--purge-days', type=float,
+                        help='delete done, failed and cancelled jobs finished more than this many days ago')
+    args = parser.parse_args()
+    if args.purge_days is not None:
+        print('purged %d jobs' % get_storage().purge_jobs(time.time() - args.purge_days * 86400))
+    print_status()
@@ -0,0 +1,386 @@
+import argparse
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import numpy as np
+import pandas as pd
+
+from datetime import datetime
+from os import path
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+module_path = path.abspath(path.join(path.dirname( __file__ ), '..'))
+sys.path.append(module_path)
+
+from constants import START_SCRAPE_DATE
+from db.storage import get_storage, DAILY_TOTAL_COLUMNS
+
+# Matrix files shared by every process on the host unless MFP_MATRIX_DIR points elsewhere
+MATRIX_DIR = os.environ.get('MFP_MATRIX_DIR', path.join(module_path, 'data', 'matrix'))
+INDEX_FILE = 'index.json'
+LOCK_FILE = 'matrix.lock'
+# Held by the process syncing the matrix from the database, so one process per host syncs
+SYNC_LOCK_FILE = 'sync.lock'
+# Channel 0 of each (user, day) cell is 1 when food was logged that day, followed
+# by the daily sums of NUTRIENTS
+NUTRIENTS = DAILY_TOTAL_COLUMNS
+CHANNELS = 1 + len(NUTRIENTS)
+# Initial number of user rows, doubled whenever it runs out
+USER_CAPACITY = 1024
+# The day axis grows by whole blocks of this many days
+DAY_BLOCK = 366
+# Seconds between checks of the user_versions table for users ingested on other hosts
+SYNC_SECONDS = 60
+# Times state() re-reads the index when the file it names was removed meanwhile
+MAP_ATTEMPTS = 3
+
+_thread_lock = threading.Lock()
+_sync_lock = threading.Lock()
+
+
+def day_number(value):
+    '''
+    Return the position on the day axis of a date formatted %Y-%m-%d
+
+    parameters:
+        value (str) -- date formatted %Y-%m-%d
+    '''
+    return (datetime.strptime(value, '%Y-%m-%d') - datetime.strptime(START_SCRAPE_DATE, '%Y-%m-%d')).days
+
+
+class NutrientMatrix:
+    '''
+    Per-user daily nutrient totals of every user, held in one fixed-width float32
+    array of shape (users, days, CHANNELS) in a file that each process memory-maps
+    read-only. Every gunicorn worker on the host therefore reads the same page
+    cache, and population statistics are vectorized operations over array slices.
+
+    index.json next to the array holds its shape, the username of each row and the
+    user_versions version each row was last written at. It is replaced atomically
+    after every update, and readers map the file it names on their next access.
+    Day cells are rewritten in place under a flock, so readers see ingests without
+    copying. The file of the previous generation is kept when the array grows, so
+    a reader that read the old index can still map it.
+
+    The matrix is local to the host. Rows ingested by other hosts are found by
+    sync_from_storage, which rebuilds the users whose version in the database
+    differs from the version of their row. Requests start it in a background thread
+    with start_sync and keep reading the matrix as it is meanwhile.
+
+    parameters:
+        directory (str) -- directory holding the array and its index
+    '''
+    def __init__(self, directory=MATRIX_DIR):
+        self.directory = directory
+        self._state = None
+        self._stamp = None
+        os.makedirs(self.directory, exist_ok=True)
+
+    def _index_path(self):
+        return path.join(self.directory, INDEX_FILE)
+
+    def _read_index(self):
+        try:
+            with open(self._index_path()) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {'file': None, 'generation': 0, 'capacity': 0, 'days': 0, 'users': [], 'versions': {}}
+
+    def _write_index(self, index):
+        # Written to a temporary file first so readers never load a partial index
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(index, f)
+        os.replace(tmp_path, self._index_path())
+
+    def _map(self, index, mode='r'):
+        if index['file'] is None:
+            return np.zeros((0, 0, CHANNELS), dtype=np.float32)
+        return np.memmap(path.join(self.directory, index['file']), dtype=np.float32, mode=mode,
+                         shape=(index['capacity'], index['days'], CHANNELS))
+
+    def state(self):
+        '''
+        Return the current (index, array) of the matrix, mapping the latest file if
+        the index changed since the last call
+        '''
+        try:
+            stat = os.stat(self._index_path())
+            stamp = (stat.st_ino, stat.st_mtime_ns)
+        except FileNotFoundError:
+            stamp = None
+        if self._state is None or stamp != self._stamp:
+            for attempt in range(MAP_ATTEMPTS):
+                index = self._read_index()
+                try:
+                    array = self._map(index)
+                    break
+                except FileNotFoundError:
+                    # The array grew twice since the index was read; read the new index
+                    if attempt == MAP_ATTEMPTS - 1:
+                        raise
+            self._state, self._stamp = (index, array), stamp
+        return self._state
+
+    def _grow(self, index, capacity, days):
+        # Copy the array into a larger file; readers keep their mapping of the old
+        # file until they see the new index
+        generation = index['generation'] + 1
+        grown = dict(index, file='totals-%06d.f4' % generation, generation=generation,
+                     capacity=capacity, days=days)
+        array = self._map(grown, mode='w+')
+        if index['file'] is not None:
+            array[:index['capacity'], :index['days']] = self._map(index)
+        array.flush()
+        return grown
+
+    def update_user(self, user, date_start, date_end, daily, version=None):
+        '''
+        Overwrite the user's cells between the given dates with their daily totals.
+        Days without a row in the totals are marked as not logged.
+
+        parameters:
+            user (str) -- username
+            date_start (str) -- first date formatted %Y-%m-%d
+            date_end (str) -- last date formatted %Y-%m-%d
+            daily (DataFrame) -- output of Storage.daily_totals over the dates
+            version (int) -- version of the user read before the totals
+        '''
+        first, last = max(day_number(date_start), 0), day_number(date_end)
+        if last < first:
+            return
+        with _thread_lock, open(path.join(self.directory, LOCK_FILE), 'a') as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                index = self._read_index()
+                if user not in index['users']:
+                    index = dict(index, users=index['users'] + [user])
+                if version is not None:
+                    index = dict(index, versions=dict(index.get('versions', {}), **{user: version}))
+                row = index['users'].index(user)
+                if row >= index['capacity'] or last >= index['days']:
+                    capacity = max(index['capacity'], USER_CAPACITY)
+                    while capacity <= row:
+                        capacity *= 2
+                    days = max(index['days'], (last // DAY_BLOCK + 1) * DAY_BLOCK)
+                    index = self._grow(index, capacity, days)
+
+                cells = np.zeros((last - first + 1, CHANNELS), dtype=np.float32)
+                if not daily.empty:
+                    days = np.array([day_number(str(day)[:10]) for day in daily['entry_date']]) - first
+                    keep = (days >= 0) & (days < len(cells))
+                    cells[days[keep], 0] = 1
+                    cells[days[keep], 1:] = daily[NUTRIENTS].fillna(0).to_numpy(dtype=np.float32)[keep]
+                array = self._map(index, mode='r+')
+                array[row, first:last + 1] = cells
+                array.flush()
+                del array
+
+                self._write_index(index)
+                self._remove_old_generations(index['generation'])
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _remove_old_generations(self, generation):
+        # The previous generation stays for readers that read the index before it changed
+        for name in os.listdir(self.directory):
+            if name.startswith('totals-') and name.endswith('.f4') and int(name[7:-3]) < generation - 1:
+                os.remove(path.join(self.directory, name))
+
+    def window(self, date_start, date_end):
+        '''
+        Return the usernames with a row and a zero-copy view of their cells between
+        the given dates. Dates outside the day axis are left out.
+
+        parameters:
+            date_start (str) -- first date formatted %Y-%m-%d
+            date_end (str) -- last date formatted %Y-%m-%d
+        '''
+        index, array = self.state()
+        first, last = max(day_number(date_start), 0), min(day_number(date_end), index['days'] - 1)
+        users = index['users']
+        if last < first:
+            return users, array[:len(users), :0]
+        return users, array[:len(users), first:last + 1]
+
+    def mean_daily_totals(self, date_start, date_end):
+        '''
+        Return the mean daily NUTRIENTS of every user over the days they logged food
+        between the given dates, as a dataframe indexed by username. Users without a
+        logged day are left out.
+
+        parameters:
+            date_start (str) -- first date formatted %Y-%m-%d
+            date_end (str) -- last date formatted %Y-%m-%d
+        '''
+        users, cells = self.window(date_start, date_end)
+        logged = cells[:, :, 0].sum(axis=1)
+        # Cells of days without food are zero, so they do not change the sums
+        sums = cells[:, :, 1:].sum(axis=1, dtype=np.float64)
+        active = logged > 0
+        means = sums[active] / logged[active, None]
+        return pd.DataFrame(means, index=pd.Index(np.array(users, dtype=object)[active], name='mfp_username'),
+                            columns=NUTRIENTS)
+
+
+_matrix = None
+
+def get_matrix():
+    '''Return the nutrient matrix of this process'''
+    global _matrix
+    if _matrix is None:
+        _matrix = NutrientMatrix()
+    return _matrix
+
+def refresh_user(user, date_start, date_end, storage=None):
+    '''
+    Rewrite the user's cells between the given dates from the user's nutrition rows,
+    and record the user's current version. Called after every ingest on this host,
+    so only the touched days of the user are rewritten.
+
+    parameters:
+        user (str) -- username whose rows were written
+        date_start (str) -- first written date formatted %Y-%m-%d
+        date_end (str) -- last written date formatted %Y-%m-%d
+        storage (Storage) -- storage backend. Default: get_storage()
+    '''
+    storage = storage or get_storage()
+    # Read before the totals, so rows written meanwhile leave the row out of date
+    version = storage.user_version(user)
+    get_matrix().update_user(user, date_start, date_end, storage.daily_totals(user, date_start, date_end), version)
+
+def rebuild_users(users, storage=None):
+    '''
+    Rewrite the whole history of the users, used to fill the matrix for rows
+    ingested before it existed
+
+    parameters:
+        users (iterable of str) -- usernames
+        storage (Storage) -- storage backend. Default: get_storage()
+    '''
+    storage = storage or get_storage()
+    for user in users:
+        # Users without rows get an empty row, which records their version
+        last = storage.last_entry_date(user) or START_SCRAPE_DATE
+        refresh_user(user, START_SCRAPE_DATE, max(last, START_SCRAPE_DATE), storage)
+
+_synced_at = None
+_sync_thread = None
+
+def sync_from_storage(storage=None):
+    '''
+    Rebuild the users whose rows were written since their row of the matrix, e.g. by
+    an ingest on another host, and return the rebuilt usernames. On a new host this
+    rebuilds every user, so it is run by start_sync in the background or by
+    `python db/nutrient_matrix.py --sync`, never inside a request.
+
+    parameters:
+        storage (Storage) -- storage backend. Default: get_storage()
+    '''
+    storage = storage or get_storage()
+    index, _ = get_matrix().state()
+    known = index.get('versions', {})
+    stale = [user for user, version in storage.read_user_versions().items() if known.get(user) != version]
+    rebuild_users(stale, storage)
+    return stale
+
+def start_sync(storage=None):
+    '''
+    Start sync_from_storage in a background thread and return at once. Nothing is
+    started while a sync of this process runs or if the last one started less than
+    SYNC_SECONDS ago, and the thread skips the sync while another process of the
+    host holds SYNC_LOCK_FILE. Returns True if a thread was started.
+
+    parameters:
+        storage (Storage) -- storage backend. Default: get_storage()
+    '''
+    global _synced_at, _sync_thread
+    now = time.monotonic()
+    with _sync_lock:
+        if _sync_thread is not None and _sync_thread.is_alive():
+            return False
+        if _synced_at is not None and now - _synced_at < SYNC_SECONDS:
+            return False
+        _synced_at = now
+        # Started on first use rather than at import, since gunicorn forks the workers
+        # after importing the app and threads do not survive the fork
+        _sync_thread = threading.Thread(target=_sync, args=(storage,), daemon=True)
+        _sync_thread.start()
+    return True
+
+def _sync(storage):
+    try:
+        matrix = get_matrix()
+        with open(path.join(matrix.directory, SYNC_LOCK_FILE), 'a') as lock:
+            if fcntl is not None:
+                try:
+                    fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    # Another worker of the host is syncing the shared files
+                    return
+            try:
+                stale = sync_from_storage(storage)
+                if stale:
+                    print('Synced %s users into the nutrient matrix' % len(stale))
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+    except Exception as error:
+        # The matrix is served as it is until the next sync
+        print(error)
+
+def population_percentiles(user, date_start, date_end):
+    '''
+    Return, for every nutrient, the user's mean daily intake over the days they
+    logged food between the given dates, the median of all users' means and the
+    percentile of the user among them, as a dataframe indexed by nutrient. Empty
+    if the user logged nothing over the dates.
+
+    parameters:
+        user (str) -- username
+        date_start (str) -- first date formatted %Y-%m-%d
+        date_end (str) -- last date formatted %Y-%m-%d
+    '''
+    # Users ingested on other hosts are rebuilt in the background; until then the
+    # matrix is served as it is
+    start_sync()
+    means = get_matrix().mean_daily_totals(date_start, date_end)
+    if user not in means.index:
+        return pd.DataFrame(columns=['user', 'median', 'percentile', 'users'])
+    values = means.to_numpy()
+    mine = means.loc[user].to_numpy()
+    # Share of the other users below the user, with ties counting half, so a user
+    # equal to everyone else is at the 50th percentile
+    below = (values < mine).sum(axis=0) + 0.5 * ((values == mine).sum(axis=0) - 1)
+    percentile = 100 * below / (len(values) - 1) if len(values) > 1 else np.full(len(NUTRIENTS), 50.0)
+    return pd.DataFrame({
+        'user': mine,
+        'median': np.median(values, axis=0),
+        'percentile': percentile,
+        'users': len(values),
+    }, index=pd.Index(NUTRIENTS, name='nutrient'))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Rebuild the nutrient matrix from the nutrition table')
+    parser.add_argument('--users', nargs='*', help='usernames to rebuild (default: every user with rows)')
+    parser.add_argument('--sync', action='store_true',
+                        help='only rebuild the users whose rows changed since their row of the matrix')
+    args = parser.parse_args()
+
+    storage = get_storage()
+    if args.sync:
+        print('Synced %s users' % len(sync_from_storage(storage)))
+        sys.exit()
+    users = args.users or [record[0] for record in storage.fetchall('SELECT DISTINCT mfp_username FROM nutrition;')]
+    rebuild_users(users, storage)
+    print('Rebuilt %s users' % len(users))
@@ -0,0 +1,155 @@
+import os
+import socket
+import sys
+import threading
+import time
+import uuid
+
+from os import path
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta
+
+module_path = path.abspath(path.join(path.dirname( __file__ ), '..'))
+sys.path.append(module_path)
+
+import metrics
+from db import jobs, update_db
+from db.storage import get_storage
+
+# Scrapes started before Submit, in a few background threads per process
+PREFETCH_WORKERS = int(os.environ.get('MFP_PREFETCH_WORKERS', 2))
+# Days ending today prefetched when no date range is picked
+PREFETCH_DAYS = 7
+# Seconds a username validated for a prefetch is trusted by the Submit check
+VALIDATED_SECONDS = 300
+
+metrics.describe('mfp_prefetch_total', 'counter',
+                 'Speculative prefetches by result: deduplicated into a queued or running prefetch, '
+                 'cancelled when the username changed, or the ingest_user result')
+
+executor = ThreadPoolExecutor(max_workers=PREFETCH_WORKERS)
+_validated = {}
+_lock = threading.Lock()
+
+
+def prefetch_enabled():
+    '''Return False if usernames should not be prefetched, set with MFP_PREFETCH=0'''
+    return os.environ.get('MFP_PREFETCH', '1').lower() not in ('0', 'false', 'no')
+
+def new_session():
+    '''Return a random id for the prefetches of one dashboard session'''
+    return uuid.uuid4().hex
+
+def likely_range(start_date, end_date):
+    '''
+    Return the (first, last) dates formatted %Y-%m-%d to prefetch: the range in the
+    date picker, or the last PREFETCH_DAYS days if none is picked
+
+    parameters:
+        start_date (str) -- start date of the picker in ISO-8601, or None
+        end_date (str) -- end date of the picker in ISO-8601, or None
+    '''
+    if start_date and end_date:
+        return tuple(datetime.strftime(datetime.fromisoformat(value), '%Y-%m-%d') for value in (start_date, end_date))
+    today = date.today()
+    return (datetime.strftime(today - timedelta(PREFETCH_DAYS - 1), '%Y-%m-%d'),
+            datetime.strftime(today, '%Y-%m-%d'))
+
+def mark_validated(user):
+    '''
+    Remember that the username was found public, so Submit does not check it again
+
+    parameters:
+        user (str) -- username
+    '''
+    now = time.time()
+    with _lock:
+        for name, validated_at in list(_validated.items()):
+            if now - validated_at >= VALIDATED_SECONDS:
+                del _validated[name]
+        _validated[user] = now
+
+def recently_validated(user):
+    '''
+    Return True if the username was found public in this process within VALIDATED_SECONDS
+
+    parameters:
+        user (str) -- username
+    '''
+    with _lock:
+        return time.time() - _validated.get(user, 0) < VALIDATED_SECONDS
+
+def start(user, date_start, date_end, session, storage=None):
+    '''
+    Queue a prefetch job ingesting the user's dates without a history backfill, and
+    return its id. A queued or running prefetch of the dates, started by any session
+    on any worker or node, is shared instead. Every session waiting on the job is
+    recorded in the scrape_job_sessions table, so the job is cancelled only once the
+    last one drops it. Without the scrape queue, the job is claimed and run in a
+    background thread of this process; with it, a scrape worker runs the job.
+
+    parameters:
+        user (str) -- username
+        date_start (str) -- first date formatted %Y-%m-%d
+        date_end (str) -- last date formatted %Y-%m-%d
+        session (str) -- id of the dashboard session, see new_session
+        storage (Storage) -- storage backend. Default: get_storage()
+    '''
+    storage = storage or get_storage()
+    local = not jobs.queue_enabled()
+    if local:
+        # No scrape worker requeues the prefetches of a process that died mid-scrape
+        storage.requeue_expired_jobs(time.time())
+    while True:
+        job_id = jobs.enqueue(user, date_start, date_end, jobs.PREFETCH, storage)
+        sessions = storage.add_job_session(job_id, session)
+        state = storage.job_state(job_id)
+        # The last session may have cancelled the job in between, so a new one is queued
+        if state != 'cancelled':
+            break
+    if sessions > 1:
+        metrics.inc('mfp_prefetch_total', {'result': 'deduplicated'})
+    if local and state == 'queued':
+        executor.submit(_run, job_id, storage)
+    return job_id
+
+def _run(job_id, storage):
+    # Leased to this process, read at run time since gunicorn forks after import
+    worker = 'prefetch-%s-%s' % (socket.gethostname(), os.getpid())
+    # Another process may have claimed the job first, or every session dropped it
+    job = storage.claim_job_id(job_id, worker, time.time(), jobs.LEASE_SECONDS)
+    if job is None:
+        return
+
+    def cancelled():
+        # Extending the lease before every diary page also finds the job cancelled,
+        # since only running jobs can be extended
+        return not storage.heartbeat_job(job_id, worker, time.time(), jobs.LEASE_SECONDS)
+
+    error = None
+    try:
+        result = update_db.ingest_user(job['mfp_username'], job['date_start'], job['date_end'],
+                                       backfill=False, local=True, cancelled=cancelled)
+        # Cancellations are counted by cancel()
+        if result != 'cancelled':
+            metrics.inc('mfp_prefetch_total', {'result': result})
+    except Exception as e:
+        error = '%s: %s' % (type(e).__name__, e)
+        print(error)
+    storage.finish_job(job_id, worker, 'done' if error is None else 'failed', time.time(), error=error)
+
+def cancel(job_id, session, storage=None):
+    '''
+    Drop the interest of one session in a prefetch job, e.g. because the username
+    was changed. Once no session waits on it, the job is marked cancelled in the
+    jobs table: a queued job is never claimed, and the process or scrape worker
+    running it stops before its next diary page.
+
+    parameters:
+        job_id (int) -- id returned by start
+        session (str) -- id of the dashboard session
+        storage (Storage) -- storage backend. Default: get_storage()
+    '''
+    storage = storage or get_storage()
+    if storage.cancel_job_session(job_id, session, time.time()):
+        metrics.inc('mfp_prefetch_total', {'result': 'cancelled'})
@@ -0,0 +1,150 @@
+import argparse
+import os
+import sys
+import time
+
+from datetime import datetime, timedelta
+from itertools import groupby
+from multiprocessing import Pool
+from os import path
+
+module_path = path.abspath(path.join(path.dirname( __file__ ), '..'))
+sys.path.append(module_path)
+
+from db import food_index, food_search, group_stats, nutrient_matrix
+from db.cache import query_cache
+from db.storage import get_storage
+from db.update_db import diary_rows
+from webscraper.archive import get_archive, read_blob
+from webscraper.user_data import MFP_User
+
+# Archived pages parsed per pool task
+BATCH_PAGES = 64
+
+_parser = None
+
+
+def contiguous_runs(days):
+    '''
+    Return (first, last) pairs of the runs of consecutive dates in a sorted list
+
+    parameters:
+        days (list of str) -- sorted dates formatted %Y-%m-%d
+    '''
+    runs = []
+    for day in days:
+        value = datetime.strptime(day, '%Y-%m-%d').date()
+        if runs and value - runs[-1][2] == timedelta(1):
+            runs[-1][1:] = [day, value]
+        else:
+            runs.append([day, day, value])
+    return [(first, last) for first, last, _ in runs]
+
+def parse_pages(task):
+    '''
+    Parse a batch of archived diary pages in a pool worker and return the user, the
+    parsed dates and the nutrition rows of the batch
+
+    parameters:
+        task (tuple) -- archive directory and the (user, date, segment, offset,
+            length, codec) tuples of one user's pages, as returned by PageArchive.pages
+    '''
+    global _parser
+    directory, pages = task
+    if _parser is None:
+        # Only the parsing methods are used, so the scrape in __init__ is skipped
+        _parser = MFP_User.__new__(MFP_User)
+    rows = []
+    for user, day, segment, offset, length, codec in pages:
+        content = read_blob(directory, segment, offset, length, codec)
+        rows.extend(diary_rows(user, day, _parser._parse_diary(content)))
+    return pages[0][0], [page[1] for page in pages], rows
+
+def batches(directory, pages):
+    '''
+    Yield parse_pages tasks of at most BATCH_PAGES pages of a single user, in the
+    order of the pages
+
+    parameters:
+        directory (str) -- archive directory
+        pages (list of tuples) -- output of PageArchive.pages
+    '''
+    for _, user_pages in groupby(pages, key=lambda page: page[0]):
+        user_pages = list(user_pages)
+        for i in range(0, len(user_pages), BATCH_PAGES):
+            yield directory, user_pages[i:i+BATCH_PAGES]
+
+def write_user(user, days, rows, storage):
+    '''
+    Replace the user's nutrition rows over every run of consecutive re-parsed days
+    and refresh the food index, nutrient matrix and cached reads over the runs, and
+    the group statistics on the days whose totals changed
+
+    parameters:
+        user (str) -- username
+        days (list of str) -- re-parsed dates formatted %Y-%m-%d
+        rows (list of tuples) -- values ordered as NUTRITION_COLUMNS
+        storage (Storage) -- storage backend
+    '''
+    days = sorted(set(days))
+    with storage.ingest_lock(user):
+        before = storage.daily_totals(user, days[0], days[-1])
+        for first, last in contiguous_runs(days):
+            storage.replace_nutrition(user, first, last, [row for row in rows if first <= row[1] <= last])
+        storage.bump_user_version(user)
+    group_stats.refresh_user_groups(user, before, storage.daily_totals(user, days[0], days[-1]), storage)
+    food_index.refresh_user(user, days[0], days[-1], storage)
+    nutrient_matrix.refresh_user(user, days[0], days[-1], storage)
+    food_search.add_items(set(row[2] for row in rows))
+    query_cache.invalidate(user, days[0], days[-1])
+
+def reparse(users=None, date_start=None, date_end=None, processes=None, storage=None):
+    '''
+    Rebuild the nutrition rows of the archived diary pages without fetching them
+    again, e.g. after a parser fix. Pages are decompressed and parsed in a pool of
+    processes while the rows of each finished user are written, and only the dates
+    with an archived page are replaced. Returns the number of users, pages and rows.
+
+    parameters:
+        users (list of str) -- only these users. Default: every archived user
+        date_start (str) -- first date formatted %Y-%m-%d. Default: no bound
+        date_end (str) -- last date formatted %Y-%m-%d. Default: no bound
+        processes (int) -- parser processes. Default: os.cpu_count()
+        storage (Storage) -- storage backend. Default: get_storage()
+    '''
+    storage = storage or get_storage()
+    archive = get_archive()
+    if archive is None:
+        raise RuntimeError('the page archive is turned off with MFP_ARCHIVE=0')
+    pages = archive.pages(users, date_start, date_end)
+    totals = {'users': 0, 'pages': len(pages), 'rows': 0}
+    user, days, rows = None, [], []
+    with Pool(processes or os.cpu_count()) as pool:
+        # Results come back in page order, so a user is complete once the next one starts
+        for batch_user, batch_days, batch_rows in pool.imap(parse_pages, batches(archive.directory, pages)):
+            if batch_user != user and days:
+                write_user(user, days, rows, storage)
+                totals['users'] += 1
+                days, rows = [], []
+            user = batch_user
+            days.extend(batch_days)
+            rows.extend(batch_rows)
+            totals['rows'] += len(batch_rows)
+    if days:
+        write_user(user, days, rows, storage)
+        totals['users'] += 1
+    return totals
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Rebuild nutrition rows from the archived diary pages')
+    parser.add_argument('--users', nargs='*', help='usernames to re-parse (default: every archived user)')
+    parser.add_argument('--start', help='first date to re-parse, formatted %%Y-%%m-%%d')
+    parser.add_argument('--end', help='last date to re-parse, formatted %%Y-%%m-%%d')
+    parser.add_argument('--processes', type=int, help='parser processes (default: one per core)')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    totals = reparse(args.users, args.start, args.end, args.processes)
+    print('Re-parsed %(pages)s pages into %(rows)s rows for %(users)s users' % totals,
+          'in %.1f seconds' % (time.perf_counter() - start))
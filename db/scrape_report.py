@@ -0,0 +1,92 @@
+import argparse
+import sys
+import time
+import numpy as np
+import pandas as pd
+
+from os import path
+
+module_path = path.abspath(path.join(path.dirname( __file__ ), '..'))
+sys.path.append(module_path)
+
+from db.storage import get_storage
+
+DEFAULT_DAYS = 30
+
+
+def load_runs(days=DEFAULT_DAYS, storage=None):
+    '''
+    Return the scraper runs of the last days from the scrape_runs ledger, with the
+    UTC day each run started on
+
+    parameters:
+        days (float) -- number of days to load
+        storage (Storage) -- storage backend. Default: get_storage()
+    '''
+    storage = storage or get_storage()
+    runs = storage.read_scrape_runs(time.time() - days * 86400)
+    runs['day'] = pd.to_datetime(runs['started_at'], unit='s').dt.normalize()
+    return runs
+
+def throughput(runs):
+    '''
+    Return the runs, pages, failures, throttled responses, megabytes and pages per
+    second of wall time and of parse CPU time of every scraper and day
+
+    parameters:
+        runs (DataFrame) -- output of load_runs
+    '''
+    grouped = runs.groupby(['day', 'scraper'])
+    report = pd.DataFrame({
+        'runs': grouped.size(),
+        'errors': grouped['error'].count(),
+        'pages': grouped['pages_requested'].sum(),
+        'failed_pages': grouped['pages_requested'].sum() - grouped['pages_succeeded'].sum(),
+        'throttled': grouped['throttled'].sum(),
+        'mb': grouped['bytes'].sum() / 1e6,
+        'wall_seconds': grouped['wall_seconds'].sum(),
+        'parse_cpu_seconds': grouped['parse_cpu_seconds'].sum(),
+    })
+    report['pages_per_second'] = report['pages'] / report['wall_seconds']
+    report['pages_per_cpu_second'] = report['pages'] / report['parse_cpu_seconds']
+    return report
+
+def cost_per_user_day(runs):
+    '''
+    Return the wall time, pages, bytes and parse CPU time spent per scraped user-day
+    by the diary scraper, for every day and overall, with the user-days a single
+    scraper can ingest per hour at that cost. User-days are the diary days actually
+    fetched (the days column of the ledger), so skipped and refused pages add to
+    the cost without counting as scraped.
+
+    parameters:
+        runs (DataFrame) -- output of load_runs
+    '''
+    diary = runs[(runs['scraper'] == 'diary') & runs['days'].notna()]
+    totals = diary.groupby('day')[['days', 'wall_seconds', 'pages_requested', 'bytes', 'parse_cpu_seconds']].sum()
+    totals.loc['all'] = totals.sum()
+    # Days whose runs fetched nothing have no cost per user-day
+    totals['days'] = totals['days'].replace(0, np.nan)
+    report = pd.DataFrame({
+        'user_days': totals['days'],
+        'seconds': totals['wall_seconds'] / totals['days'],
+        'pages': totals['pages_requested'] / totals['days'],
+        'kb': totals['bytes'] / totals['days'] / 1e3,
+        'parse_cpu_ms': totals['parse_cpu_seconds'] / totals['days'] * 1e3,
+    })
+    report['user_days_per_hour'] = 3600 / report['seconds']
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Report scrape throughput and cost from the scrape_runs ledger')
+    parser.add_argument('--days', type=float, default=DEFAULT_DAYS, help='days of runs to report')
+    args = parser.parse_args()
+
+    runs = load_runs(args.days)
+    pd.set_option('display.width', 200)
+    pd.set_option('display.max_columns', 20)
+    print('Throughput by day and scraper')
+    print(throughput(runs).round(2).to_string())
+    print('\nDiary cost per user-day')
+    print(cost_per_user_day(runs).round(2).to_string())
@@ -0,0 +1,169 @@
+import argparse
+import os
+import socket
+import sys
+import threading
+import time
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from os import path
+
+module_path = path.abspath(path.join(path.dirname( __file__ ), '..'))
+sys.path.append(module_path)
+
+import metrics
+from db import jobs, update_db
+from db.storage import get_storage
+
+# Seconds an idle worker waits before polling the queue again
+POLL_SECONDS = 2.0
+
+
+class ScrapeWorker:
+    '''
+    Claims scrape jobs from the queue in db/jobs.py and runs them with
+    update_db.ingest_user. Any number of workers on any number of nodes can share
+    a PostgreSQL queue; each claimed job is leased to one worker, and the lease is
+    extended by a heartbeat while the job runs. A job whose worker dies is queued
+    again when its lease expires, and failed attempts are retried with backoff. An
+    attempt fails when it raises, or when ingest_user stored no diary page, e.g.
+    because MyFitnessPal rate limited every request.
+
+    parameters:
+        name (str) -- worker name recorded on claimed jobs. Default: host:pid
+        storage (Storage) -- storage backend holding the queue. Default: get_storage()
+        lease_seconds (float) -- lease duration of a claimed job
+        heartbeat_seconds (float) -- interval of the lease extensions
+    '''
+    def __init__(self, name=None, storage=None, lease_seconds=jobs.LEASE_SECONDS,
+                 heartbeat_seconds=jobs.HEARTBEAT_SECONDS):
+        self.name = name or '%s:%s' % (socket.gethostname(), os.getpid())
+        self.storage = storage or get_storage()
+        self.lease_seconds = lease_seconds
+        self.heartbeat_seconds = heartbeat_seconds
+
+    def run_once(self):
+        '''Run the next runnable job and return False if there was none'''
+        for job_id, kind, state in self.storage.requeue_expired_jobs(time.time()):
+            print('Job %s: lease expired, %s' % (job_id, state))
+            metrics.inc('mfp_scrape_jobs_total', {'kind': kind, 'result': 'expired'})
+
+        now = time.time()
+        job = self.storage.claim_job(self.name, now, self.lease_seconds)
+        if job is None:
+            return False
+        metrics.observe('mfp_scrape_queue_wait_seconds', max(0, now - job['run_at']), {'kind': job['kind']})
+        print('Job %s: %s %s for %s through %s, attempt %s' % (
+            job['id'], job['kind'], job['mfp_username'], job['date_start'], job['date_end'], job['attempts']))
+
+        done = threading.Event()
+        heartbeat = threading.Thread(target=self._heartbeat, args=(job, done), daemon=True)
+        heartbeat.start()
+        error = None
+        if job['kind'] == jobs.PREFETCH:
+            # A prefetch is cancelled in the jobs table once no session waits on it
+            cancelled = lambda: self.storage.job_state(job['id']) == 'cancelled'
+        else:
+            cancelled = None
+        try:
+            with metrics.timed('mfp_scrape_job_seconds', {'kind': job['kind']}):
+                # Interactive jobs queue the backfill of the rest of the history when they
+                # finish, and backfill jobs yield to requested scrapes of the same user
+                outcome = update_db.ingest_user(job['mfp_username'], job['date_start'], job['date_end'],
+                                                backfill=job['kind'] == jobs.INTERACTIVE, local=True,
+                                                background=job['kind'] == jobs.BACKFILL, cancelled=cancelled)
+            if outcome == 'failed':
+                # ingest_user catches its own errors, so throttling is only seen in its result
+                error = 'no diary page could be fetched and stored'
+                print('Job %s: %s' % (job['id'], error))
+        except Exception as e:
+            error = '%s: %s' % (type(e).__name__, e)
+            print('Job %s: %s' % (job['id'], error))
+        finally:
+            done.set()
+            heartbeat.join()
+
+        now = time.time()
+        if error is None:
+            state, result, run_at = 'done', 'done', None
+        elif job['attempts'] >= job['max_attempts']:
+            state, result, run_at = 'failed', 'failed', None
+        else:
+            state, result, run_at = 'queued', 'retried', now + jobs.retry_delay(job['attempts'])
+        if not self.storage.finish_job(job['id'], self.name, state, now, run_at, error):
+            # The lease expired and the job was queued again or claimed by another
+            # worker, or the prefetch was cancelled
+            result = 'cancelled' if self.storage.job_state(job['id']) == 'cancelled' else 'lost'
+        metrics.inc('mfp_scrape_jobs_total', {'kind': job['kind'], 'result': result})
+        return True
+
+    def _heartbeat(self, job, done):
+        while not done.wait(self.heartbeat_seconds):
+            try:
+                if not self.storage.heartbeat_job(job['id'], self.name, time.time(), self.lease_seconds):
+                    print('Job %s: lease lost' % job['id'])
+                    return
+            except Exception as error:
+                print(error)
+
+    def run(self, stop=None, poll_seconds=POLL_SECONDS):
+        '''
+        Run jobs until the stop event is set, polling the queue while it is empty
+
+        parameters:
+            stop (threading.Event) -- event ending the loop. Default: run forever
+            poll_seconds (float) -- seconds between polls of an empty queue
+        '''
+        stop = stop or threading.Event()
+        while not stop.is_set():
+            try:
+                ran = self.run_once()
+            except Exception as error:
+                print(error)
+                ran = False
+            if not ran:
+                stop.wait(poll_seconds)
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    '''Serves the metrics of the workers on this node at /metrics'''
+    def do_GET(self):
+        if self.path != '/metrics':
+            self.send_error(404)
+            return
+        body = metrics.render().encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run scrape jobs queued by the dashboard')
+    parser.add_argument('--threads', type=int, default=1, help='jobs run at once by this process')
+    parser.add_argument('--name', help='worker name recorded on claimed jobs. Default: host:pid')
+    parser.add_argument('--metrics-port', type=int, help='serve /metrics on this port')
+    args = parser.parse_args()
+    # Backfills scheduled by interactive jobs are queued for any worker
+    os.environ['MFP_SCRAPE_QUEUE'] = '1'
+
+    if args.metrics_port:
+        server = ThreadingHTTPServer(('', args.metrics_port), MetricsHandler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    name = args.name or '%s:%s' % (socket.gethostname(), os.getpid())
+    threads = [
+        threading.Thread(target=ScrapeWorker('%s/%d' % (name, i)).run, daemon=True)
+        for i in range(args.threads)
+    ]
+    for thread in threads:
+        thread.start()
+    try:
+        for thread in threads:
+            thread.join()
+    except KeyboardInterrupt:
+        pass
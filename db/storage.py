@@ -0,0 +1,1390 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import pandas as pd
+import pandas.io.sql as psql
+
+from contextlib import contextmanager
+from datetime import date, datetime
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+try:
+    import psycopg2
+except ImportError:
+    psycopg2 = None
+
+try:
+    import duckdb
+except ImportError:
+    duckdb = None
+
+from db.config import config, BASEDIR
+
+# Column order used for every nutrition insert
+NUTRITION_COLUMNS = [
+    'mfp_username', 'entry_date', 'item', 'calories', 'protein', 'carbohydrates',
+    'fat', 'fiber', 'sugar', 'saturated_fat', 'polyunsaturated_fat',
+    'monounsaturated_fat', 'trans_fat', 'cholesterol', 'sodium', 'potassium',
+    'vitamin_a', 'vitamin_c', 'calcium', 'iron'
+]
+
+# Nutrients summed per day by daily_totals()
+DAILY_TOTAL_COLUMNS = ['calories', 'protein', 'carbohydrates', 'fat', 'fiber', 'sugar']
+
+# Nutrients summarized per group and day in group_daily_stats, by their member
+# mean and these percentiles of the members' daily totals
+GROUP_STAT_NUTRIENTS = ['calories', 'protein', 'carbohydrates', 'fat']
+GROUP_STAT_PERCENTILES = [10, 25, 50, 75, 90]
+GROUP_STAT_COLUMNS = ['group_name', 'entry_date', 'members', 'active_members'] + [
+    '%s_%s' % (nutrient, stat)
+    for nutrient in GROUP_STAT_NUTRIENTS
+    for stat in ['mean'] + ['p%s' % p for p in GROUP_STAT_PERCENTILES]
+]
+
+# Per-user, per-month and per-food counts and sums kept in food_frequency
+FOOD_STAT_NUTRIENTS = ['calories', 'protein', 'carbohydrates', 'fat']
+FOOD_FREQUENCY_COLUMNS = ['mfp_username', 'month', 'item', 'entries', 'days'] + FOOD_STAT_NUTRIENTS
+
+# Columns of the scrape_runs ledger, one row per scraper run
+SCRAPE_RUN_COLUMNS = [
+    'scraper', 'subject', 'date_start', 'date_end', 'days', 'host', 'started_at',
+    'wall_seconds', 'parse_cpu_seconds', 'pages_requested', 'pages_succeeded',
+    'bytes', 'throttled', 'error'
+]
+
+# Table definitions shared by every backend. {serial} is replaced with the
+# backend specific auto-incrementing primary key definition.
+TABLES = {
+    'users': '''
+        CREATE TABLE IF NOT EXISTS users (
+            user_id {serial},
+            mfp_username text
+        )
+        ''',
+    'groups': '''
+        CREATE TABLE IF NOT EXISTS groups (
+            group_id {serial},
+            group_name text
+        )
+        ''',
+    'group_users': '''
+        CREATE TABLE IF NOT EXISTS group_users (
+            id {serial},
+            mfp_username text,
+            group_name text
+        )
+        ''',
+    'nutrition': '''
+        CREATE TABLE IF NOT EXISTS nutrition (
+            id {serial},
+            mfp_username text,
+            entry_date DATE,
+            item text,
+            calories int,
+            fat int,
+            polyunsaturated_fat int,
+            saturated_fat int,
+            monounsaturated_fat int,
+            trans_fat int,
+            cholesterol int,
+            sodium int,
+            potassium int,
+            carbohydrates int,
+            fiber int,
+            sugar int,
+            protein int,
+            vitamin_a int,
+            vitamin_c int,
+            calcium int,
+            iron int
+        )
+        ''',
+    'group_daily_stats': '''
+        CREATE TABLE IF NOT EXISTS group_daily_stats (
+            group_name text,
+            entry_date DATE,
+            members int,
+            active_members int,
+            %s,
+            PRIMARY KEY (group_name, entry_date)
+        )
+        ''' % ',\n            '.join('%s real' % col for col in GROUP_STAT_COLUMNS[4:]),
+    'scrape_coverage': '''
+        CREATE TABLE IF NOT EXISTS scrape_coverage (
+            mfp_username text,
+            date_start DATE,
+            date_end DATE
+        )
+        ''',
+    # Bumped after every write of a user's rows, so caches of any process can tell
+    # that their copy of the user is stale
+    'user_versions': '''
+        CREATE TABLE IF NOT EXISTS user_versions (
+            mfp_username text,
+            version bigint
+        )
+        ''',
+    'food_frequency': '''
+        CREATE TABLE IF NOT EXISTS food_frequency (
+            mfp_username text,
+            month DATE,
+            item text,
+            entries int,
+            days int,
+            %s,
+            PRIMARY KEY (mfp_username, month, item)
+        )
+        ''' % ',\n            '.join('%s bigint' % col for col in FOOD_STAT_NUTRIENTS),
+    'scrape_runs': '''
+        CREATE TABLE IF NOT EXISTS scrape_runs (
+            id {serial},
+            scraper text,
+            subject text,
+            date_start DATE,
+            date_end DATE,
+            days int,
+            host text,
+            started_at double precision,
+            wall_seconds double precision,
+            parse_cpu_seconds double precision,
+            pages_requested int,
+            pages_succeeded int,
+            bytes bigint,
+            throttled int,
+            error text
+        )
+        ''',
+    # Times are epoch seconds of the enqueuing or working process
+    'scrape_jobs': '''
+        CREATE TABLE IF NOT EXISTS scrape_jobs (
+            id {serial},
+            mfp_username text,
+            date_start DATE,
+            date_end DATE,
+            kind text,
+            priority int,
+            state text,
+            attempts int,
+            max_attempts int,
+            enqueued_at double precision,
+            run_at double precision,
+            started_at double precision,
+            lease_expires_at double precision,
+            finished_at double precision,
+            worker text,
+            last_error text
+        )
+        ''',
+    # Dashboard sessions waiting on a prefetch job, which is cancelled once none is left
+    'scrape_job_sessions': '''
+        CREATE TABLE IF NOT EXISTS scrape_job_sessions (
+            job_id int,
+            session_id text
+        )
+        ''',
+}
+
+INSERT_NUTRITION_SQL = '''
+INSERT INTO nutrition (mfp_username, entry_date, item,
+    calories, protein, carbohydrates, fat, fiber, sugar, saturated_fat,
+    polyunsaturated_fat, monounsaturated_fat, trans_fat, cholesterol,
+    sodium, potassium, vitamin_a, vitamin_c, calcium, iron)
+VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s);
+'''
+
+ITER_NUTRITION_SQL = '''
+SELECT %s FROM nutrition
+WHERE mfp_username = %%s AND entry_date >= %%s AND entry_date <= %%s
+ORDER BY entry_date, id;
+''' % ', '.join(NUTRITION_COLUMNS)
+
+# Rows fetched from the database at a time by Storage.iter_nutrition
+ITER_BATCH_ROWS = 5000
+
+DELETE_NUTRITION_SQL = '''
+DELETE FROM nutrition
+WHERE mfp_username = %s AND entry_date >= %s AND entry_date <= %s;
+'''
+
+INSERT_GROUP_STATS_SQL = '''
+INSERT INTO group_daily_stats (%s)
+VALUES (%s);
+''' % (', '.join(GROUP_STAT_COLUMNS), ', '.join(['%s']*len(GROUP_STAT_COLUMNS)))
+
+DELETE_GROUP_STATS_SQL = '''
+DELETE FROM group_daily_stats
+WHERE group_name = %s AND entry_date >= %s AND entry_date <= %s;
+'''
+
+# Columns returned for a claimed scrape job
+JOB_COLUMNS = ['id', 'mfp_username', 'date_start', 'date_end', 'kind', 'attempts', 'max_attempts', 'enqueued_at', 'run_at']
+
+# {lock} is replaced with the row locking clause of the backend
+CLAIM_JOB_SQL = '''
+UPDATE scrape_jobs
+SET state = 'running', worker = %s, attempts = attempts + 1, started_at = %s, lease_expires_at = %s
+WHERE state = 'queued' AND id = (
+    SELECT id FROM scrape_jobs
+    WHERE state = 'queued' AND run_at <= %s
+    ORDER BY priority, run_at, id
+    LIMIT 1{lock}
+)
+RETURNING {columns};
+'''
+
+CLAIM_JOB_ID_SQL = '''
+UPDATE scrape_jobs
+SET state = 'running', worker = %s, attempts = attempts + 1, started_at = %s, lease_expires_at = %s
+WHERE id = %s AND state = 'queued'
+RETURNING {columns};
+'''
+
+INSERT_FOOD_FREQUENCY_SQL = '''
+INSERT INTO food_frequency (%s)
+VALUES (%s);
+''' % (', '.join(FOOD_FREQUENCY_COLUMNS), ', '.join(['%s']*len(FOOD_FREQUENCY_COLUMNS)))
+
+DELETE_FOOD_FREQUENCY_SQL = '''
+DELETE FROM food_frequency
+WHERE mfp_username = %s AND month >= %s AND month <= %s;
+'''
+
+INSERT_SCRAPE_RUN_SQL = '''
+INSERT INTO scrape_runs (%s)
+VALUES (%s);
+''' % (', '.join(SCRAPE_RUN_COLUMNS), ', '.join(['%s']*len(SCRAPE_RUN_COLUMNS)))
+
+INDEXES = [
+    '''
+    CREATE INDEX IF NOT EXISTS nutrition_user_date_idx
+    ON nutrition (mfp_username, entry_date)
+    ''',
+    '''
+    CREATE INDEX IF NOT EXISTS group_users_group_idx
+    ON group_users (group_name, mfp_username)
+    ''',
+    '''
+    CREATE INDEX IF NOT EXISTS group_users_user_idx
+    ON group_users (mfp_username)
+    ''',
+    '''
+    CREATE INDEX IF NOT EXISTS scrape_coverage_user_idx
+    ON scrape_coverage (mfp_username)
+    ''',
+    '''
+    CREATE INDEX IF NOT EXISTS food_frequency_item_idx
+    ON food_frequency (item)
+    ''',
+    '''
+    CREATE INDEX IF NOT EXISTS scrape_runs_started_idx
+    ON scrape_runs (started_at)
+    ''',
+    '''
+    CREATE INDEX IF NOT EXISTS scrape_jobs_claim_idx
+    ON scrape_jobs (state, priority, run_at)
+    ''',
+    '''
+    CREATE INDEX IF NOT EXISTS scrape_jobs_user_idx
+    ON scrape_jobs (mfp_username, state)
+    ''',
+    '''
+    CREATE INDEX IF NOT EXISTS scrape_job_sessions_job_idx
+    ON scrape_job_sessions (job_id)
+    '''
+]
+
+# First key of the Postgres advisory locks taken by ingest_lock(), so they never
+# collide with advisory locks taken by other applications on the same database
+INGEST_LOCK_NAMESPACE = 0x4d4650
+
+
+class Storage:
+    '''
+    Base class for the databases that can sit behind db.update_db.
+
+    Every backend supports the same ingest (insert_nutrition) and range read
+    (read_nutrition) operations. SQL is written with the psycopg2 '%s' paramstyle
+    and translated by sql() for backends that use a different placeholder.
+
+    class variables:
+        name (str) -- backend name used in the [storage] section of database.ini
+        placeholder (str) -- DB-API parameter placeholder of the backend
+        serial (str) -- column definition of an auto-incrementing primary key
+        job_lock (str) -- clause locking the scrape job selected by claim_job
+    '''
+    name = None
+    placeholder = '%s'
+    serial = 'SERIAL PRIMARY KEY'
+    job_lock = ''
+
+    def connect(self):
+        '''Return a new DB-API connection to the backend'''
+        raise NotImplementedError
+
+    def sql(self, statement):
+        '''
+        Translate a statement written with '%s' placeholders to the backend paramstyle
+
+        parameters:
+            statement (str) -- sql statement
+        '''
+        if self.placeholder == '%s':
+            return statement
+        return statement.replace('%s', self.placeholder)
+
+    def table_statements(self):
+        '''Return the CREATE statements for every table and index'''
+        commands = [ddl.format(serial=self.serial) for ddl in TABLES.values()]
+        return commands + INDEXES
+
+    def create_tables(self):
+        '''Create all tables used by the dashboard if they do not exist yet'''
+        conn = self.connect()
+        try:
+            cur = conn.cursor()
+            for command in self.table_statements():
+                cur.execute(command)
+            conn.commit()
+            cur.close()
+        finally:
+            conn.close()
+
+    def executemany(self, sql, rows):
+        '''
+        Execute the input SQL statement once for every row and commit
+
+        parameters:
+            sql (str) -- sql statement with '%s' placeholders
+            rows (iterable of tuples) -- parameters for each execution
+        '''
+        rows = list(rows)
+        if not rows:
+            return 0
+        conn = self.connect()
+        try:
+            cur = conn.cursor()
+            cur.executemany(self.sql(sql), rows)
+            conn.commit()
+            cur.close()
+        finally:
+            conn.close()
+        return len(rows)
+
+    def fetchall(self, sql, params=()):
+        '''
+        Return every record produced by the input query
+
+        parameters:
+            sql (str) -- sql query with '%s' placeholders
+            params (tuple) -- query parameters
+        '''
+        conn = self.connect()
+        try:
+            cur = conn.cursor()
+            cur.execute(self.sql(sql), params)
+            records = cur.fetchall()
+            cur.close()
+        finally:
+            conn.close()
+        return records
+
+    def read_sql(self, sql, params=()):
+        '''
+        Return the records produced by the input query as a dataframe
+
+        parameters:
+            sql (str) -- sql query with '%s' placeholders
+            params (tuple) -- query parameters
+        '''
+        conn = self.connect()
+        try:
+            df = psql.read_sql(self.sql(sql), conn, params=tuple(params))
+        finally:
+            conn.close()
+        return df
+
+    def execute_returning(self, sql, params=()):
+        '''
+        Execute a statement with a RETURNING clause, commit and return the returned records
+
+        parameters:
+            sql (str) -- sql statement with '%s' placeholders
+            params (tuple) -- statement parameters
+        '''
+        conn = self.connect()
+        try:
+            cur = conn.cursor()
+            cur.execute(self.sql(sql), tuple(params))
+            records = cur.fetchall()
+            conn.commit()
+            cur.close()
+        finally:
+            conn.close()
+        return records
+
+    def replace_rows(self, delete_sql, delete_params, insert_sql, rows):
+        '''
+        Delete rows and insert their replacements in one transaction
+
+        parameters:
+            delete_sql (str) -- delete statement with '%s' placeholders
+            delete_params (tuple) -- parameters of the delete statement
+            insert_sql (str) -- insert statement with '%s' placeholders
+            rows (list of tuples) -- parameters of each insert
+        '''
+        conn = self.connect()
+        try:
+            cur = conn.cursor()
+            cur.execute(self.sql(delete_sql), tuple(delete_params))
+            if rows:
+                cur.executemany(self.sql(insert_sql), rows)
+            conn.commit()
+            cur.close()
+        finally:
+            conn.close()
+        return len(rows)
+
+    def insert_nutrition(self, rows):
+        '''
+        Insert nutrition rows and return the number of rows written
+
+        parameters:
+            rows (iterable of tuples) -- values ordered as NUTRITION_COLUMNS
+        '''
+        return self.executemany(INSERT_NUTRITION_SQL, rows)
+
+    def replace_nutrition(self, user, date_start, date_end, rows):
+        '''
+        Replace the stored nutrition rows of the user between the given dates in one
+        transaction and return the number of rows written
+
+        parameters:
+            user (str) -- username
+            date_start (str) -- first date formatted %Y-%m-%d
+            date_end (str) -- last date formatted %Y-%m-%d
+            rows (list of tuples) -- values ordered as NUTRITION_COLUMNS
+        '''
+        return self.replace_rows(DELETE_NUTRITION_SQL, (user, date_start, date_end), INSERT_NUTRITION_SQL, rows)
+
+    def last_entry_date(self, user):
+        '''
+        Return the most recent entry date stored for the user as a %Y-%m-%d string,
+        or None if the user has no rows.
+
+        parameters:
+            user (str) -- username
+        '''
+        records = self.fetchall('''
+            SELECT MAX(entry_date)
+            FROM nutrition
+            WHERE mfp_username = %s;
+            ''', (user,))
+        if not records or records[0][0] is None:
+            return None
+        return to_date_string(records[0][0])
+
+    def read_nutrition(self, user, date_start, date_end):
+        '''
+        Return all nutrition rows for the user between the given dates as a dataframe
+
+        parameters:
+            user (str) -- username
+            date_start (str) -- start date
+            date_end (str) -- end date
+        '''
+        sql = self.sql('''
+            SELECT * FROM nutrition
+            WHERE mfp_username = %s AND entry_date >= %s AND entry_date <= %s;
+            ''')
+        conn = self.connect()
+        try:
+            df = psql.read_sql(sql, conn, params=(user, date_start, date_end))
+        finally:
+            conn.close()
+        return df
+
+    def iter_nutrition(self, user, date_start, date_end, batch_size=ITER_BATCH_ROWS):
+        '''
+        Yield the nutrition rows of the user between the given dates, ordered by date,
+        as lists of at most batch_size tuples ordered as NUTRITION_COLUMNS. Rows are
+        fetched from the cursor batch by batch, so the range is never held in memory.
+
+        parameters:
+            user (str) -- username
+            date_start (str) -- start date
+            date_end (str) -- end date
+            batch_size (int) -- rows per batch
+        '''
+        conn = self.connect()
+        try:
+            cur = self.streaming_cursor(conn, batch_size)
+            cur.execute(self.sql(ITER_NUTRITION_SQL), (user, date_start, date_end))
+            while True:
+                rows = cur.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield rows
+            cur.close()
+        finally:
+            conn.close()
+
+    def streaming_cursor(self, conn, batch_size):
+        '''Return a cursor that fetches query results incrementally'''
+        return conn.cursor()
+
+    def daily_totals(self, user, date_start, date_end):
+        '''
+        Return the per-day sums of DAILY_TOTAL_COLUMNS for the user between the given dates
+
+        parameters:
+            user (str) -- username
+            date_start (str) -- start date
+            date_end (str) -- end date
+        '''
+        sums = ', '.join('SUM(%s) AS %s' % (col, col) for col in DAILY_TOTAL_COLUMNS)
+        sql = self.sql('''
+            SELECT entry_date, %s FROM nutrition
+            WHERE mfp_username = %%s AND entry_date >= %%s AND entry_date <= %%s
+            GROUP BY entry_date
+            ORDER BY entry_date;
+            ''' % sums)
+        conn = self.connect()
+        try:
+            df = psql.read_sql(sql, conn, params=(user, date_start, date_end))
+        finally:
+            conn.close()
+        return df
+
+    def user_groups(self, user):
+        '''
+        Return the names of the groups the user belongs to
+
+        parameters:
+            user (str) -- username
+        '''
+        records = self.fetchall('''
+            SELECT DISTINCT group_name FROM group_users
+            WHERE mfp_username = %s
+            ORDER BY group_name;
+            ''', (user,))
+        return [record[0] for record in records]
+
+    def group_member_count(self, group_name):
+        '''
+        Return the number of members of the group
+
+        parameters:
+            group_name (str) -- group name
+        '''
+        records = self.fetchall('''
+            SELECT COUNT(DISTINCT mfp_username) FROM group_users
+            WHERE group_name = %s;
+            ''', (group_name,))
+        return records[0][0] if records else 0
+
+    def group_member_daily_totals(self, group_name, date_start, date_end):
+        '''
+        Return the per-day sums of GROUP_STAT_NUTRIENTS of every group member who
+        logged food between the given dates, one row per member and day
+
+        parameters:
+            group_name (str) -- group name
+            date_start (str) -- start date
+            date_end (str) -- end date
+        '''
+        sums = ', '.join('SUM(n.%s) AS %s' % (col, col) for col in GROUP_STAT_NUTRIENTS)
+        return self.read_sql('''
+            SELECT n.mfp_username, n.entry_date, %s
+            FROM nutrition n
+            JOIN (
+                SELECT DISTINCT mfp_username FROM group_users WHERE group_name = %%s
+            ) g ON g.mfp_username = n.mfp_username
+            WHERE n.entry_date >= %%s AND n.entry_date <= %%s AND n.item IS NOT NULL
+            GROUP BY n.mfp_username, n.entry_date
+            ORDER BY n.entry_date;
+            ''' % sums, (group_name, date_start, date_end))
+
+    def replace_group_daily_stats(self, group_name, date_start, date_end, rows):
+        '''
+        Replace the stored statistics of the group between the given dates in one transaction
+
+        parameters:
+            group_name (str) -- group name
+            date_start (str) -- start date
+            date_end (str) -- end date
+            rows (list of tuples) -- values ordered as GROUP_STAT_COLUMNS
+        '''
+        return self.replace_rows(
+            DELETE_GROUP_STATS_SQL, (group_name, date_start, date_end), INSERT_GROUP_STATS_SQL, rows)
+
+    def food_daily_totals(self, user, date_start, date_end):
+        '''
+        Return the number of entries and the sums of FOOD_STAT_NUTRIENTS of every
+        food the user logged between the given dates, one row per day and food
+
+        parameters:
+            user (str) -- username
+            date_start (str) -- start date
+            date_end (str) -- end date
+        '''
+        sums = ', '.join('SUM(%s) AS %s' % (col, col) for col in FOOD_STAT_NUTRIENTS)
+        return self.read_sql('''
+            SELECT entry_date, item, COUNT(*) AS entries, %s
+            FROM nutrition
+            WHERE mfp_username = %%s AND entry_date >= %%s AND entry_date <= %%s AND item IS NOT NULL
+            GROUP BY entry_date, item;
+            ''' % sums, (user, date_start, date_end))
+
+    def replace_food_frequency(self, user, month_start, month_end, rows):
+        '''
+        Replace the stored food frequency rows of the user between the given months in one transaction
+
+        parameters:
+            user (str) -- username
+            month_start (str) -- first day of the first month formatted %Y-%m-%d
+            month_end (str) -- first day of the last month formatted %Y-%m-%d
+            rows (list of tuples) -- values ordered as FOOD_FREQUENCY_COLUMNS
+        '''
+        return self.replace_rows(
+            DELETE_FOOD_FREQUENCY_SQL, (user, month_start, month_end), INSERT_FOOD_FREQUENCY_SQL, rows)
+
+    def read_food_frequency(self, user, month_start, month_end):
+        '''
+        Return the entries, days and nutrient sums of every food of the user summed
+        over the stored months between the given ones, as a dataframe
+
+        parameters:
+            user (str) -- username
+            month_start (str) -- first day of the first month formatted %Y-%m-%d
+            month_end (str) -- first day of the last month formatted %Y-%m-%d
+        '''
+        sums = ', '.join('SUM(%s) AS %s' % (col, col) for col in FOOD_FREQUENCY_COLUMNS[3:])
+        return self.read_sql('''
+            SELECT item, %s FROM food_frequency
+            WHERE mfp_username = %%s AND month >= %%s AND month <= %%s
+            GROUP BY item;
+            ''' % sums, (user, month_start, month_end))
+
+    def distinct_food_items(self):
+        '''Return the name of every food logged by any user'''
+        return [record[0] for record in self.fetchall('SELECT DISTINCT item FROM food_frequency;')]
+
+    def food_item_stats(self, items):
+        '''
+        Return the number of users who logged each of the foods, its entries and days
+        logged, and its nutrient sums over every user, as a dataframe
+
+        parameters:
+            items (list of str) -- food names
+        '''
+        sums = ', '.join('SUM(%s) AS %s' % (col, col) for col in FOOD_FREQUENCY_COLUMNS[3:])
+        if not items:
+            return pd.DataFrame(columns=['item', 'users'] + FOOD_FREQUENCY_COLUMNS[3:])
+        return self.read_sql('''
+            SELECT item, COUNT(DISTINCT mfp_username) AS users, %s
+            FROM food_frequency
+            WHERE item IN (%s)
+            GROUP BY item;
+            ''' % (sums, ', '.join(['%s']*len(items))), tuple(items))
+
+    def read_coverage(self, user):
+        '''
+        Return the stored scraped date intervals of the user as (date_start, date_end)
+        tuples formatted %Y-%m-%d
+
+        parameters:
+            user (str) -- username
+        '''
+        records = self.fetchall('''
+            SELECT date_start, date_end FROM scrape_coverage
+            WHERE mfp_username = %s
+            ORDER BY date_start;
+            ''', (user,))
+        return [(to_date_string(start), to_date_string(end)) for start, end in records]
+
+    def replace_coverage(self, user, intervals):
+        '''
+        Replace the stored scraped date intervals of the user
+
+        parameters:
+            user (str) -- username
+            intervals (list of tuples) -- (date_start, date_end) formatted %Y-%m-%d
+        '''
+        return self.replace_rows(
+            'DELETE FROM scrape_coverage WHERE mfp_username = %s;', (user,),
+            'INSERT INTO scrape_coverage (mfp_username, date_start, date_end) VALUES (%s, %s, %s);',
+            [(user, start, end) for start, end in intervals])
+
+    def user_version(self, user):
+        '''
+        Return the number of times the user's rows were written, 0 if never
+
+        parameters:
+            user (str) -- username
+        '''
+        records = self.fetchall('SELECT version FROM user_versions WHERE mfp_username = %s;', (user,))
+        return records[0][0] if records else 0
+
+    def read_user_versions(self):
+        '''Return the version of every user whose rows were written, as a dict keyed by username'''
+        return dict(self.fetchall('SELECT mfp_username, version FROM user_versions;'))
+
+    def bump_user_version(self, user):
+        '''
+        Increment the version of the user after the user's rows were written. Called
+        under the user's ingest_lock, so increments never race.
+
+        parameters:
+            user (str) -- username
+        '''
+        return self.replace_rows(
+            'DELETE FROM user_versions WHERE mfp_username = %s;', (user,),
+            'INSERT INTO user_versions (mfp_username, version) VALUES (%s, %s);',
+            [(user, self.user_version(user) + 1)])
+
+    def insert_scrape_run(self, row):
+        '''
+        Append one scraper run to the scrape_runs ledger
+
+        parameters:
+            row (tuple) -- values ordered as SCRAPE_RUN_COLUMNS
+        '''
+        return self.executemany(INSERT_SCRAPE_RUN_SQL, [row])
+
+    def read_scrape_runs(self, since):
+        '''
+        Return the scraper runs started since the given time as a dataframe
+
+        parameters:
+            since (float) -- epoch time
+        '''
+        return self.read_sql('''
+            SELECT %s FROM scrape_runs
+            WHERE started_at >= %%s
+            ORDER BY started_at;
+            ''' % ', '.join(SCRAPE_RUN_COLUMNS), (since,))
+
+    def enqueue_job(self, user, date_start, date_end, kind, priority, max_attempts, now):
+        '''
+        Queue a scrape job of the user's dates and return its id. If a queued or running
+        job of the same kind already covers the dates, its id is returned instead.
+
+        parameters:
+            user (str) -- username
+            date_start (str) -- first date formatted %Y-%m-%d
+            date_end (str) -- last date formatted %Y-%m-%d
+            kind (str) -- job kind, e.g. 'interactive' or 'backfill'
+            priority (int) -- jobs with lower values are claimed first
+            max_attempts (int) -- attempts before the job is marked failed
+            now (float) -- current epoch time
+        '''
+        records = self.fetchall('''
+            SELECT id FROM scrape_jobs
+            WHERE mfp_username = %s AND kind = %s AND state IN ('queued', 'running')
+                AND date_start <= %s AND date_end >= %s
+            ORDER BY id
+            LIMIT 1;
+            ''', (user, kind, date_start, date_end))
+        if records:
+            return records[0][0]
+        return self.execute_returning('''
+            INSERT INTO scrape_jobs (mfp_username, date_start, date_end, kind, priority,
+                state, attempts, max_attempts, enqueued_at, run_at)
+            VALUES (%s, %s, %s, %s, %s, 'queued', 0, %s, %s, %s)
+            RETURNING id;
+            ''', (user, date_start, date_end, kind, priority, max_attempts, now, now))[0][0]
+
+    def claim_job(self, worker, now, lease_seconds):
+        '''
+        Lease the runnable queued job with the lowest priority value to the worker and
+        return it as a dict of JOB_COLUMNS, or None if no job is runnable. The lease
+        expires after lease_seconds unless it is extended with heartbeat_job.
+
+        parameters:
+            worker (str) -- worker name
+            now (float) -- current epoch time
+            lease_seconds (float) -- lease duration
+        '''
+        # Claims of threads sharing this process are serialized, the row lock of the
+        # backend keeps workers in other processes from claiming the same job
+        with _job_claim_lock:
+            records = self.execute_returning(
+                CLAIM_JOB_SQL.format(lock=self.job_lock, columns=', '.join(JOB_COLUMNS)),
+                (worker, now, now + lease_seconds, now))
+        if not records:
+            return None
+        job = dict(zip(JOB_COLUMNS, records[0]))
+        job['date_start'] = to_date_string(job['date_start'])
+        job['date_end'] = to_date_string(job['date_end'])
+        return job
+
+    def claim_job_id(self, job_id, worker, now, lease_seconds):
+        '''
+        Lease the job to the worker if it is still queued and return it as a dict of
+        JOB_COLUMNS, or None if it was claimed or cancelled meanwhile
+
+        parameters:
+            job_id (int) -- job id
+            worker (str) -- worker name
+            now (float) -- current epoch time
+            lease_seconds (float) -- lease duration
+        '''
+        records = self.execute_returning(CLAIM_JOB_ID_SQL.format(columns=', '.join(JOB_COLUMNS)),
+                                         (worker, now, now + lease_seconds, job_id))
+        if not records:
+            return None
+        job = dict(zip(JOB_COLUMNS, records[0]))
+        job['date_start'] = to_date_string(job['date_start'])
+        job['date_end'] = to_date_string(job['date_end'])
+        return job
+
+    def heartbeat_job(self, job_id, worker, now, lease_seconds):
+        '''
+        Extend the lease of a running job and return False if the worker no longer holds it
+
+        parameters:
+            job_id (int) -- job id
+            worker (str) -- worker name
+            now (float) -- current epoch time
+            lease_seconds (float) -- lease duration from now
+        '''
+        return bool(self.execute_returning('''
+            UPDATE scrape_jobs SET lease_expires_at = %s
+            WHERE id = %s AND worker = %s AND state = 'running'
+            RETURNING id;
+            ''', (now + lease_seconds, job_id, worker)))
+
+    def finish_job(self, job_id, worker, state, now, run_at=None, error=None):
+        '''
+        Release a job leased to the worker as 'done', 'failed', or 'queued' again to be
+        retried at run_at. Returns False if the worker no longer held the lease.
+
+        parameters:
+            job_id (int) -- job id
+            worker (str) -- worker name
+            state (str) -- 'done', 'failed' or 'queued'
+            now (float) -- current epoch time
+            run_at (float) -- epoch time of the retry of a queued job
+            error (str) -- error of the failed attempt
+        '''
+        return bool(self.execute_returning('''
+            UPDATE scrape_jobs
+            SET state = %s, run_at = %s, finished_at = %s, last_error = %s, lease_expires_at = NULL
+            WHERE id = %s AND worker = %s AND state = 'running'
+            RETURNING id;
+            ''', (state, run_at or now, None if state == 'queued' else now, error, job_id, worker)))
+
+    def requeue_expired_jobs(self, now):
+        '''
+        Queue the running jobs whose lease expired again, or mark them failed once they
+        used all their attempts, and return them as (id, kind, state) tuples
+
+        parameters:
+            now (float) -- current epoch time
+        '''
+        return self.execute_returning('''
+            UPDATE scrape_jobs
+            SET state = CASE WHEN attempts >= max_attempts THEN 'failed' ELSE 'queued' END,
+                finished_at = CASE WHEN attempts >= max_attempts THEN %s ELSE NULL END,
+                run_at = %s, lease_expires_at = NULL, last_error = 'lease expired'
+            WHERE state = 'running' AND lease_expires_at < %s
+            RETURNING id, kind, state;
+            ''', (now, now, now))
+
+    def job_state(self, job_id):
+        '''
+        Return the state of the job, or None if it does not exist
+
+        parameters:
+            job_id (int) -- job id
+        '''
+        records = self.fetchall('SELECT state FROM scrape_jobs WHERE id = %s;', (job_id,))
+        return records[0][0] if records else None
+
+    def add_job_session(self, job_id, session):
+        '''
+        Record a dashboard session waiting on the job and return the number of sessions
+        waiting on it
+
+        parameters:
+            job_id (int) -- job id
+            session (str) -- session id
+        '''
+        self.executemany('''
+            INSERT INTO scrape_job_sessions (job_id, session_id)
+            SELECT %s, %s
+            WHERE NOT EXISTS (SELECT 1 FROM scrape_job_sessions WHERE job_id = %s AND session_id = %s);
+            ''', [(job_id, session, job_id, session)])
+        return self.fetchall('SELECT COUNT(*) FROM scrape_job_sessions WHERE job_id = %s;', (job_id,))[0][0]
+
+    def cancel_job_session(self, job_id, session, now):
+        '''
+        Drop a session waiting on the job, and cancel the job if it was the last one and
+        the job is queued or running. Returns True if the job was cancelled.
+
+        parameters:
+            job_id (int) -- job id
+            session (str) -- session id
+            now (float) -- current epoch time
+        '''
+        self.executemany('DELETE FROM scrape_job_sessions WHERE job_id = %s AND session_id = %s;',
+                         [(job_id, session)])
+        return bool(self.execute_returning('''
+            UPDATE scrape_jobs SET state = 'cancelled', finished_at = %s, lease_expires_at = NULL
+            WHERE id = %s AND state IN ('queued', 'running')
+                AND NOT EXISTS (SELECT 1 FROM scrape_job_sessions WHERE job_id = %s)
+            RETURNING id;
+            ''', (now, job_id, job_id)))
+
+    def job_counts(self):
+        '''Return (kind, state, count, oldest enqueued_at) tuples for every kind and state of scrape job'''
+        return self.fetchall('''
+            SELECT kind, state, COUNT(*), MIN(enqueued_at) FROM scrape_jobs
+            GROUP BY kind, state
+            ORDER BY kind, state;
+            ''')
+
+    def purge_jobs(self, before):
+        '''
+        Delete the done, failed and cancelled jobs finished before the given time and
+        return their number
+
+        parameters:
+            before (float) -- epoch time
+        '''
+        purged = len(self.execute_returning('''
+            DELETE FROM scrape_jobs
+            WHERE state IN ('done', 'failed', 'cancelled') AND finished_at < %s
+            RETURNING id;
+            ''', (before,)))
+        self.executemany('''
+            DELETE FROM scrape_job_sessions
+            WHERE job_id NOT IN (SELECT id FROM scrape_jobs WHERE state IN ('queued', 'running'));
+            ''', [()])
+        return purged
+
+    @contextmanager
+    def ingest_lock(self, user):
+        '''
+        Hold an exclusive per-user lock while the user's rows are ingested, shared by
+        every thread and process using the same database file. Yields True if another
+        holder had to be waited on, in which case it may already have done the ingest.
+
+        This implementation locks a file next to the database with flock, for the
+        embedded backends. Without fcntl (Windows) it only covers the current process.
+
+        parameters:
+            user (str) -- username
+        '''
+        lock_path = self._lock_path(user)
+        with open(lock_path, 'a') as f:
+            if fcntl is None:
+                with _thread_lock(lock_path) as waited:
+                    yield waited
+                return
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                waited = False
+            except BlockingIOError:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                waited = True
+            try:
+                yield waited
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def ingest_lock_held(self, user):
+        '''
+        Return True if ingest_lock(user) is held by someone, without waiting for it
+
+        parameters:
+            user (str) -- username
+        '''
+        lock_path = self._lock_path(user)
+        with open(lock_path, 'a') as f:
+            if fcntl is None:
+                lock = _thread_locks.get(lock_path)
+                return lock is not None and lock.locked()
+            try:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return True
+            fcntl.flock(f, fcntl.LOCK_UN)
+            return False
+
+    def _lock_path(self, user):
+        directory = '%s.locks' % self.path
+        os.makedirs(directory, exist_ok=True)
+        return os.path.join(directory, '%s.lock' % hashlib.sha1(user.encode()).hexdigest())
+
+    def read_group_daily_stats(self, group_name, date_start, date_end):
+        '''
+        Return the stored statistics of the group between the given dates as a dataframe
+
+        parameters:
+            group_name (str) -- group name
+            date_start (str) -- start date
+            date_end (str) -- end date
+        '''
+        return self.read_sql('''
+            SELECT %s FROM group_daily_stats
+            WHERE group_name = %%s AND entry_date >= %%s AND entry_date <= %%s
+            ORDER BY entry_date;
+            ''' % ', '.join(GROUP_STAT_COLUMNS), (group_name, date_start, date_end))
+
+
+class PostgresStorage(Storage):
+    '''
+    PostgreSQL server configured by the [postgresql] section of database.ini
+    '''
+    name = 'postgresql'
+    # Workers on any node skip the job rows other workers are claiming
+    job_lock = ' FOR UPDATE SKIP LOCKED'
+
+    def __init__(self, params=None):
+        if psycopg2 is None:
+            raise ImportError('psycopg2 is required for the postgresql storage backend')
+        self.params = params
+
+    def connect(self):
+        if self.params is None:
+            # Load config parameters from database.ini
+            self.params = config()
+        return psycopg2.connect(**self.params)
+
+    def streaming_cursor(self, conn, batch_size):
+        # A named cursor keeps the result on the server and fetches it in batches
+        cur = conn.cursor(name='mfp_iter_nutrition')
+        cur.itersize = batch_size
+        return cur
+
+    @contextmanager
+    def ingest_lock(self, user):
+        # A session-level advisory lock covers every worker and node using the
+        # database, and is released by the server if this process dies
+        key = (INGEST_LOCK_NAMESPACE, lock_key(user))
+        conn = self.connect()
+        conn.autocommit = True
+        try:
+            cur = conn.cursor()
+            cur.execute('SELECT pg_try_advisory_lock(%s, %s);', key)
+            waited = not cur.fetchone()[0]
+            if waited:
+                cur.execute('SELECT pg_advisory_lock(%s, %s);', key)
+            try:
+                yield waited
+            finally:
+                cur.execute('SELECT pg_advisory_unlock(%s, %s);', key)
+                cur.close()
+        finally:
+            conn.close()
+
+    def ingest_lock_held(self, user):
+        key = (INGEST_LOCK_NAMESPACE, lock_key(user))
+        conn = self.connect()
+        conn.autocommit = True
+        try:
+            cur = conn.cursor()
+            cur.execute('SELECT pg_try_advisory_lock(%s, %s);', key)
+            if not cur.fetchone()[0]:
+                return True
+            cur.execute('SELECT pg_advisory_unlock(%s, %s);', key)
+            return False
+        finally:
+            conn.close()
+
+
+class DuckDBStorage(Storage):
+    '''
+    Embedded, columnar DuckDB database stored in a single local file
+    '''
+    name = 'duckdb'
+    placeholder = '?'
+
+    def __init__(self, path=None):
+        if duckdb is None:
+            raise ImportError('duckdb is required for the duckdb storage backend')
+        self.path = path or os.path.join(BASEDIR, 'mfp.duckdb')
+
+    def connect(self):
+        # Concurrent connects to the same file from several threads can fail to
+        # attach it, which job queue polling makes frequent
+        with _duckdb_connect_lock:
+            return duckdb.connect(self.path)
+
+    def table_statements(self):
+        # DuckDB has no SERIAL type, so every table gets its own sequence
+        commands = []
+        for table, ddl in TABLES.items():
+            sequence = '%s_id_seq' % table
+            commands.append('CREATE SEQUENCE IF NOT EXISTS %s' % sequence)
+            commands.append(ddl.format(serial="INTEGER PRIMARY KEY DEFAULT nextval('%s')" % sequence))
+        return commands + INDEXES
+
+    def create_tables(self):
+        conn = self.connect()
+        try:
+            for command in self.table_statements():
+                conn.execute(command)
+        finally:
+            conn.close()
+
+    def executemany(self, sql, rows):
+        rows = list(rows)
+        if not rows:
+            return 0
+        conn = self.connect()
+        try:
+            conn.executemany(self.sql(sql), rows)
+        finally:
+            conn.close()
+        return len(rows)
+
+    def insert_nutrition(self, rows):
+        rows = list(rows)
+        if not rows:
+            return 0
+        conn = self.connect()
+        try:
+            # Append the rows through a dataframe so the insert is a single columnar scan
+            conn.register('nutrition_rows', pd.DataFrame(rows, columns=NUTRITION_COLUMNS))
+            conn.execute('INSERT INTO nutrition (%s) SELECT * FROM nutrition_rows' % ', '.join(NUTRITION_COLUMNS))
+            conn.unregister('nutrition_rows')
+        finally:
+            conn.close()
+        return len(rows)
+
+    def fetchall(self, sql, params=()):
+        conn = self.connect()
+        try:
+            records = conn.execute(self.sql(sql), list(params)).fetchall()
+        finally:
+            conn.close()
+        return records
+
+    def read_sql(self, sql, params=()):
+        conn = self.connect()
+        try:
+            df = conn.execute(self.sql(sql), list(params)).df()
+        finally:
+            conn.close()
+        return df
+
+    def execute_returning(self, sql, params=()):
+        conn = self.connect()
+        try:
+            records = conn.execute(self.sql(sql), list(params)).fetchall()
+        finally:
+            conn.close()
+        return records
+
+    def replace_rows(self, delete_sql, delete_params, insert_sql, rows):
+        conn = self.connect()
+        try:
+            conn.begin()
+            conn.execute(self.sql(delete_sql), list(delete_params))
+            if rows:
+                conn.executemany(self.sql(insert_sql), rows)
+            conn.commit()
+        finally:
+            conn.close()
+        return len(rows)
+
+    def replace_nutrition(self, user, date_start, date_end, rows):
+        conn = self.connect()
+        try:
+            conn.begin()
+            conn.execute(self.sql(DELETE_NUTRITION_SQL), [user, date_start, date_end])
+            if rows:
+                conn.register('nutrition_rows', pd.DataFrame(rows, columns=NUTRITION_COLUMNS))
+                conn.execute('INSERT INTO nutrition (%s) SELECT * FROM nutrition_rows' % ', '.join(NUTRITION_COLUMNS))
+                conn.unregister('nutrition_rows')
+            conn.commit()
+        finally:
+            conn.close()
+        return len(rows)
+
+    def read_nutrition(self, user, date_start, date_end):
+        conn = self.connect()
+        try:
+            df = conn.execute(self.sql('''
+                SELECT * FROM nutrition
+                WHERE mfp_username = %s AND entry_date >= %s AND entry_date <= %s;
+                '''), [user, date_start, date_end]).df()
+        finally:
+            conn.close()
+        return df
+
+    def iter_nutrition(self, user, date_start, date_end, batch_size=ITER_BATCH_ROWS):
+        # Page through the range by (entry_date, id) so only one batch is materialized at a time
+        sql = self.sql('''
+            SELECT id, %s FROM nutrition
+            WHERE mfp_username = %%s AND entry_date >= %%s AND entry_date <= %%s
+                AND (entry_date > %%s OR (entry_date = %%s AND id > %%s))
+            ORDER BY entry_date, id
+            LIMIT %d;
+            ''' % (', '.join(NUTRITION_COLUMNS), batch_size))
+        last_date, last_id = date_start, -1
+        conn = self.connect()
+        try:
+            while True:
+                rows = conn.execute(sql, [user, date_start, date_end, last_date, last_date, last_id]).fetchall()
+                if not rows:
+                    break
+                last_id, last_date = rows[-1][0], rows[-1][2]
+                yield [row[1:] for row in rows]
+        finally:
+            conn.close()
+
+    def daily_totals(self, user, date_start, date_end):
+        sums = ', '.join('SUM(%s) AS %s' % (col, col) for col in DAILY_TOTAL_COLUMNS)
+        conn = self.connect()
+        try:
+            df = conn.execute(self.sql('''
+                SELECT entry_date, %s FROM nutrition
+                WHERE mfp_username = %%s AND entry_date >= %%s AND entry_date <= %%s
+                GROUP BY entry_date
+                ORDER BY entry_date;
+                ''' % sums), [user, date_start, date_end]).df()
+        finally:
+            conn.close()
+        return df
+
+
+class SQLiteStorage(Storage):
+    '''
+    Embedded SQLite database, used when DuckDB is not installed
+    '''
+    name = 'sqlite'
+    placeholder = '?'
+    serial = 'INTEGER PRIMARY KEY AUTOINCREMENT'
+
+    def __init__(self, path=None):
+        self.path = path or os.path.join(BASEDIR, 'mfp.sqlite')
+
+    def connect(self):
+        return sqlite3.connect(self.path)
+
+    def create_tables(self):
+        super().create_tables()
+        self.pad_stored_dates()
+
+    def pad_stored_dates(self):
+        '''
+        Zero-pad the dates of nutrition rows stored unpadded (e.g. 2020-6-5) by the
+        first version of this backend, so they fall within range comparisons again.
+        Returns the number of distinct dates rewritten.
+        '''
+        dates = [record[0] for record in self.fetchall(
+            'SELECT DISTINCT entry_date FROM nutrition WHERE length(entry_date) < 10;')]
+        return self.executemany('UPDATE nutrition SET entry_date = %s WHERE entry_date = %s;', [
+            (to_date_string(datetime.strptime(value, '%Y-%m-%d')), value) for value in dates])
+
+    def insert_nutrition(self, rows):
+        return super().insert_nutrition(_padded_dates(rows))
+
+    def replace_nutrition(self, user, date_start, date_end, rows):
+        return super().replace_nutrition(user, date_start, date_end, _padded_dates(rows))
+
+
+BACKENDS = {
+    PostgresStorage.name: PostgresStorage,
+    DuckDBStorage.name: DuckDBStorage,
+    SQLiteStorage.name: SQLiteStorage,
+}
+
+_storage = None
+
+def make_storage(backend, path=None):
+    '''
+    Return a storage instance for the named backend. Requesting 'embedded'
+    returns DuckDB when it is installed and SQLite otherwise.
+
+    parameters:
+        backend (str) -- one of 'postgresql', 'duckdb', 'sqlite' or 'embedded'
+        path (str) -- database file used by the embedded backends
+    '''
+    if backend == 'embedded':
+        backend = DuckDBStorage.name if duckdb is not None else SQLiteStorage.name
+    if backend not in BACKENDS:
+        raise Exception('Unknown storage backend: {0}'.format(backend))
+    if backend == PostgresStorage.name:
+        return PostgresStorage()
+    return BACKENDS[backend](path)
+
+def get_storage():
+    '''
+    Return the storage backend selected in the [storage] section of database.ini,
+    or by the MFP_STORAGE and MFP_STORAGE_PATH environment variables which take
+    precedence. Without either the PostgreSQL server is used.
+    '''
+    global _storage
+    if _storage is None:
+        try:
+            settings = config(section='storage')
+        except Exception:
+            settings = {}
+        backend = os.environ.get('MFP_STORAGE', settings.get('backend', PostgresStorage.name))
+        _storage = make_storage(backend, os.environ.get('MFP_STORAGE_PATH', settings.get('path')))
+    return _storage
+
+def set_storage(storage):
+    '''
+    Replace the storage backend used by db.update_db
+
+    parameters:
+        storage (Storage) -- storage instance
+    '''
+    global _storage
+    _storage = storage
+
+def _padded_dates(rows):
+    # SQLite stores dates as text, so zero-pad scraped dates for range comparisons
+    return [
+        (row[0], to_date_string(datetime.strptime(row[1], '%Y-%m-%d'))) + tuple(row[2:])
+        for row in rows
+    ]
+
+_job_claim_lock = threading.Lock()
+_duckdb_connect_lock = threading.Lock()
+
+def lock_key(user):
+    '''
+    Return a signed 32-bit advisory lock key derived from the username
+
+    parameters:
+        user (str) -- username
+    '''
+    return int.from_bytes(hashlib.sha1(user.encode()).digest()[:4], 'big', signed=True)
+
+_thread_locks = {}
+_thread_locks_guard = threading.Lock()
+
+@contextmanager
+def _thread_lock(name):
+    '''Process-local fallback of Storage.ingest_lock, yielding True if it had to wait'''
+    with _thread_locks_guard:
+        lock = _thread_locks.setdefault(name, threading.Lock())
+    waited = not lock.acquire(blocking=False)
+    if waited:
+        lock.acquire()
+    try:
+        yield waited
+    finally:
+        lock.release()
+
+def to_date_string(value):
+    '''
+    Return a date, datetime or date-like string formatted as %Y-%m-%d
+
+    parameters:
+        value (date, datetime or str) -- date value returned by a backend
+    '''
+    if isinstance(value, (date, datetime)):
+        return datetime.strftime(value, '%Y-%m-%d')
+    return str(value)[:10]
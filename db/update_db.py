@@ -1,17 +1,71 @@
-import psycopg2
 import json
 import sys
-import pandas.io.sql as psql
+import threading
+import time
+import pandas as pd
 
 from os import path
+from concurrent.futures import ThreadPoolExecutor
 from datetime import date, datetime
 
 module_path = path.abspath(path.join(path.dirname( __file__ ), '..'))
 sys.path.append(module_path)
 
-from db.config import config
+import metrics
+from constants import START_SCRAPE_DATE
+from db import coverage, food_index, food_search, group_stats, jobs, nutrient_matrix
+from db.cache import query_cache
+from db.storage import get_storage, to_date_string, NUTRITION_COLUMNS
 from webscraper.user_data import MFP_User
 
+# Keys of MFP_User.data items, ordered as storage.NUTRITION_COLUMNS after the item name
+NUTRIENT_KEYS = [
+    'Calories', 'Protein', 'Carbohydrates', 'Fat', 'Fiber', 'Sugar', 'Saturated Fat',
+    'Polyunsaturated Fat', 'Monounsaturated Fat', 'Trans Fat', 'Cholesterol',
+    'Sodium', 'Potassium', 'Vitamin A', 'Vitamin C', 'Calcium', 'Iron'
+]
+
+for name in ['hits', 'misses', 'evictions', 'invalidations']:
+    metrics.describe('mfp_query_cache_%s_total' % name, 'counter', 'return_data cache %s' % name)
+metrics.describe('mfp_query_cache_entries', 'gauge', 'Ranges held by the return_data cache')
+metrics.describe('mfp_query_cache_bytes', 'gauge', 'Size of the dataframes held by the return_data cache')
+
+def collect_cache_metrics():
+    '''Copy the return_data cache counters into the metrics registry'''
+    report = query_cache.report()
+    for name in ['hits', 'misses', 'evictions', 'invalidations']:
+        metrics.set_value('mfp_query_cache_%s_total' % name, report[name])
+    metrics.set_value('mfp_query_cache_entries', report['entries'])
+    metrics.set_value('mfp_query_cache_bytes', report['bytes'])
+
+metrics.register_collector(collect_cache_metrics)
+
+metrics.describe('mfp_ingest_total', 'counter',
+                 'ingest_user calls by result: scraped, failed when no diary page was fetched and stored, up_to_date, coalesced into a concurrent ingest, '
+                 'cancelled prefetch, or queued for a scrape worker (queue_timeout when it did not finish in time)')
+metrics.describe('mfp_ingest_lock_wait_seconds', 'histogram',
+                 'Time ingest_user waited for the per-user ingest lock of each scraped chunk', metrics.LATENCY_BUCKETS)
+metrics.describe('mfp_ingest_gap_days_total', 'counter',
+                 'Diary days fetched by ingest_user, for requested ranges or background backfills')
+
+# Name of the per-user ingest lock held by requested ingests, which backfills yield to
+REQUEST_LOCK = '%s:requested'
+
+# Backfills of the history outside the requested ranges, one user at a time per process
+backfill_executor = ThreadPoolExecutor(max_workers=1)
+_backfills = set()
+_backfills_lock = threading.Lock()
+
+def record_query(query, rows):
+    '''
+    Count the rows read or written by an update_db query
+
+    parameters:
+        query (str) -- name of the update_db function
+        rows (int) -- number of rows
+    '''
+    metrics.inc('mfp_db_query_rows_total', {'query': query}, rows)
+
 def get_forum_data():
     '''
     Get and return scraped username/group data from MFP Forums
@@ -52,40 +106,20 @@ def get_users_groups(data):
 
 def execute_sql(sql, *argv):
     '''
-    Execute the input SQL statement on the postgreSQL database
+    Execute the input SQL statement on the configured storage backend
 
     parameters:
         sql (string) -- sql query to executre
     '''
-    conn = None
-    id = None
+    storage = get_storage()
     try:
-        # Load config parameters from database.ini
-        params = config()
-
-        # Connect to the PostgreSQL server
-        conn = psycopg2.connect(**params)
-
-        # Create new cursor
-        cur = conn.cursor()
-
-        # Execute the SQL command
         if len(argv)>0:
             for arg in argv:
-                [cur.execute(sql, (i,)) for i in arg] 
+                storage.executemany(sql, [(i,) for i in arg])
         else:
-            cur.execute(sql)
-
-        # commit the changes
-        conn.commit()
-
-        # close communication with the PostgreSQL database server
-        cur.close()
-    except (Exception, psycopg2.DatabaseError) as error:
+            storage.executemany(sql, [()])
+    except Exception as error:
         print(error)
-    finally:
-        if conn is not None:
-            conn.close()
 
 
 def insert_users(users):
@@ -121,103 +155,286 @@ def insert_group_user_relations(user_groups):
     parameters:
         users_groups (dict) -- dict of key-value format {user: [group1, group2, ...]}
     '''
-    conn = None
-    id = None
-    # Load config parameters from database.ini
-    params = config()
-    # Connect to the PostgreSQL server
-    conn = psycopg2.connect(**params)
-    # Create new cursor
-    cur = conn.cursor()
-
-    for user, groups in user_groups.items():
-        for group in groups:
-            sql = '''
-            INSERT INTO group_users (mfp_username, group_name)
-            VALUES (%s, %s);
-            '''        
-            try:
-                cur.execute(sql, (user, group))
-            except (Exception, psycopg2.DatabaseError) as error:
-                print(error)
-
-    # commit the changes
-    conn.commit()
-    # close communication with the PostgreSQL database server
-    conn.close()
-    cur.close()
-
-def insert_nutrition(users, last_date):
-    '''
-    Collect all nutrition data from every user over the last 5 years
-    and insert into the database
+    sql = '''
+    INSERT INTO group_users (mfp_username, group_name)
+    VALUES (%s, %s);
+    '''
+    rows = [(user, group) for user, groups in user_groups.items() for group in groups]
+    try:
+        get_storage().executemany(sql, rows)
+        # Member counts and cohorts changed, so recompute the groups' statistics
+        with metrics.timed('mfp_db_query_seconds', {'query': 'rebuild_group_stats'}):
+            group_stats.rebuild_groups(set(group for _, group in rows))
+    except Exception as error:
+        print(error)
+
+def nutrition_rows(mfp_user):
+    '''
+    Yield one tuple per logged food (ordered as storage.NUTRITION_COLUMNS) from the
+    scraped data of an MFP_User, with zero-padded dates. Days without entries yield
+    nothing; they are recorded as scraped in the coverage intervals instead.
+
+    parameters:
+        mfp_user (MFP_User) -- scraped user
+    '''
+    for day in mfp_user.data['Dates'].keys():
+        if day == 'Items':
+            pass
+        elif mfp_user.data['Dates'][day]:
+            yield from diary_rows(mfp_user.username, day, mfp_user.data['Dates'][day]['Items'])
+
+def diary_rows(user, day, items):
+    '''
+    Return one tuple per logged food (ordered as storage.NUTRITION_COLUMNS) of a
+    parsed diary page
+
+    parameters:
+        user (str) -- username
+        day (str) -- diary date formatted %Y-%m-%d (zero padding optional)
+        items (dict) -- nutrition values by food, as returned by MFP_User.get_nutrition
+    '''
+    entry_date = to_date_string(datetime.strptime(day, '%Y-%m-%d'))
+    return [(user, entry_date, item) + tuple(values[key] for key in NUTRIENT_KEYS)
+            for item, values in items.items()]
+
+def insert_nutrition(users, last_date, date_end=None, stop=None):
+    '''
+    Scrape the nutrition data of every user between the given dates, replace the
+    stored rows of the diary days actually fetched and record those days as covered,
+    along with the days of months whose sampled pages were all fetched and empty.
+    Days refused by the site, or skipped because the scrape stopped early, stay
+    uncovered, so a later ingest scrapes them again. The user's food frequency index,
+    the user's cells of the nutrient matrix and the cached reads are refreshed over the
+    fetched days, and the daily statistics of the user's groups on the days whose totals
+    changed. Returns the number of diary days fetched and stored; the days of a user
+    whose rows could not be written are not counted.
 
     parameters:
         users (list of strings) -- list of users to add to the database
-        last_date (str) -- Most recent date that an entry has been recorded in the 
-            database for an input user
-    '''
-    conn = None
-    id = None
-    # Load config parameters from database.ini
-    params = config()
-    # Connect to the PostgreSQL server
-    conn = psycopg2.connect(**params)
-    # Create new cursor
-    cur = conn.cursor()
-    today = datetime.strftime(date.today(), '%Y-%m-%d')
+        last_date (str) -- first date to scrape formatted %Y-%m-%d
+        date_end (str) -- last date to scrape formatted %Y-%m-%d. Default: today
+        stop (callable) -- checked before every page request, the scrape ends early
+            once it returns True
+    '''
+    storage = get_storage()
+    date_end = date_end or coverage.today()
+    fetched = 0
     for user in users:
-        mfp_user = MFP_User(user, last_date)
-
-        sql_entries = '''
-        INSERT INTO nutrition (mfp_username, entry_date, item, \
-            calories, protein, carbohydrates, fat, fiber, sugar, saturated_fat, \
-            polyunsaturated_fat, monounsaturated_fat, trans_fat, cholesterol, \
-            sodium, potassium, vitamin_a, vitamin_c, calcium, iron)
-        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s);
-        '''
-        sql_no_entries = '''
-        INSERT INTO nutrition (mfp_username, entry_date)
-        VALUES (%s, %s);
-        '''
+        mfp_user = MFP_User(user, last_date, date_end, stop=stop)
+        if mfp_user.failed:
+            print('%s diary pages of %s could not be fetched and are left uncovered' % (len(mfp_user.failed), user))
+        # Month sampling can return days outside the range, which may be covered already
+        days = sorted(day for day in mfp_user.fetched if last_date <= day <= date_end)
+        # Days of sampled empty months have no rows to write but are known to be empty
+        known = sorted(set(days) | mfp_user.sampled_empty)
+        if not known:
+            continue
+        runs = coverage.merge_intervals((day, day) for day in days)
+        rows = [row for row in nutrition_rows(mfp_user) if row[1] in mfp_user.fetched and last_date <= row[1] <= date_end]
         try:
-            for day in mfp_user.data['Dates'].keys():
-                if day == 'Items':
-                    pass
-                elif mfp_user.data['Dates'][day]:
-                    for item in mfp_user.data['Dates'][day]['Items'].keys():
-                        cals = mfp_user.data['Dates'][day]['Items'][item]['Calories']
-                        protein = mfp_user.data['Dates'][day]['Items'][item]['Protein']
-                        carbs = mfp_user.data['Dates'][day]['Items'][item]['Carbohydrates']
-                        fat = mfp_user.data['Dates'][day]['Items'][item]['Fat']
-                        fiber = mfp_user.data['Dates'][day]['Items'][item]['Fiber']
-                        sugar = mfp_user.data['Dates'][day]['Items'][item]['Sugar']
-                        sat_fat = mfp_user.data['Dates'][day]['Items'][item]['Saturated Fat']
-                        polyunsat_fat = mfp_user.data['Dates'][day]['Items'][item]['Polyunsaturated Fat']
-                        monounsat_fat = mfp_user.data['Dates'][day]['Items'][item]['Monounsaturated Fat']
-                        trans_fat = mfp_user.data['Dates'][day]['Items'][item]['Trans Fat']
-                        cholesterol = mfp_user.data['Dates'][day]['Items'][item]['Cholesterol']
-                        sodium = mfp_user.data['Dates'][day]['Items'][item]['Sodium']
-                        potassium = mfp_user.data['Dates'][day]['Items'][item]['Potassium']
-                        vitamin_a = mfp_user.data['Dates'][day]['Items'][item]['Vitamin A']
-                        vitamin_c = mfp_user.data['Dates'][day]['Items'][item]['Vitamin C']
-                        calcium = mfp_user.data['Dates'][day]['Items'][item]['Calcium']
-                        iron = mfp_user.data['Dates'][day]['Items'][item]['Iron']
-
-                        cur.execute(sql_entries, (mfp_user.username, day, item, cals, protein, carbs, fat, fiber, sugar,
-                            sat_fat, polyunsat_fat, monounsat_fat, trans_fat, cholesterol, sodium, potassium,
-                            vitamin_a, vitamin_c, calcium, iron))
-                else:
-                    cur.execute(sql_no_entries, (mfp_user.username, day))
-                    
-                # commit the changes
-                conn.commit()
-        except (Exception, psycopg2.DatabaseError) as error:
+            covered = coverage.user_coverage(user, START_SCRAPE_DATE, storage)
+            if not days:
+                add_known_coverage(user, known, covered, storage)
+                continue
+            # Compared with the totals after the write, so group statistics are only
+            # recomputed on days that changed
+            before = storage.daily_totals(user, days[0], days[-1])
+            with metrics.timed('mfp_db_query_seconds', {'query': 'insert_nutrition'}):
+                for run_start, run_end in runs:
+                    storage.replace_nutrition(user, run_start, run_end,
+                                              [row for row in rows if run_start <= row[1] <= run_end])
+            record_query('insert_nutrition', len(rows))
+            add_known_coverage(user, known, covered, storage)
+            fetched += len(days)
+            # Cached reads of the user in every process are stale from here on
+            storage.bump_user_version(user)
+            with metrics.timed('mfp_db_query_seconds', {'query': 'refresh_group_stats'}):
+                group_stats.refresh_user_groups(user, before, storage.daily_totals(user, days[0], days[-1]), storage)
+            with metrics.timed('mfp_db_query_seconds', {'query': 'refresh_food_index'}):
+                food_index.refresh_user(user, days[0], days[-1], storage)
+            with metrics.timed('mfp_db_query_seconds', {'query': 'refresh_nutrient_matrix'}):
+                nutrient_matrix.refresh_user(user, days[0], days[-1], storage)
+            food_search.add_items(set(row[2] for row in rows))
+        except Exception as error:
             print(error)
+        finally:
+            query_cache.invalidate(user, known[0], known[-1])
+    return fetched
+
+def add_known_coverage(user, days, covered, storage):
+    '''
+    Record the days as covered for the user, except today and later
+
+    parameters:
+        user (str) -- username
+        days (list of str) -- dates formatted %Y-%m-%d
+        covered (list of tuples) -- coverage of the user read before the rows were written
+        storage (Storage) -- storage backend
+    '''
+    # Today's diary can still change, so it is scraped again on the next visit
+    yesterday = coverage.yesterday()
+    coverage.add_coverage(user, [(run_start, min(run_end, yesterday))
+                                 for run_start, run_end in coverage.merge_intervals((day, day) for day in days)
+                                 if run_start <= yesterday], covered, storage)
+
+def ingest_user(user, date_start=START_SCRAPE_DATE, date_end=None, backfill=True, local=False, cancelled=None,
+                background=False):
+    '''
+    Scrape the dates between date_start and date_end (default today) that are not
+    covered yet for the user. The rest of the history since START_SCRAPE_DATE is then
+    scraped in the background by schedule_backfill when `backfill` is set.
+
+    Ingests are single-flight per user. Each chunk of at most coverage.MAX_SCRAPE_DAYS
+    is scraped under Storage.ingest_lock, shared by every thread, worker and node
+    using the database, and its coverage is read again under the lock, so concurrent
+    calls for the same user wait for the chunk being scraped and then skip the dates
+    it covered. Coverage is read before locking, so a covered range never waits.
+
+    Requested ranges go ahead of history backfills (`background`): a requested ingest
+    holds the user's request lock (REQUEST_LOCK) while it runs, and a backfill stops
+    before its next diary page whenever that lock is held, waits for the request to
+    finish and then resumes the interrupted chunk.
+
+    When the scrape queue is enabled (db.jobs.queue_enabled), the scrape is queued
+    for the scrape workers and waited for, unless `local` is set as it is by the workers.
+
+    A speculative ingest (db.prefetch) passes `cancelled`, which is checked before
+    each diary page request; the ingest stops with result 'cancelled' once it
+    returns True.
 
-    # close communication with the PostgreSQL database server
-    conn.close()
-    cur.close()
+    parameters:
+        user (str) -- username
+        date_start (str) -- first requested date formatted %Y-%m-%d
+        date_end (str) -- last requested date formatted %Y-%m-%d
+        backfill (bool) -- backfill the remaining history in the background
+        local (bool) -- scrape in this process even if the scrape queue is enabled
+        cancelled (callable) -- returns True once the ingest is no longer wanted
+        background (bool) -- the ingest is a history backfill, which yields to requested ranges
+    '''
+    storage = get_storage()
+    date_end = min(date_end or coverage.today(), coverage.today())
+    if not local and jobs.queue_enabled():
+        return queue_ingest(user, date_start, date_end, backfill)
+    covered = coverage.user_coverage(user, START_SCRAPE_DATE, storage)
+    gaps = coverage.missing_intervals(covered, date_start, date_end) if date_start <= date_end else []
+    if not gaps:
+        result = 'up_to_date'
+    elif background:
+        result = _ingest_gaps(user, gaps, storage, cancelled, background)
+    else:
+        with storage.ingest_lock(REQUEST_LOCK % user):
+            result = _ingest_gaps(user, gaps, storage, cancelled, background)
+    metrics.inc('mfp_ingest_total', {'result': result})
+
+    if backfill and coverage.missing_intervals(
+            coverage.user_coverage(user, START_SCRAPE_DATE, storage), START_SCRAPE_DATE, coverage.yesterday()):
+        schedule_backfill(user)
+    return result
+
+def _ingest_gaps(user, gaps, storage, cancelled, background):
+    '''
+    Scrape the gaps chunk by chunk under the user's ingest lock and return the
+    ingest_user result
+
+    parameters:
+        user (str) -- username
+        gaps (list of tuples) -- uncovered intervals, as returned by coverage.missing_intervals
+        storage (Storage) -- storage backend
+        cancelled (callable) -- returns True once the ingest is no longer wanted, or None
+        background (bool) -- yield to requested ingests of the user
+    '''
+    def is_cancelled():
+        return cancelled is not None and cancelled()
+
+    def stop():
+        return is_cancelled() or (background and storage.ingest_lock_held(REQUEST_LOCK % user))
+
+    scraped = fetched = 0
+    for gap_start, gap_end in gaps:
+        for chunk_start, chunk_end in coverage.split_interval(gap_start, gap_end):
+            while not is_cancelled():
+                if background:
+                    # Wait for requested ingests of the user to finish first
+                    with storage.ingest_lock(REQUEST_LOCK % user):
+                        pass
+                start = time.perf_counter()
+                with storage.ingest_lock(user):
+                    metrics.observe('mfp_ingest_lock_wait_seconds', time.perf_counter() - start)
+                    # Read under the lock, so the days a concurrent ingest covered are skipped
+                    covered = coverage.user_coverage(user, START_SCRAPE_DATE, storage)
+                    for missing_start, missing_end in coverage.missing_intervals(covered, chunk_start, chunk_end):
+                        print("Scraping %s for %s through %s" % (user, missing_start, missing_end))
+                        scraped += 1
+                        days = insert_nutrition([user], missing_start, missing_end, stop=stop)
+                        fetched += days
+                        metrics.inc('mfp_ingest_gap_days_total',
+                                    {'mode': 'backfill' if background else 'requested'}, days)
+                        if stop():
+                            break
+                # A backfill interrupted by a requested ingest scrapes the rest of the chunk afterwards
+                if not (background and stop()):
+                    break
+            if is_cancelled():
+                return 'cancelled'
+    if not scraped:
+        return 'coalesced'
+    # Nothing stored means every page was refused, e.g. rate limited, or every write failed
+    return 'scraped' if fetched else 'failed'
+
+def queue_ingest(user, date_start, date_end, backfill=True):
+    '''
+    Queue the scrape of the uncovered dates of the range as an interactive job and
+    wait for a scrape worker to finish it. Dates covered by other jobs meanwhile are
+    skipped by the worker, since it scrapes through ingest_user.
+
+    parameters:
+        user (str) -- username
+        date_start (str) -- first requested date formatted %Y-%m-%d
+        date_end (str) -- last requested date formatted %Y-%m-%d
+        backfill (bool) -- queue a backfill of the remaining history
+    '''
+    storage = get_storage()
+    covered = coverage.user_coverage(user, START_SCRAPE_DATE, storage)
+    gaps = coverage.missing_intervals(covered, date_start, date_end) if date_start <= date_end else []
+    if gaps:
+        # The worker queues the backfill once the requested range is scraped
+        job_id = jobs.enqueue(user, gaps[0][0], gaps[-1][1], jobs.INTERACTIVE, storage)
+        state = jobs.wait_for_job(job_id, storage=storage)
+        result = 'queued' if state == 'done' else 'queue_timeout'
+    else:
+        result = 'up_to_date'
+        if backfill and coverage.missing_intervals(covered, START_SCRAPE_DATE, coverage.yesterday()):
+            schedule_backfill(user)
+    metrics.inc('mfp_ingest_total', {'result': result})
+    return result
+
+def schedule_backfill(user):
+    '''
+    Scrape the uncovered history of the user in a background thread of this process,
+    unless a backfill of the user is already queued here. When the scrape queue is
+    enabled, a backfill job is queued for the scrape workers instead.
+
+    parameters:
+        user (str) -- username
+    '''
+    if jobs.queue_enabled():
+        jobs.enqueue(user, START_SCRAPE_DATE, coverage.yesterday(), jobs.BACKFILL)
+        return
+    with _backfills_lock:
+        if user in _backfills:
+            return
+        _backfills.add(user)
+
+    def backfill():
+        try:
+            ingest_user(user, backfill=False, background=True)
+        except Exception as error:
+            print(error)
+        finally:
+            with _backfills_lock:
+                _backfills.discard(user)
+
+    backfill_executor.submit(backfill)
 
 def db_check_user(user):
     '''
@@ -228,63 +445,35 @@ def db_check_user(user):
     parameters:
         users (string) -- username
     '''
-    conn = None
-    id = None
-    # Load config parameters from database.ini
-    params = config()
-    # Connect to the PostgreSQL server
-    conn = psycopg2.connect(**params)
-    # Create new cursor
-    cur = conn.cursor()
-    sql = '''
-    SELECT 1 FROM nutrition
-    WHERE mfp_username = %s
-    LIMIT 1
-    '''        
-
-    # Execute the sql statement to check if the username is already in the datebase
-    cur.execute(sql, (user,))
-    # Get the response records (0=user not in db or 1=user exists in database)
-    user_exists = cur.fetchall()
-
-    if user_exists:
-        sql = '''
-        SELECT MAX(entry_date)
-        FROM nutrition
-        WHERE mfp_username = %s;
-        '''
-        cur.execute(sql, (user,))
-    
-        # close communixcation with the PostgreSQL database server
-        last_updated_date = cur.fetchall()
-        last_updated_date = datetime.strftime(last_updated_date[0][0], '%Y-%m-%d')
-
-        conn.close()
-        cur.close()
-
-        return (user_exists, last_updated_date)
+    with metrics.timed('mfp_db_query_seconds', {'query': 'db_check_user'}):
+        last_updated_date = get_storage().last_entry_date(user)
+    if last_updated_date is not None:
+        return (1, last_updated_date)
     else:
         return (0, 0)
 
 def return_data(user, date_start, date_end):
     '''
-    Return query output as a dataframe for the provided username between the given date ranges
+    Return query output as a dataframe for the provided username between the given date ranges.
+    Ranges already read since the user's last ingest are served from db.cache.query_cache,
+    which checks the user's version on every read so ingests by other processes are seen.
 
     parameters:
         users (string) -- username
-        date_start (string) -- start date
-        date_end (string) -- end date
-    '''
-    conn = None
-    id = None
-    # Load config parameters from database.ini
-    params = config()
-    # Connect to the PostgreSQL server
-    conn = psycopg2.connect(**params)
-    # Create new cursor, query data
-    cur = conn.cursor()
-    df = psql.read_sql("SELECT * FROM nutrition \
-        WHERE (mfp_username = '%s' AND entry_date >= '%s' AND entry_date <= '%s');" % (user, date_start, date_end), conn)
+        date_start (string) -- start date formatted %Y-%m-%d
+        date_end (string) -- end date formatted %Y-%m-%d
+    '''
+    storage = get_storage()
+    # Read before the rows, so rows written meanwhile are cached under the older version
+    version = storage.user_version(user)
+    df = query_cache.get(user, date_start, date_end, version)
+    if df is None:
+        with metrics.timed('mfp_db_query_seconds', {'query': 'return_data'}):
+            df = storage.read_nutrition(user, date_start, date_end)
+            covered = coverage.user_coverage(user, START_SCRAPE_DATE, storage)
+        record_query('return_data', len(df))
+        df = with_empty_days(df, user, coverage.covered_days(covered, date_start, date_end))
+        query_cache.put(user, date_start, date_end, df, version)
     # Drop all non-empty columns
     df.dropna(axis='columns', how='all', inplace=True)
     df.fillna(0, inplace=True)
@@ -298,8 +487,95 @@ def return_data(user, date_start, date_end):
         df['fiber'] = 0
         df['sugar'] = 0
 
-    conn.close()
-    cur.close()
+    return df
+
+def with_empty_days(df, user, days):
+    '''
+    Return the nutrition rows with entry_date parsed and one row without values
+    added for every scraped day that has no logged food
+
+    parameters:
+        df (DataFrame) -- rows returned by Storage.read_nutrition
+        user (str) -- username
+        days (list of str) -- scraped days formatted %Y-%m-%d
+    '''
+    df['entry_date'] = pd.to_datetime(df['entry_date'])
+    empty_days = pd.DatetimeIndex(days).difference(pd.DatetimeIndex(df['entry_date'].unique()))
+    if len(empty_days) == 0:
+        return df
+    empty = pd.DataFrame({'mfp_username': user, 'entry_date': empty_days}).reindex(columns=df.columns)
+    return pd.concat([df, empty], ignore_index=True)
+
+def return_food_totals(user, date_start, date_end):
+    '''
+    Return the entries, days logged and calorie and macro sums of every food the
+    user logged between the given dates, as a dataframe indexed by item
+
+    parameters:
+        user (string) -- username
+        date_start (string) -- start date formatted %Y-%m-%d
+        date_end (string) -- end date formatted %Y-%m-%d
+    '''
+    with metrics.timed('mfp_db_query_seconds', {'query': 'return_food_totals'}):
+        df = food_index.food_totals(user, date_start, date_end)
+    record_query('return_food_totals', len(df))
+    return df
+
+def return_population_percentiles(user, date_start, date_end):
+    '''
+    Return the user's mean daily calories and macros between the given dates with
+    the median of all users and the user's percentile among them, as a dataframe
+    indexed by nutrient. Empty if the user logged nothing over the dates.
+
+    parameters:
+        user (string) -- username
+        date_start (string) -- start date formatted %Y-%m-%d
+        date_end (string) -- end date formatted %Y-%m-%d
+    '''
+    with metrics.timed('mfp_db_query_seconds', {'query': 'return_population_percentiles'}):
+        df = nutrient_matrix.population_percentiles(user, date_start, date_end)
+    record_query('return_population_percentiles', len(df))
+    return df
+
+def search_foods(query, limit=20):
+    '''
+    Return the foods logged by any user that match the query by prefix or by
+    trigram similarity, best first, with their number of users, entries and
+    average calories and macros per entry, as a dataframe
+
+    parameters:
+        query (string) -- food name or its beginning, possibly misspelled
+        limit (int) -- maximum number of foods returned
+    '''
+    with metrics.timed('mfp_db_query_seconds', {'query': 'search_foods'}):
+        df = food_search.search(query, limit)
+    record_query('search_foods', len(df))
+    return df
+
+def return_user_groups(user):
+    '''
+    Return the names of the groups the user belongs to
+
+    parameters:
+        user (string) -- username
+    '''
+    with metrics.timed('mfp_db_query_seconds', {'query': 'return_user_groups'}):
+        return get_storage().user_groups(user)
+
+def return_group_stats(group_name, date_start, date_end):
+    '''
+    Return the precomputed daily statistics of the group between the given dates
+    as a dataframe with entry_date parsed
+
+    parameters:
+        group_name (string) -- group name
+        date_start (string) -- start date formatted %Y-%m-%d
+        date_end (string) -- end date formatted %Y-%m-%d
+    '''
+    with metrics.timed('mfp_db_query_seconds', {'query': 'return_group_stats'}):
+        df = get_storage().read_group_daily_stats(group_name, date_start, date_end)
+    record_query('return_group_stats', len(df))
+    df['entry_date'] = pd.to_datetime(df['entry_date']).dt.normalize()
     return df
 
     
@@ -0,0 +1,173 @@
+import csv
+import io
+import json
+import re
+
+from datetime import datetime
+
+import flask
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+import metrics
+from db.storage import get_storage, to_date_string, NUTRITION_COLUMNS
+
+EXPORT_URL = '/export/<username>.<fmt>'
+# Exported columns; the username is part of the request
+EXPORT_COLUMNS = NUTRITION_COLUMNS[1:]
+DEFAULT_START_DATE = '2000-01-01'
+
+metrics.describe('mfp_export_rows_total', 'counter', 'Nutrition rows streamed by /export')
+
+
+def csv_chunks(batches):
+    '''
+    Yield a CSV header, then one encoded chunk per batch of nutrition rows
+
+    parameters:
+        batches (iterable of lists) -- row batches from Storage.iter_nutrition
+    '''
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_COLUMNS)
+    for rows in batches:
+        writer.writerows((to_date_string(row[1]),) + tuple(row[2:]) for row in rows)
+        yield buffer.getvalue().encode()
+        buffer.seek(0)
+        buffer.truncate()
+    if buffer.tell():
+        yield buffer.getvalue().encode()
+
+def ndjson_chunks(batches):
+    '''
+    Yield one encoded chunk of newline delimited JSON objects per batch of nutrition rows
+
+    parameters:
+        batches (iterable of lists) -- row batches from Storage.iter_nutrition
+    '''
+    for rows in batches:
+        yield ''.join(
+            json.dumps(dict(zip(EXPORT_COLUMNS, (to_date_string(row[1]),) + tuple(row[2:])))) + '\n'
+            for row in rows
+        ).encode()
+
+
+class _ChunkSink:
+    '''
+    Write-only file object collecting the bytes written by the Parquet writer
+    until they are taken by drain()
+    '''
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+        self.closed = False
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+def parquet_schema():
+    '''Return the Arrow schema of the exported Parquet file'''
+    return pa.schema(
+        [('entry_date', pa.date32()), ('item', pa.string())] +
+        [(column, pa.int64()) for column in EXPORT_COLUMNS[2:]])
+
+def parquet_chunks(batches):
+    '''
+    Yield a Parquet file written as one row group per batch of nutrition rows.
+    Each row group is sent as soon as it is written, and the footer last.
+
+    parameters:
+        batches (iterable of lists) -- row batches from Storage.iter_nutrition
+    '''
+    schema = parquet_schema()
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, schema, compression='snappy')
+    try:
+        for rows in batches:
+            columns = list(zip(*rows))
+            arrays = [[datetime.strptime(to_date_string(day), '%Y-%m-%d').date() for day in columns[1]]]
+            arrays += [list(values) for values in columns[2:]]
+            writer.write_table(pa.Table.from_arrays(arrays, schema=schema))
+            yield sink.drain()
+    finally:
+        writer.close()
+    yield sink.drain()
+
+# format: (encoder, mimetype)
+FORMATS = {
+    'csv': (csv_chunks, 'text/csv'),
+    'ndjson': (ndjson_chunks, 'application/x-ndjson'),
+    'parquet': (parquet_chunks, 'application/vnd.apache.parquet'),
+}
+
+def counted(batches, fmt):
+    '''Pass the batches through, counting the exported rows'''
+    for rows in batches:
+        metrics.inc('mfp_export_rows_total', {'format': fmt}, len(rows))
+        yield rows
+
+def parse_date(value, default):
+    '''Return the %Y-%m-%d date of a query parameter, raising ValueError if it is malformed'''
+    if not value:
+        return default
+    return datetime.strftime(datetime.strptime(value, '%Y-%m-%d'), '%Y-%m-%d')
+
+def export(username, fmt):
+    '''
+    Stream the stored nutrition rows of the user between the `start` and `end`
+    query parameters (%Y-%m-%d, default: everything up to today) as CSV, NDJSON or Parquet.
+    Rows are read from the database in batches and written to the response as they
+    arrive, so memory use does not depend on the size of the range.
+
+    parameters:
+        username (str) -- MyFitnessPal username
+        fmt (str) -- 'csv', 'ndjson' or 'parquet'
+    '''
+    if fmt not in FORMATS:
+        flask.abort(404)
+    if fmt == 'parquet' and pa is None:
+        flask.abort(501, 'pyarrow is required for Parquet exports')
+    try:
+        date_start = parse_date(flask.request.args.get('start'), DEFAULT_START_DATE)
+        date_end = parse_date(flask.request.args.get('end'), datetime.strftime(datetime.today(), '%Y-%m-%d'))
+    except ValueError:
+        flask.abort(400, 'start and end must be formatted YYYY-MM-DD')
+
+    encoder, mimetype = FORMATS[fmt]
+    batches = counted(get_storage().iter_nutrition(username, date_start, date_end), fmt)
+    filename = '%s_%s_%s.%s' % (re.sub(r'[^A-Za-z0-9_-]', '_', username), date_start, date_end, fmt)
+    # direct_passthrough keeps compression middleware from buffering the whole body
+    return flask.Response(
+        flask.stream_with_context(encoder(batches)),
+        mimetype=mimetype,
+        headers={'Content-Disposition': 'attachment; filename="%s"' % filename},
+        direct_passthrough=True)
+
+def init_app(app):
+    '''
+    Register the export route on the Flask server of the Dash app
+
+    parameters:
+        app (dash.Dash) -- dash app
+    '''
+    app.server.add_url_rule(EXPORT_URL, 'export', export)
@@ -0,0 +1,71 @@
+import gc
+import multiprocessing
+import os
+import resource
+import sys
+
+# Production profile for the dashboard: `gunicorn -c gunicorn.conf.py wsgi:application`
+
+bind = os.environ.get('GUNICORN_BIND', ':80')
+accesslog = '-'
+errorlog = '-'
+
+# Import the app (pandas, plotly, the scrapers and the figure templates) once in
+# the master and fork the workers from it, so workers start instantly and share
+# those pages copy-on-write instead of each importing them again.
+preload_app = True
+
+# Callbacks mostly wait on MyFitnessPal requests and database queries, so each
+# worker serves several requests at once with threads.
+worker_class = 'gthread'
+workers = int(os.environ.get('GUNICORN_WORKERS', multiprocessing.cpu_count() + 1))
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+# A first visit scrapes the user's whole history
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 300))
+max_requests = 1000
+max_requests_jitter = 100
+
+
+def memory_usage():
+    '''
+    Return (rss, private) memory of the current process in MB. Private memory is
+    the part not shared with the master; it is None where /proc is unavailable.
+    '''
+    try:
+        usage = {}
+        with open('/proc/self/smaps_rollup') as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) == 3 and parts[2] == 'kB':
+                    usage[parts[0].rstrip(':')] = int(parts[1]) / 1024
+        return usage['Rss'], usage['Private_Clean'] + usage['Private_Dirty']
+    except (OSError, KeyError):
+        # ru_maxrss is in kB on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, None
+
+def on_starting(server):
+    import metrics
+    # Samples of workers from a previous run would otherwise be added to this one
+    metrics.clear()
+
+def child_exit(server, worker):
+    import metrics
+    # Keep the exited worker's counters in the totals and drop its gauges
+    metrics.retire(worker.pid)
+
+def when_ready(server):
+    wsgi = sys.modules.get('wsgi')
+    if wsgi is not None:
+        server.log.info('App import took %.2fs', wsgi.IMPORT_SECONDS)
+    rss, _ = memory_usage()
+    server.log.info('Master RSS %.1f MB', rss)
+    # Move everything allocated so far out of the collector's reach, so garbage
+    # collections in the workers do not touch (and un-share) the preloaded pages
+    gc.freeze()
+
+def post_worker_init(worker):
+    rss, private = memory_usage()
+    if private is None:
+        worker.log.info('Worker %s booted: RSS %.1f MB', worker.pid, rss)
+    else:
+        worker.log.info('Worker %s booted: RSS %.1f MB, %.1f MB not shared', worker.pid, rss, private)
@@ -0,0 +1,340 @@
+import functools
+import json
+import os
+import tempfile
+import threading
+import time
+import uuid
+
+from contextlib import contextmanager
+
+# Every process (gunicorn worker) periodically writes its samples here so that
+# /metrics, served by any one worker, can report the totals of all of them.
+METRICS_DIR = os.path.join(tempfile.gettempdir(), 'mfp-dash-metrics')
+FLUSH_INTERVAL = 1.0
+# Counters and histograms of exited workers, folded in by retire()
+ARCHIVE_FILE = 'archive.json'
+
+LATENCY_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300]
+
+# name: (type, help, histogram buckets)
+METRICS = {
+    'mfp_callback_seconds': ('histogram', 'Latency of Dash callbacks', LATENCY_BUCKETS),
+    'mfp_scrape_requests_total': ('counter', 'Requests sent to MyFitnessPal', None),
+    'mfp_scrape_request_seconds': ('histogram', 'Latency of requests sent to MyFitnessPal', LATENCY_BUCKETS),
+    'mfp_scrape_response_bytes_total': ('counter', 'Bytes received from MyFitnessPal', None),
+    'mfp_db_query_seconds': ('histogram', 'Latency of update_db queries', LATENCY_BUCKETS),
+    'mfp_db_query_rows_total': ('counter', 'Rows read or written by update_db queries', None),
+}
+
+_lock = threading.Lock()
+_samples = {}
+_collectors = []
+_last_flush = 0.0
+# (pid, file name) of this process. The name is random, so a worker reusing the PID
+# of an exited one never continues from its counters.
+_sample_file = (None, None)
+
+
+def describe(name, metric_type, help_text, buckets=None):
+    '''
+    Register a metric so it is rendered with its HELP and TYPE lines
+
+    parameters:
+        name (str) -- metric name
+        metric_type (str) -- 'counter', 'gauge' or 'histogram'
+        help_text (str) -- description of the metric
+        buckets (list of floats) -- upper bounds of the histogram buckets
+    '''
+    METRICS[name] = (metric_type, help_text, buckets)
+
+def register_collector(collector):
+    '''
+    Register a function called before every flush to update metrics that are
+    read from another component (for example the query cache counters)
+
+    parameters:
+        collector (callable) -- function without arguments
+    '''
+    _collectors.append(collector)
+
+def _key(name, labels):
+    return (name, tuple(sorted((labels or {}).items())))
+
+def inc(name, labels=None, value=1):
+    '''
+    Increase a counter
+
+    parameters:
+        name (str) -- metric name
+        labels (dict) -- label names and values
+        value (number) -- amount to add
+    '''
+    key = _key(name, labels)
+    with _lock:
+        _samples[key] = _samples.get(key, 0) + value
+    _maybe_flush()
+
+def set_value(name, value, labels=None):
+    '''
+    Set a gauge, or a counter maintained by another component
+
+    parameters:
+        name (str) -- metric name
+        value (number) -- current value
+        labels (dict) -- label names and values
+    '''
+    with _lock:
+        _samples[_key(name, labels)] = value
+
+def observe(name, value, labels=None):
+    '''
+    Record one observation in a histogram
+
+    parameters:
+        name (str) -- metric name
+        value (number) -- observed value
+        labels (dict) -- label names and values
+    '''
+    buckets = METRICS[name][2]
+    key = _key(name, labels)
+    with _lock:
+        # bucket counts, then sum and count
+        sample = _samples.setdefault(key, [0]*(len(buckets)+2))
+        for i, bound in enumerate(buckets):
+            if value <= bound:
+                sample[i] += 1
+        sample[-2] += value
+        sample[-1] += 1
+    _maybe_flush()
+
+@contextmanager
+def timed(name, labels=None):
+    '''
+    Observe the wall time of the enclosed block in a histogram
+
+    parameters:
+        name (str) -- histogram name
+        labels (dict) -- label names and values
+    '''
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start, labels)
+
+def instrument_callback(func):
+    '''
+    Decorator recording the latency of a Dash callback by callback name and
+    status (ok, prevented or error). Apply it below @app.callback.
+    '''
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        status = 'error'
+        try:
+            result = func(*args, **kwargs)
+            status = 'ok'
+            return result
+        except Exception as error:
+            if type(error).__name__ == 'PreventUpdate':
+                status = 'prevented'
+            raise
+        finally:
+            observe('mfp_callback_seconds', time.perf_counter() - start,
+                    {'callback': func.__name__, 'status': status})
+    return wrapper
+
+def record_response(scraper, response, *args, **kwargs):
+    '''
+    requests response hook recording the status, size and latency of a MyFitnessPal request
+
+    parameters:
+        scraper (str) -- name of the scraper that sent the request
+        response (requests.Response) -- response received
+    '''
+    inc('mfp_scrape_requests_total', {'scraper': scraper, 'status': str(response.status_code)})
+    inc('mfp_scrape_response_bytes_total', {'scraper': scraper}, len(response.content))
+    observe('mfp_scrape_request_seconds', response.elapsed.total_seconds(), {'scraper': scraper})
+
+def instrument_session(session, scraper):
+    '''
+    Record every request sent through the requests session
+
+    parameters:
+        session (requests.Session) -- session used by a scraper
+        scraper (str) -- name of the scraper, used as the scraper label
+    '''
+    session.hooks['response'].append(functools.partial(record_response, scraper))
+    return session
+
+def _maybe_flush():
+    if time.time() - _last_flush >= FLUSH_INTERVAL:
+        flush()
+
+def _sample_file_name():
+    global _sample_file
+    pid = os.getpid()
+    # Checked on every flush, since gunicorn workers are forked from the master
+    if _sample_file[0] != pid:
+        _sample_file = (pid, '%s-%s.json' % (pid, uuid.uuid4().hex[:8]))
+    return _sample_file[1]
+
+def flush():
+    '''Write the samples of this process to METRICS_DIR'''
+    global _last_flush
+    _last_flush = time.time()
+    for collector in _collectors:
+        try:
+            collector()
+        except Exception as error:
+            print(error)
+    with _lock:
+        snapshot = [
+            [name, list(labels), list(value) if isinstance(value, list) else value]
+            for (name, labels), value in _samples.items()
+        ]
+    try:
+        os.makedirs(METRICS_DIR, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=METRICS_DIR, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(snapshot, f)
+        os.replace(tmp_path, os.path.join(METRICS_DIR, _sample_file_name()))
+    except OSError as error:
+        print(error)
+
+def _read_json(path, default):
+    try:
+        with open(path) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return default
+
+def _is_gauge(name):
+    return METRICS.get(name, ('untyped',))[0] == 'gauge'
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def _add(totals, snapshot, gauges=True):
+    for name, labels, value in snapshot:
+        if not gauges and _is_gauge(name):
+            continue
+        key = (name, tuple(tuple(label) for label in labels))
+        if isinstance(value, list):
+            current = totals.get(key, [0]*len(value))
+            totals[key] = [a + b for a, b in zip(current, value)]
+        else:
+            totals[key] = totals.get(key, 0) + value
+
+def collect():
+    '''
+    Return the samples of every process that has written to METRICS_DIR, summed by
+    metric and labels, together with the counters and histograms archived from exited
+    workers. Gauges of processes that are no longer running are left out.
+    '''
+    flush()
+    archive_path = os.path.join(METRICS_DIR, ARCHIVE_FILE)
+    # Read again if a worker was retired meanwhile, so its samples are counted once
+    for attempt in range(3):
+        stamp = os.stat(archive_path).st_mtime_ns if os.path.exists(archive_path) else None
+        archive = _read_json(archive_path, {'samples': [], 'retired': []})
+        retired = set(archive['retired'])
+        totals = {}
+        _add(totals, archive['samples'])
+        for filename in os.listdir(METRICS_DIR):
+            if not filename.endswith('.json') or filename == ARCHIVE_FILE or filename in retired:
+                continue
+            snapshot = _read_json(os.path.join(METRICS_DIR, filename), None)
+            if snapshot is None:
+                continue
+            _add(totals, snapshot, gauges=_pid_alive(int(filename.split('-')[0].split('.')[0])))
+        if stamp == (os.stat(archive_path).st_mtime_ns if os.path.exists(archive_path) else None):
+            break
+    return totals
+
+def retire(pid):
+    '''
+    Fold the counters and histograms of an exited process into the archive and
+    delete its sample files, so its totals keep adding up while its gauges stop.
+    Called by the gunicorn master from the child_exit hook.
+
+    parameters:
+        pid (int) -- PID of the exited process
+    '''
+    if not os.path.isdir(METRICS_DIR):
+        return
+    prefix = '%s-' % pid
+    filenames = [name for name in os.listdir(METRICS_DIR) if name.startswith(prefix) and name.endswith('.json')]
+    if not filenames:
+        return
+    archive_path = os.path.join(METRICS_DIR, ARCHIVE_FILE)
+    archive = _read_json(archive_path, {'samples': [], 'retired': []})
+    totals = {}
+    _add(totals, archive['samples'])
+    for filename in filenames:
+        _add(totals, _read_json(os.path.join(METRICS_DIR, filename), []), gauges=False)
+    # Files still listed are skipped by collect() until they are deleted below
+    archive = {
+        'samples': [[name, list(labels), value] for (name, labels), value in totals.items()],
+        'retired': filenames
+    }
+    try:
+        fd, tmp_path = tempfile.mkstemp(dir=METRICS_DIR, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(archive, f)
+        os.replace(tmp_path, archive_path)
+        for filename in filenames:
+            os.remove(os.path.join(METRICS_DIR, filename))
+    except OSError as error:
+        print(error)
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    escaped = [
+        '%s="%s"' % (k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+        for k, v in labels
+    ]
+    return '{%s}' % ','.join(escaped)
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+def render():
+    '''Return every metric in the Prometheus text exposition format'''
+    by_name = {}
+    for (name, labels), value in sorted(collect().items()):
+        by_name.setdefault(name, []).append((labels, value))
+
+    lines = []
+    for name, samples in by_name.items():
+        metric_type, help_text, buckets = METRICS.get(name, ('untyped', name, None))
+        lines.append('# HELP %s %s' % (name, help_text))
+        lines.append('# TYPE %s %s' % (name, metric_type))
+        for labels, value in samples:
+            if metric_type == 'histogram':
+                for bound, count in zip(buckets + ['+Inf'], value[:-2] + [value[-1]]):
+                    bucket_labels = labels + (('le', str(bound)),)
+                    lines.append('%s_bucket%s %s' % (name, _format_labels(bucket_labels), count))
+                lines.append('%s_sum%s %s' % (name, _format_labels(labels), _format_value(value[-2])))
+                lines.append('%s_count%s %s' % (name, _format_labels(labels), value[-1]))
+            else:
+                lines.append('%s%s %s' % (name, _format_labels(labels), _format_value(value)))
+    return '\n'.join(lines) + '\n'
+
+def clear():
+    '''Remove the samples written by previous runs, called once when the server starts'''
+    if not os.path.isdir(METRICS_DIR):
+        return
+    for filename in os.listdir(METRICS_DIR):
+        try:
+            os.remove(os.path.join(METRICS_DIR, filename))
+        except OSError:
+            pass
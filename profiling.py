@@ -0,0 +1,157 @@
+import cProfile
+import hmac
+import io
+import json
+import os
+import pstats
+import re
+import tempfile
+import threading
+import time
+import tracemalloc
+
+import flask
+
+# Profiles are written here, one set of files per profiled callback request
+PROFILE_DIR = os.environ.get('MFP_PROFILE_DIR', os.path.join(tempfile.gettempdir(), 'mfp-dash-profiles'))
+# Admins profile a single request by sending this token in the PROFILE_HEADER header.
+# Header profiling is disabled when no token is configured.
+ADMIN_TOKEN = os.environ.get('MFP_PROFILE_TOKEN')
+PROFILE_HEADER = 'X-MFP-Profile'
+# Comma separated callback names profiled on every request, e.g. "load_data,plot_data"
+PROFILE_CALLBACKS = set(filter(None, os.environ.get('MFP_PROFILE_CALLBACKS', '').split(',')))
+
+TRACEMALLOC_FRAMES = 10
+REPORT_LINES = 40
+
+# tracemalloc is global to the process while profiled requests overlap in threaded
+# workers, so it is started by the first profiled request and stopped by the last
+_tracing_lock = threading.Lock()
+_tracing = {'requests': 0, 'started': False}
+
+
+def is_admin_request(request):
+    '''
+    Return True if the request carries the admin profiling token
+
+    parameters:
+        request (flask.Request) -- incoming request
+    '''
+    token = request.headers.get(PROFILE_HEADER)
+    if not ADMIN_TOKEN or not token:
+        return False
+    return hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode())
+
+def callback_name(app, payload):
+    '''
+    Return the name of the Dash callback a _dash-update-component request runs
+
+    parameters:
+        app (dash.Dash) -- dash app
+        payload (dict) -- JSON body of the request
+    '''
+    output = payload.get('output', '')
+    callback = app.callback_map.get(output, {}).get('callback')
+    if callback is not None:
+        return callback.__name__
+    return re.sub(r'[^A-Za-z0-9_-]+', '_', output)[:60]
+
+def start_profile(app):
+    '''
+    before_request hook starting a CPU profile and allocation trace when the
+    callback request is requested by an admin or listed in PROFILE_CALLBACKS
+    '''
+    request = flask.request
+    if not request.path.endswith('_dash-update-component'):
+        return
+    payload = request.get_json(silent=True) or {}
+    name = callback_name(app, payload)
+    if name not in PROFILE_CALLBACKS and not is_admin_request(request):
+        return
+
+    with _tracing_lock:
+        if _tracing['requests'] == 0 and not tracemalloc.is_tracing():
+            # Tracing started elsewhere, e.g. with PYTHONTRACEMALLOC, is left running
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+            _tracing['started'] = True
+        _tracing['requests'] += 1
+    profiler = cProfile.Profile()
+    flask.g.mfp_profile = {
+        'profiler': profiler,
+        'callback': name,
+        'payload': payload,
+        'start': time.perf_counter()
+    }
+    profiler.enable()
+
+def stop_profile(exception=None):
+    '''
+    teardown_request hook stopping the profile started by start_profile and
+    writing it to PROFILE_DIR
+    '''
+    profile = flask.g.pop('mfp_profile', None)
+    if profile is None:
+        return
+    profile['profiler'].disable()
+    elapsed = time.perf_counter() - profile['start']
+    with _tracing_lock:
+        snapshot = tracemalloc.take_snapshot() if tracemalloc.is_tracing() else None
+        _tracing['requests'] -= 1
+        if _tracing['requests'] == 0 and _tracing['started']:
+            tracemalloc.stop()
+            _tracing['started'] = False
+    try:
+        write_profile(profile, snapshot, elapsed, exception)
+    except OSError as error:
+        print(error)
+
+def write_profile(profile, snapshot, elapsed, exception=None):
+    '''
+    Write the CPU profile (.prof, readable with pstats or snakeviz), the allocation
+    snapshot (.tracemalloc), a text report of both and the request parameters (.json)
+
+    parameters:
+        profile (dict) -- profile started by start_profile
+        snapshot (tracemalloc.Snapshot) -- allocations at the end of the request, or None
+            if tracing was stopped by someone else
+        elapsed (float) -- wall time of the request in seconds
+        exception (Exception) -- exception raised by the request, if any
+    '''
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    # The thread id keeps overlapping requests of one worker from sharing file names
+    base = os.path.join(PROFILE_DIR, '%s-%s-%s-%s' % (
+        time.strftime('%Y%m%d-%H%M%S'), profile['callback'], os.getpid(), threading.get_ident()))
+
+    profile['profiler'].dump_stats(base + '.prof')
+    if snapshot is not None:
+        snapshot.dump(base + '.tracemalloc')
+
+    report = io.StringIO()
+    pstats.Stats(profile['profiler'], stream=report).sort_stats('cumulative').print_stats(REPORT_LINES)
+    if snapshot is not None:
+        report.write('\nTop allocations by line:\n')
+        for stat in snapshot.statistics('lineno')[:REPORT_LINES]:
+            report.write('%s\n' % stat)
+    with open(base + '.txt', 'w') as f:
+        f.write(report.getvalue())
+
+    payload = profile['payload']
+    with open(base + '.json', 'w') as f:
+        json.dump({
+            'callback': profile['callback'],
+            'output': payload.get('output'),
+            'inputs': payload.get('inputs'),
+            'state': payload.get('state'),
+            'seconds': elapsed,
+            'error': repr(exception) if exception is not None else None
+        }, f, indent=4, default=str)
+
+def init_app(app):
+    '''
+    Register the profiling hooks on the Flask server of the Dash app
+
+    parameters:
+        app (dash.Dash) -- dash app
+    '''
+    app.server.before_request(lambda: start_profile(app))
+    app.server.teardown_request(stop_profile)
@@ -0,0 +1,71 @@
+import sys
+import threading
+
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from os import path
+
+import pytest
+
+module_path = path.abspath(path.join(path.dirname( __file__ ), '..'))
+sys.path.append(module_path)
+
+import constants
+import db.nutrient_matrix
+import webscraper.only_public_profiles
+import webscraper.user_data
+from db import storage as storage_module
+from db.storage import make_storage
+
+with open(path.join(module_path, 'benchmarks', 'fixtures', 'diary.html'), 'rb') as f:
+    DIARY = f.read()
+EMPTY_DIARY = b'<html><body><table class="table0" id="diary-table"></table></body></html>'
+
+
+class DiaryStandIn(BaseHTTPRequestHandler):
+    '''
+    Local stand-in for the MyFitnessPal food diary. `page` maps the requested
+    date (as sent, without zero padding) to (status, body); every requested
+    date is appended to `requested`.
+    '''
+    page = staticmethod(lambda day: (200, DIARY))
+    requested = []
+
+    def do_GET(self):
+        day = self.path.split('date=')[-1]
+        self.requested.append(day)
+        status, body = self.page(day)
+        self.send_response(status)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def storage(tmp_path, monkeypatch):
+    '''Embedded SQLite storage used by db.update_db, with archiving and the ledger off'''
+    monkeypatch.setenv('MFP_ARCHIVE', '0')
+    monkeypatch.setenv('MFP_SCRAPE_LEDGER', '0')
+    monkeypatch.setenv('MFP_SCRAPE_QUEUE', '0')
+    monkeypatch.setattr('db.nutrient_matrix._matrix', db.nutrient_matrix.NutrientMatrix(str(tmp_path / 'matrix')))
+    monkeypatch.setattr('db.nutrient_matrix._synced_at', None)
+    storage = make_storage('sqlite', str(tmp_path / 'mfp.sqlite'))
+    storage.create_tables()
+    monkeypatch.setattr(storage_module, '_storage', storage)
+    return storage
+
+@pytest.fixture
+def diary(monkeypatch):
+    '''Start the diary stand-in and point the scrapers at it; returns its handler class'''
+    handler = type('Diary', (DiaryStandIn,), {'requested': []})
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = 'http://127.0.0.1:%s' % server.server_address[1]
+    for module in (constants, webscraper.user_data, webscraper.only_public_profiles):
+        monkeypatch.setattr(module, 'MFP_URL', url)
+    yield handler
+    server.shutdown()
+    server.server_close()
@@ -0,0 +1,31 @@
+from db import coverage, update_db
+from tests.conftest import DIARY, EMPTY_DIARY
+
+
+def month(day):
+    return tuple(int(part) for part in day.split('-')[:2])
+
+def test_sampled_empty_months_are_covered(storage, diary):
+    # Food is logged in January and March only
+    diary.page = staticmethod(lambda day: (200, DIARY if month(day) in [(2020, 1), (2020, 3)] else EMPTY_DIARY))
+
+    assert update_db.ingest_user('sampled', '2020-01-01', '2020-06-30', backfill=False) == 'scraped'
+    first = list(diary.requested)
+    # Only the 5th, 15th and 25th of the empty months were requested
+    assert sorted(day for day in first if month(day) == (2020, 2)) == ['2020-2-15', '2020-2-25', '2020-2-5']
+    assert coverage.user_coverage('sampled', '2020-01-01', storage) == [('2020-01-01', '2020-06-30')]
+
+    diary.requested.clear()
+    assert update_db.ingest_user('sampled', '2020-01-01', '2020-06-30', backfill=False) == 'up_to_date'
+    assert diary.requested == []
+
+def test_refused_sample_leaves_month_uncovered(storage, diary):
+    diary.page = staticmethod(lambda day: (429, b'') if day == '2020-2-15' else (200, EMPTY_DIARY))
+
+    update_db.ingest_user('refused', '2020-01-01', '2020-03-31', backfill=False)
+    # February is scraped in full, and only the refused day is asked for again
+    assert coverage.user_coverage('refused', '2020-01-01', storage) == [
+        ('2020-01-01', '2020-02-14'), ('2020-02-16', '2020-03-31')]
+    diary.requested.clear()
+    update_db.ingest_user('refused', '2020-01-01', '2020-03-31', backfill=False)
+    assert diary.requested == ['2020-02-15']
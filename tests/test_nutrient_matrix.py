@@ -0,0 +1,18 @@
+import threading
+
+from db import nutrient_matrix, update_db
+
+
+def test_percentiles_do_not_wait_for_the_sync(storage, diary, monkeypatch):
+    update_db.ingest_user('matrix', '2020-01-01', '2020-01-07', backfill=False)
+    # As on a new host: the database has the user, the matrix is empty
+    monkeypatch.setattr(nutrient_matrix, '_matrix', nutrient_matrix.NutrientMatrix(str(storage.path) + '-matrix'))
+    monkeypatch.setattr(nutrient_matrix, '_synced_at', None)
+    release = threading.Event()
+    rebuild = nutrient_matrix.rebuild_users
+    monkeypatch.setattr(nutrient_matrix, 'rebuild_users', lambda users, storage: release.wait(10) and rebuild(users, storage))
+
+    assert nutrient_matrix.population_percentiles('matrix', '2020-01-01', '2020-01-07').empty
+    release.set()
+    nutrient_matrix._sync_thread.join(10)
+    assert nutrient_matrix.population_percentiles('matrix', '2020-01-01', '2020-01-07')['users'].iloc[0] == 1
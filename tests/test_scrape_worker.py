@@ -0,0 +1,21 @@
+import time
+
+from db import jobs
+from db.scrape_worker import ScrapeWorker
+
+
+def test_throttled_job_is_retried_with_backoff(storage, diary, monkeypatch):
+    # Backfills scheduled by the job are queued, as in a worker process
+    monkeypatch.setenv('MFP_SCRAPE_QUEUE', '1')
+    diary.page = staticmethod(lambda day: (429, b''))
+    job_id = jobs.enqueue('throttled', '2020-01-01', '2020-01-07', jobs.INTERACTIVE, storage)
+
+    start = time.time()
+    assert ScrapeWorker('test', storage).run_once()
+    assert len(diary.requested) == 7
+
+    state, attempts, run_at, last_error = storage.fetchall(
+        'SELECT state, attempts, run_at, last_error FROM scrape_jobs WHERE id = %s', (job_id,))[0]
+    assert (state, attempts) == ('queued', 1)
+    assert run_at >= start + jobs.retry_delay(1)
+    assert last_error
@@ -0,0 +1,23 @@
+import pandas as pd
+
+from dashboard.table_source import DateIndexedTable
+
+
+def table():
+    # A day without logged food holds 0 in place of a food name
+    return DateIndexedTable(pd.DataFrame({
+        'entry_date': pd.to_datetime(['2020-01-01', '2020-01-01', '2020-01-02', '2020-01-03']),
+        'item': ['Banana', 'Apple', 0, 'Apple'],
+        'calories': [105.0, 95.0, 0.0, 80.0],
+    }))
+
+def test_sort_text_column_with_empty_days():
+    records, _ = table().page(['2020-01-01', '2020-01-02', '2020-01-03'],
+                              sort_by=[{'column_id': 'item', 'direction': 'asc'},
+                                       {'column_id': 'calories', 'direction': 'desc'}])
+    assert [(row['item'], row['calories']) for row in records] == [
+        (0, 0.0), ('Apple', 95.0), ('Apple', 80.0), ('Banana', 105.0)]
+
+def test_mistyped_filter_value_is_skipped():
+    records, _ = table().page(['2020-01-01', '2020-01-02', '2020-01-03'], filter_query='{calories} < abc')
+    assert len(records) == 4
@@ -1,9 +1,16 @@
 import requests
 import json
-import re
 import os
+import sys
+import time
 from multiprocessing import Pool, cpu_count
-from bs4 import BeautifulSoup
+
+module_path = os.path.abspath(os.path.join(os.path.dirname( __file__ ), '..'))
+sys.path.append(module_path)
+
+import metrics
+from webscraper.ledger import ScrapeRun, response_counts
+from webscraper.parsing import get_parser
 
 class GroupScraper:
 
@@ -18,11 +25,11 @@ class GroupScraper:
             data (dict) -- dictionary with the following key-value structure:
                 'MyFitnessPal Group Name': {'Group': value, 'URL': value, 'Member_count: value, 'Members': value}                    
         '''
-        self._s = requests.Session()
+        self._s = metrics.instrument_session(requests.Session(), 'group')
         self.pages = 10
         self.url_list=[]
         for pg in range(1,self.pages+1):
-            self.url_list = 'https://community.myfitnesspal.com/en/groups/browse/popular?Page=p%s?filter=members' % spg
+            self.url_list.append('https://community.myfitnesspal.com/en/groups/browse/popular?Page=p%s?filter=members' % pg)
         self._make_data_dirs()
         self.data = {}
         self._get_groups()
@@ -45,19 +52,23 @@ class GroupScraper:
         page_no = 0        
         for url in self.url_list:
             page_no+=1
-            page_html = BeautifulSoup(self._s.get(url).content, 'html.parser')
-            group_ids = page_html.find_all('li', attrs={'id': re.compile('Group_\d+')})
             group_no = 1
 
-            for g in group_ids:
-                group_type = g.find_all('span', attrs={'class': re.compile('^MItem$')})[-1].contents[0].strip()
-                if group_type != 'Private Group':
-                    group = g.find_all('a', attrs={'href': re.compile('^//')})[-1].contents[0].strip()
-                    link = 'https:' + g.find_all('a', attrs={'href': re.compile('^//'), 'class':None})[0]['href']
+            with ScrapeRun('group_browse', url) as run:
+                response = self._s.get(url)
+                run.record_response(response)
+                with run.parsing():
+                    groups = self._parse_groups(response.content)
+
+            for g in groups:
+                if g['type'] != 'Private Group':
+                    group = g['name']
+                    link = 'https:' + g['link']
                     
                     members_link = link.rsplit('/', 1)[0] + '/members/' + link.rsplit('/', 1)[1]
-                    members_count = g.find_all('span', attrs={'class': 'MItem Hidden DiscussionCountNumber Number MItem-Count'})[0].contents[0].strip()
-                    members = self._get_members(group, members_count, members_link)
+                    members_count = g['members_count']
+                    with ScrapeRun('group', group) as run:
+                        members = self._get_members(group, members_count, members_link, run)
                     
                     # Store the data in a json-friendly format
                     self.data[group] = {
@@ -71,7 +82,7 @@ class GroupScraper:
                     self._to_json(group, page_no, group_no)
                     group_no+=1
             
-    def _get_members(self, group, members_count, members_link):
+    def _get_members(self, group, members_count, members_link, run):
         '''
         Return all usernames from the input group
 
@@ -79,6 +90,7 @@ class GroupScraper:
             group (str): MyFitnessPal Group
             members_count (str): Number of members in the MyFitnessPal Group
             members_link (str): URL of the Page 1 of the list of members in a group
+            run (ScrapeRun): ledger run the member pages are counted in
 
         outputs: 
             member_list (list): list of strings of all members in the group
@@ -91,29 +103,52 @@ class GroupScraper:
 
         # Multiprocessing
         with Pool(cpu_count()-1) as p:
-            member_list = p.map(self._get_members_on_page, page_list)
+            pages = p.map(self._get_members_on_page, page_list)
         p.close()
         p.join()
 
+        # The pages are fetched in worker processes, which return their ledger counters
+        for _, counts in pages:
+            run.merge(counts)
         # Flatten list of lists of members from each page into a single list of members
-        member_list = [member for page_list in member_list for member in page_list]
+        member_list = [member for page_members, _ in pages for member in page_members]
         return member_list
 
     def _get_members_on_page(self, url):
         '''
-        Function to get all group members on the input url
+        Function to get all group members on the input url, and the ledger counters
+        of the page (see ledger.response_counts)
 
         parameters: 
             url (string) -- Group Member URL to scrape
         '''
         print(f'Scraping %s' % url)
-        if self._s.get(url).status_code == 200:
-            page_html = BeautifulSoup(self._s.get(url).content, 'html.parser')
-            user_ids = page_html.find_all('a', attrs={'class': 'Title', 'href': re.compile('\/en\/profile\/usercard\/\d+')})
-            member_list = [user_ids[i].contents[0].strip() for i in range(len(user_ids))]
-        else:
-            pass
-        return member_list
+        response = self._s.get(url)
+        counts = response_counts(response)
+        if response.status_code != 200:
+            return [], counts
+        start = time.thread_time()
+        members = self._parse_members(response.content)
+        counts['parse_cpu_seconds'] = time.thread_time() - start
+        return members, counts
+
+    def _parse_groups(self, content):
+        '''
+        Return the groups listed on a group browse page (see parsing.Parser.groups)
+
+        parameters:
+            content (bytes) -- html of the group browse page
+        '''
+        return get_parser().groups(content)
+
+    def _parse_members(self, content):
+        '''
+        Return the usernames listed on a group member page
+
+        parameters:
+            content (bytes) -- html of the group member page
+        '''
+        return get_parser().member_names(content)
 
     def _to_json(self, group, page_no, group_no):
         '''
@@ -0,0 +1,266 @@
+import gzip
+import hashlib
+import os
+import sqlite3
+import sys
+import threading
+import time
+
+from datetime import datetime
+from os import path
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+module_path = path.abspath(path.join(path.dirname( __file__ ), '..'))
+sys.path.append(module_path)
+
+# Fetched diary pages are kept here unless MFP_ARCHIVE_DIR points elsewhere
+ARCHIVE_DIR = os.environ.get('MFP_ARCHIVE_DIR', path.join(module_path, 'data', 'archive'))
+INDEX_FILE = 'index.sqlite'
+# A new segment file is started once the current one grows past this size
+SEGMENT_BYTES = 64 * 1024 * 1024
+ZSTD_LEVEL = 3
+GZIP_LEVEL = 6
+
+INDEX_TABLES = [
+    '''
+    CREATE TABLE IF NOT EXISTS blobs (
+        sha256 text PRIMARY KEY,
+        segment text,
+        offset int,
+        length int,
+        raw_length int,
+        codec text
+    )
+    ''',
+    '''
+    CREATE TABLE IF NOT EXISTS pages (
+        mfp_username text,
+        entry_date text,
+        fetched_at real,
+        sha256 text
+    )
+    ''',
+    '''
+    CREATE INDEX IF NOT EXISTS pages_user_date_idx
+    ON pages (mfp_username, entry_date, fetched_at)
+    ''',
+]
+
+
+def compress(data, codec):
+    '''
+    Return the data compressed with the codec
+
+    parameters:
+        data (bytes) -- raw page
+        codec (str) -- 'zstd' or 'gzip'
+    '''
+    if codec == 'zstd':
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+    return gzip.compress(data, GZIP_LEVEL)
+
+def decompress(data, codec):
+    '''
+    Return the raw page of a compressed blob
+
+    parameters:
+        data (bytes) -- compressed blob
+        codec (str) -- 'zstd' or 'gzip'
+    '''
+    if codec == 'zstd':
+        if zstandard is None:
+            raise ImportError('zstandard is required to read zstd archive segments')
+        return zstandard.ZstdDecompressor().decompress(data)
+    return gzip.decompress(data)
+
+def read_blob(directory, segment, offset, length, codec):
+    '''
+    Return the raw page stored at the offset of a segment file. Takes plain values
+    so it can be called from pool worker processes.
+
+    parameters:
+        directory (str) -- archive directory
+        segment (str) -- segment file name
+        offset (int) -- offset of the blob in the segment
+        length (int) -- compressed length of the blob
+        codec (str) -- codec of the blob
+    '''
+    with open(path.join(directory, segment), 'rb') as f:
+        f.seek(offset)
+        return decompress(f.read(length), codec)
+
+
+class PageArchive:
+    '''
+    Append-only archive of the raw diary pages fetched by MFP_User, so pages can be
+    parsed again without downloading them.
+
+    Pages are content-addressed by their SHA-256: each distinct page is compressed
+    once (zstd when zstandard is installed, gzip otherwise) and appended to the
+    current segment file. A SQLite index next to the segments maps each blob to its
+    segment, offset and length, and each (user, date) fetch to its blob. Appends are
+    serialized with flock, so every worker process on the host can share the archive.
+
+    parameters:
+        directory (str) -- archive directory
+        codec (str) -- 'zstd' or 'gzip'. Default: zstd when zstandard is installed
+        segment_bytes (int) -- size after which a new segment file is started
+    '''
+    def __init__(self, directory=ARCHIVE_DIR, codec=None, segment_bytes=SEGMENT_BYTES):
+        self.directory = directory
+        self.codec = codec or ('zstd' if zstandard is not None else 'gzip')
+        self.segment_bytes = segment_bytes
+        self._lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+        conn = self._connect()
+        try:
+            conn.execute('PRAGMA journal_mode=WAL')
+            for statement in INDEX_TABLES:
+                conn.execute(statement)
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _connect(self):
+        return sqlite3.connect(path.join(self.directory, INDEX_FILE), timeout=30)
+
+    def _segments(self):
+        return sorted(name for name in os.listdir(self.directory) if name.endswith('.pack'))
+
+    def _append(self, blob):
+        # Returns (segment, offset) of the appended blob
+        with self._lock:
+            segments = self._segments()
+            segment = segments[-1] if segments else 'segment-000001.pack'
+            if segments and os.path.getsize(path.join(self.directory, segment)) >= self.segment_bytes:
+                segment = 'segment-%06d.pack' % (int(segment[8:14]) + 1)
+            with open(path.join(self.directory, segment), 'ab') as f:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    offset = f.seek(0, os.SEEK_END)
+                    f.write(blob)
+                    f.flush()
+                finally:
+                    if fcntl is not None:
+                        fcntl.flock(f, fcntl.LOCK_UN)
+        return segment, offset
+
+    def store(self, user, day, content, fetched_at=None):
+        '''
+        Archive a fetched diary page and return its SHA-256. A page already in the
+        archive is only indexed again for the user and date.
+
+        parameters:
+            user (str) -- username
+            day (str) -- diary date formatted %Y-%m-%d (zero padding optional)
+            content (bytes) -- raw page
+            fetched_at (float) -- epoch time of the fetch. Default: now
+        '''
+        sha = hashlib.sha256(content).hexdigest()
+        day = datetime.strftime(datetime.strptime(day, '%Y-%m-%d'), '%Y-%m-%d')
+        conn = self._connect()
+        try:
+            if conn.execute('SELECT 1 FROM blobs WHERE sha256 = ?', (sha,)).fetchone() is None:
+                blob = compress(content, self.codec)
+                segment, offset = self._append(blob)
+                # A concurrent store of the same page leaves an unindexed copy behind
+                conn.execute('INSERT OR IGNORE INTO blobs VALUES (?, ?, ?, ?, ?, ?)',
+                             (sha, segment, offset, len(blob), len(content), self.codec))
+            conn.execute('INSERT INTO pages VALUES (?, ?, ?, ?)', (user, day, fetched_at or time.time(), sha))
+            conn.commit()
+        finally:
+            conn.close()
+        return sha
+
+    def pages(self, users=None, date_start=None, date_end=None):
+        '''
+        Return the latest archived fetch of every (user, date) as
+        (user, date, segment, offset, length, codec) tuples ordered by user and date
+
+        parameters:
+            users (list of str) -- only these users. Default: every user
+            date_start (str) -- first date formatted %Y-%m-%d. Default: no bound
+            date_end (str) -- last date formatted %Y-%m-%d. Default: no bound
+        '''
+        conditions, params = [], []
+        if users:
+            conditions.append('p.mfp_username IN (%s)' % ', '.join(['?']*len(users)))
+            params.extend(users)
+        if date_start:
+            conditions.append('p.entry_date >= ?')
+            params.append(date_start)
+        if date_end:
+            conditions.append('p.entry_date <= ?')
+            params.append(date_end)
+        conn = self._connect()
+        try:
+            return conn.execute('''
+                SELECT p.mfp_username, p.entry_date, b.segment, b.offset, b.length, b.codec
+                FROM pages p
+                JOIN blobs b ON b.sha256 = p.sha256
+                WHERE p.fetched_at = (
+                    SELECT MAX(fetched_at) FROM pages
+                    WHERE mfp_username = p.mfp_username AND entry_date = p.entry_date
+                ) %s
+                ORDER BY p.mfp_username, p.entry_date
+                ''' % ''.join(' AND ' + condition for condition in conditions), params).fetchall()
+        finally:
+            conn.close()
+
+    def read(self, sha):
+        '''
+        Return the raw page with the given SHA-256, or None if it is not archived
+
+        parameters:
+            sha (str) -- SHA-256 hex digest of the page
+        '''
+        conn = self._connect()
+        try:
+            record = conn.execute('SELECT segment, offset, length, codec FROM blobs WHERE sha256 = ?', (sha,)).fetchone()
+        finally:
+            conn.close()
+        if record is None:
+            return None
+        return read_blob(self.directory, *record)
+
+
+_archive = None
+
+def get_archive():
+    '''
+    Return the page archive of this process, or None if archiving is turned off
+    with MFP_ARCHIVE=0
+    '''
+    global _archive
+    if os.environ.get('MFP_ARCHIVE', '1').lower() in ('0', 'false', 'no'):
+        return None
+    if _archive is None:
+        _archive = PageArchive()
+    return _archive
+
+def archive_page(user, day, content):
+    '''
+    Store a fetched diary page in the archive of this process. An archive that cannot
+    be written is reported and does not fail the scrape.
+
+    parameters:
+        user (str) -- username
+        day (str) -- diary date formatted %Y-%m-%d (zero padding optional)
+        content (bytes) -- raw page
+    '''
+    try:
+        archive = get_archive()
+        if archive is not None:
+            archive.store(user, day, content)
+    except Exception as e:
+        print(e)
@@ -0,0 +1,144 @@
+import os
+import socket
+import sys
+import threading
+import time
+
+from contextlib import contextmanager
+from datetime import datetime
+from os import path
+
+module_path = path.abspath(path.join(path.dirname( __file__ ), '..'))
+sys.path.append(module_path)
+
+import metrics
+from db.storage import get_storage
+
+# Responses MyFitnessPal sends when it is rate limiting the scraper
+THROTTLE_STATUSES = (429, 503)
+# Counters of a run, in the order of the matching storage.SCRAPE_RUN_COLUMNS
+COUNTERS = ['parse_cpu_seconds', 'pages_requested', 'pages_succeeded', 'bytes', 'throttled']
+
+metrics.describe('mfp_scrape_throttled_total', 'counter',
+                 'MyFitnessPal responses with a rate limiting status, by scraper')
+
+
+def ledger_enabled():
+    '''Return False if scrape runs should not be recorded, set with MFP_SCRAPE_LEDGER=0'''
+    return os.environ.get('MFP_SCRAPE_LEDGER', '1').lower() not in ('0', 'false', 'no')
+
+def response_counts(response):
+    '''
+    Return the ledger counters of one MyFitnessPal response
+
+    parameters:
+        response (requests.Response) -- response received
+    '''
+    return {
+        'pages_requested': 1,
+        'pages_succeeded': int(response.status_code == 200),
+        'bytes': len(response.content),
+        'throttled': int(response.status_code in THROTTLE_STATUSES),
+    }
+
+
+class ScrapeRun:
+    '''
+    Counts the pages, bytes, throttled responses and parse CPU time of one scraper
+    run and appends them to the scrape_runs ledger when the run ends. Used as a
+    context manager, so runs that raise are recorded with their error.
+
+    instance variables:
+        days (int) -- diary days actually fetched, set by the diary scraper. The
+            ledger's days column falls back to the length of the date range.
+
+    parameters:
+        scraper (str) -- scraper name: 'diary', 'group', 'group_browse' or 'profile'
+        subject (str) -- username or group the run scraped
+        date_start (date) -- first scraped date, for diary runs
+        date_end (date) -- last scraped date, for diary runs
+    '''
+    def __init__(self, scraper, subject, date_start=None, date_end=None):
+        self.scraper = scraper
+        self.subject = subject
+        self.date_start = date_start
+        self.date_end = date_end
+        self.counts = dict.fromkeys(COUNTERS, 0)
+        self.days = None
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        self.started_at = time.time()
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.finish(None if exc is None else '%s: %s' % (exc_type.__name__, exc))
+
+    def merge(self, counts):
+        '''
+        Add counters gathered elsewhere, e.g. in a worker process, to the run
+
+        parameters:
+            counts (dict) -- counter names and amounts
+        '''
+        with self._lock:
+            for name, value in counts.items():
+                self.counts[name] += value
+
+    def record_response(self, response, *args, **kwargs):
+        '''
+        requests response hook adding a MyFitnessPal response to the run
+
+        parameters:
+            response (requests.Response) -- response received
+        '''
+        counts = response_counts(response)
+        if counts['throttled']:
+            metrics.inc('mfp_scrape_throttled_total', {'scraper': self.scraper})
+        self.merge(counts)
+
+    def attach(self, session):
+        '''
+        Record every response received through the requests session and return it
+
+        parameters:
+            session (requests.Session) -- session used by the scraper
+        '''
+        session.hooks['response'].append(self.record_response)
+        return session
+
+    @contextmanager
+    def parsing(self):
+        '''Add the CPU time of the calling thread spent in the enclosed block to parse_cpu_seconds'''
+        start = time.thread_time()
+        try:
+            yield
+        finally:
+            self.merge({'parse_cpu_seconds': time.thread_time() - start})
+
+    def finish(self, error=None):
+        '''
+        Append the run to the scrape_runs ledger. A ledger that cannot be written is
+        reported and does not fail the scrape.
+
+        parameters:
+            error (str) -- error that ended the run
+        '''
+        if not ledger_enabled():
+            return
+        wall_seconds = time.perf_counter() - self._start
+        days = self.days
+        date_start = date_end = None
+        if self.date_start is not None and self.date_end is not None:
+            if days is None:
+                days = (self.date_end - self.date_start).days + 1
+            date_start = datetime.strftime(self.date_start, '%Y-%m-%d')
+            date_end = datetime.strftime(self.date_end, '%Y-%m-%d')
+        row = (self.scraper, self.subject, date_start, date_end, days,
+               '%s:%s' % (socket.gethostname(), os.getpid()), self.started_at, wall_seconds) + \
+            tuple(self.counts[name] for name in COUNTERS) + (error,)
+        try:
+            get_storage().insert_scrape_run(row)
+        except Exception as e:
+            print(e)
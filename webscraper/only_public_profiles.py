@@ -4,10 +4,12 @@ import requests
 import json
 from datetime import date, datetime
 from multiprocessing import Pool, cpu_count
-from bs4 import BeautifulSoup
 
 sys.path.append("../")
 from constants import *
+import metrics
+from webscraper.ledger import ScrapeRun
+from webscraper.parsing import get_parser
 
 
 
@@ -18,18 +20,15 @@ def check_username(username):
     parameters:
         username (str) -- The input username being searched
     '''
-    url = 'https://www.myfitnesspal.com/food/diary/%s/?date=%s' % (username, TODAY)
-    s = requests.Session()
-    if s.get(url).status_code != 200:
-        return False
-
-    html = BeautifulSoup(s.get(url).content, 'html.parser')
-    # The block-1 tag is only rendered when the username does not exist or the account is private
-    div = html.find('div', attrs={'class': "block-1"})
-    if not div:
-        return True
-    else:
-        return False
+    url = '%s/food/diary/%s/?date=%s' % (MFP_URL, username, TODAY)
+    with ScrapeRun('profile', username) as run:
+        s = run.attach(metrics.instrument_session(requests.Session(), 'profile'))
+        response = s.get(url)
+        if response.status_code != 200:
+            return False
+        # Only the private diary marker is parsed out of the page
+        with run.parsing():
+            return not get_parser().is_private(response.content)
 
 def is_public(username):
     '''
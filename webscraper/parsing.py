@@ -0,0 +1,174 @@
+import os
+import re
+
+from bs4 import BeautifulSoup, SoupStrainer
+
+try:
+    import lxml
+except ImportError:
+    lxml = None
+
+try:
+    from selectolax.lexbor import LexborHTMLParser as HTMLParser
+except ImportError:
+    HTMLParser = None
+
+# Patterns compiled once instead of on every page or group
+GROUP_ID = re.compile(r'Group_\d+')
+MEMBER_HREF = re.compile(r'/en/profile/usercard/\d+')
+PROTOCOL_RELATIVE = re.compile(r'^//')
+MEMBER_COUNT_CLASS = 'MItem Hidden DiscussionCountNumber Number MItem-Count'
+# The block-1 tag is only rendered when the username does not exist or the account is private
+PRIVATE_CLASS = 'block-1'
+
+# Only these tags and their descendants are built into the tree
+MEMBER_STRAINER = SoupStrainer('a', attrs={'class': 'Title', 'href': MEMBER_HREF})
+GROUP_STRAINER = SoupStrainer('li', attrs={'id': GROUP_ID})
+PRIVATE_STRAINER = SoupStrainer('div', attrs={'class': PRIVATE_CLASS})
+
+
+class Parser:
+    '''
+    Base class for the HTML parsers used by the group and profile scrapers.
+
+    Every backend extracts the same values from the MyFitnessPal pages, so the
+    scrapers do not depend on which one is installed.
+
+    class variables:
+        name (str) -- backend name, as set in MFP_HTML_PARSER
+    '''
+    name = None
+
+    def member_names(self, content):
+        '''
+        Return the usernames listed on a group member page
+
+        parameters:
+            content (bytes) -- html of the group member page
+        '''
+        raise NotImplementedError
+
+    def groups(self, content):
+        '''
+        Return the groups listed on a group browse page as dicts with the group
+        'name', its 'type' (e.g. 'Private Group'), the protocol relative 'link'
+        of the group and its 'members_count'
+
+        parameters:
+            content (bytes) -- html of the group browse page
+        '''
+        raise NotImplementedError
+
+    def is_private(self, content):
+        '''
+        Return True if a food diary page is the page shown for private or unknown users
+
+        parameters:
+            content (bytes) -- html of the food diary page
+        '''
+        raise NotImplementedError
+
+
+class SoupParser(Parser):
+    '''
+    BeautifulSoup with the pure-Python html.parser or with lxml. Only the tags
+    matched by the SoupStrainer of each page are built into the tree.
+    '''
+    def __init__(self, features):
+        self.name = features
+        self.features = features
+
+    def _soup(self, content, strainer):
+        return BeautifulSoup(content, self.features, parse_only=strainer)
+
+    def member_names(self, content):
+        soup = self._soup(content, MEMBER_STRAINER)
+        return [a.contents[0].strip() for a in soup.find_all('a', attrs={'class': 'Title', 'href': MEMBER_HREF})]
+
+    def groups(self, content):
+        groups = []
+        for g in self._soup(content, GROUP_STRAINER).find_all('li', attrs={'id': GROUP_ID}):
+            anchors = g.find_all('a', attrs={'href': PROTOCOL_RELATIVE})
+            groups.append({
+                'name': anchors[-1].contents[0].strip(),
+                'type': g.find_all('span', attrs={'class': 'MItem'})[-1].contents[0].strip(),
+                'link': [a for a in anchors if not a.get('class')][0]['href'],
+                'members_count': g.find('span', attrs={'class': MEMBER_COUNT_CLASS}).contents[0].strip()
+            })
+        return groups
+
+    def is_private(self, content):
+        return self._soup(content, PRIVATE_STRAINER).find('div', attrs={'class': PRIVATE_CLASS}) is not None
+
+
+class SelectolaxParser(Parser):
+    '''
+    selectolax (lexbor), a C parser queried with CSS selectors
+    '''
+    name = 'selectolax'
+
+    def __init__(self):
+        if HTMLParser is None:
+            raise ImportError('selectolax is required for the selectolax parser')
+
+    def member_names(self, content):
+        return [
+            a.text(deep=False).strip()
+            for a in HTMLParser(content).css('a.Title[href]')
+            if MEMBER_HREF.search(a.attributes['href'])
+        ]
+
+    def groups(self, content):
+        groups = []
+        for g in HTMLParser(content).css('li[id]'):
+            if not GROUP_ID.search(g.attributes['id'] or ''):
+                continue
+            anchors = g.css('a[href^="//"]')
+            groups.append({
+                'name': anchors[-1].text(deep=False).strip(),
+                'type': g.css('span.MItem')[-1].text(deep=False).strip(),
+                'link': [a for a in anchors if 'class' not in a.attributes][0].attributes['href'],
+                'members_count': g.css_first('span.' + '.'.join(MEMBER_COUNT_CLASS.split())).text(deep=False).strip()
+            })
+        return groups
+
+    def is_private(self, content):
+        return HTMLParser(content).css_first('div.' + PRIVATE_CLASS) is not None
+
+
+def available_parsers():
+    '''Return the names of the installed parser backends, fastest first'''
+    names = []
+    if HTMLParser is not None:
+        names.append(SelectolaxParser.name)
+    if lxml is not None:
+        names.append('lxml')
+    names.append('html.parser')
+    return names
+
+def make_parser(name):
+    '''
+    Return a parser instance for the named backend
+
+    parameters:
+        name (str) -- one of 'selectolax', 'lxml' or 'html.parser'
+    '''
+    if name == SelectolaxParser.name:
+        return SelectolaxParser()
+    if name not in ('lxml', 'html.parser'):
+        raise Exception('Unknown HTML parser: {0}'.format(name))
+    if name == 'lxml' and lxml is None:
+        raise ImportError('lxml is required for the lxml parser')
+    return SoupParser(name)
+
+_parser = None
+
+def get_parser():
+    '''
+    Return the parser selected by the MFP_HTML_PARSER environment variable,
+    or the fastest installed one
+    '''
+    global _parser
+    if _parser is None:
+        _parser = make_parser(os.environ.get('MFP_HTML_PARSER', available_parsers()[0]))
+    return _parser
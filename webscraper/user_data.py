@@ -1,9 +1,19 @@
+import calendar
 import requests
 import re
-from concurrent.futures import ThreadPoolExecutor
+import sys
 from datetime import date, timedelta, datetime
+from os import path
 from bs4 import BeautifulSoup
 
+module_path = path.abspath(path.join(path.dirname( __file__ ), '..'))
+sys.path.append(module_path)
+
+import metrics
+from constants import MFP_URL
+from webscraper.archive import archive_page
+from webscraper.ledger import ScrapeRun
+
 
 class MFP_User:
     '''
@@ -11,6 +21,11 @@ class MFP_User:
 
     instance variables:
         username (str) -- MyFitnessPal username
+        fetched (set of str) -- zero-padded dates whose diary page was fetched and parsed
+        failed (set of str) -- zero-padded dates whose diary page request was refused,
+            e.g. rate limited with 429 or 503
+        sampled_empty (set of str) -- zero-padded dates in the range that were not fetched
+            because every sampled page of their month was fetched and empty
         data (nested dict) -- dictionary with the following key-value structure:
             {'Dates': date: 
                 {'Items': {item: 
@@ -34,9 +49,15 @@ class MFP_User:
     '''
     def __init__(self, username, 
                 date_start=datetime.strftime(date.today()-timedelta(6), '%Y-%m-%d'), 
-                date_end=datetime.strftime(date.today(), '%Y-%m-%d')):
+                date_end=datetime.strftime(date.today(), '%Y-%m-%d'),
+                stop=None):
         self.username = username
         self.data = {'Dates': {'Items': {}}}
+        self.fetched = set()
+        self.failed = set()
+        self.sampled_empty = set()
+        # Checked before every page request; the scrape ends early once it returns True
+        self._stop = stop
     
         date_start = datetime.strptime(date_start, '%Y-%m-%d').date()
         date_end = datetime.strptime(date_end, '%Y-%m-%d').date()
@@ -45,18 +66,25 @@ class MFP_User:
         assert (date_end - date_start).days >= 0, 'date_end must be before date_start'
        
         print('Scraping %s for %s through %s' % (self.username, date_start, date_end))       
-        date_list = self._get_dates_to_check(date_start, date_end)
-        url_list = self._get_urls(date_list)
-        s = requests.Session()
-
-        if (date_end - date_start).days > 30:
-            date_list = self._filter_dates(url_list)
-            url_list = self._filter_urls(date_list)
-            
-        with ThreadPoolExecutor(max_workers=1) as executor:
-            processes = [executor.submit(self._scrape_urls(s, url, date_list.pop())) for url in url_list[::-1]]
-
-        # return all dates without entires as empty dictionaries
+        # Pages, bytes and parse time of the scrape are appended to the scrape_runs ledger
+        with ScrapeRun('diary', self.username, date_start, date_end) as self.run:
+            # The ledger counts the days fetched rather than the days requested
+            self.run.days = 0
+            date_list = self._get_dates_to_check(date_start, date_end)
+            url_list = self._get_urls(date_list)
+            s = self.run.attach(metrics.instrument_session(requests.Session(), 'diary'))
+
+            if (date_end - date_start).days > 30:
+                date_list = sorted(self._filter_dates(url_list, date_start, date_end))
+                url_list = self._filter_urls(date_list)
+
+            for url, day in zip(url_list, date_list):
+                if self._stopped():
+                    break
+                self._scrape_urls(s, url, day)
+
+        # return all dates without entires as empty dictionaries. Only the dates in
+        # self.fetched were actually scraped.
         delta = date_end-date_start
         for i in range(delta.days+1):
             d = datetime.strftime((date_start+timedelta(days=i)), '%Y-%m-%d')
@@ -66,36 +94,31 @@ class MFP_User:
     def _get_dates_to_check(self, date_start, date_end):
         '''
         Return a list of all dates that need to be checked as a list of strings.
-        The returned list will be determined by the output. If the range of dates
-        extend past 1 month, the list will only return the 5th, 15th, and 25th
-        day for every month within the range. These dates are to serve as checks
-        to see if the user has actively logged nutrition data in these months.
+        If the range of dates is longer than 30 days, the list will only return
+        the 5th, 15th, and 25th day for every month within the range. These dates
+        are to serve as checks to see if the user has actively logged nutrition
+        data in these months.
 
-        If the start date and end date are within the same month, a list of all
-        dates between them will be returned
+        Otherwise, a list of every date from the start date through the end date
+        will be returned
 
         parameters:
             date_start (str) -- Start date      
             date_end (str) -- End date
         '''
+        if (date_end - date_start).days <= 30:
+            return [
+                datetime.strftime(date_start + timedelta(i), '%Y-%m-%d')
+                for i in range((date_end - date_start).days + 1)
+            ]
+
         date_list = []
-        years = [y for y in (date_start.year, date_end.year)]
-        months = [m for m in range(1,13)]
         days = [5, 15, 25]
-
-        if date_start.year != date_end.year:
-            for y in years:
-                for m in months:
-                    for d in days:
-                        date_list.append('%s-%s-%s' % (y,m,d))
-        elif date_start.month != date_end.month:
-            for m in months:
-                for d in days:
-                    date_list.append('%s-%s-%s' %(date_start.year, m, d))
-        else:
-            days = [d for d in range(date_start.day, date_end.day)]
+        y, m = date_start.year, date_start.month
+        while (y, m) <= (date_end.year, date_end.month):
             for d in days:
-                date_list.append('%s-%s-%s' %(date_start.year, date_start.month, d))
+                date_list.append('%s-%s-%s' % (y,m,d))
+            y, m = (y + 1, 1) if m == 12 else (y, m + 1)
         return date_list
 
     def _get_urls(self, date_list):
@@ -107,33 +130,54 @@ class MFP_User:
         '''
         url_list = []
         for date in date_list:
-            url = ('https://www.myfitnesspal.com/food/diary/%s?date=%s' % (self.username, date))
+            url = ('%s/food/diary/%s?date=%s' % (MFP_URL, self.username, date))
             url_list.append(url)
         return url_list
 
-    def _filter_dates(self, url_list):
+    def _filter_dates(self, url_list, date_start, date_end):
         '''
         Refine the list of urls such that if the user has logged any data
         on the 5th, 15th, or 25th of any month, then every day of that
-        month will be scraped.
+        month will be scraped. A month whose sampled page could not be
+        fetched is scraped in full as well. The days within date_start and
+        date_end of a month whose sampled pages were all fetched and empty
+        are added to self.sampled_empty.
 
         parameters:
             url_list (list of strings): list of urls
+            date_start (date) -- first date of the range
+            date_end (date) -- last date of the range
         '''
-        s = requests.Session()
+        s = self.run.attach(metrics.instrument_session(requests.Session(), 'diary'))
         new_date_list = []
+        # Months with a sampled page that was not fetched, refused or not empty
+        active = set()
+        sampled = set()
         for url in url_list:
             date = url.split('=')[1]
+            y = int(date.split('-')[0])
+            m = int(date.split('-')[1])
+            if self._stopped():
+                # The unsampled rest of the month is not known to be empty
+                active.add((y, m))
+                break
+            sampled.add((y, m))
             self._scrape_urls(s, url, date)
-            if self.data['Dates'][date]['Items']:
-                y = date.split('-')[0]
-                m = date.split('-')[1]
-                for d in range(1,29):
+            if date not in self.data['Dates'] or self.data['Dates'][date]['Items']:
+                active.add((y, m))
+                for d in range(1, calendar.monthrange(y, m)[1] + 1):
                     if d not in [5, 15, 25]:
                         new_date_list.append("%s-%s-%s" % (y,m,d))
             else:
                 del self.data['Dates'][date]
 
+        for y, m in sampled - active:
+            for d in range(1, calendar.monthrange(y, m)[1] + 1):
+                day = datetime(y, m, d).date()
+                if date_start <= day <= date_end:
+                    self.sampled_empty.add(datetime.strftime(day, '%Y-%m-%d'))
+        self.sampled_empty -= self.fetched
+
         new_date_list = set(list(new_date_list))
         return new_date_list
 
@@ -157,8 +201,33 @@ class MFP_User:
             url (string) -- url
             date (string) -- date
         '''
-        self.diary_html = BeautifulSoup(s.get(url).content, 'html.parser')
-        self.data['Dates'][date] = {'Items': self.get_nutrition()}   
+        response = s.get(url)
+        padded = datetime.strftime(datetime.strptime(date, '%Y-%m-%d'), '%Y-%m-%d')
+        if response.status_code != 200:
+            # Left out of the parsed dates so the day is not recorded as scraped
+            # and the next ingest asks for it again
+            self.failed.add(padded)
+            return
+        content = response.content
+        # Kept so the page can be parsed again offline by db/reparse.py
+        archive_page(self.username, date, content)
+        with self.run.parsing():
+            self.data['Dates'][date] = {'Items': self._parse_diary(content)}
+        self.fetched.add(padded)
+        self.run.days = len(self.fetched)
+
+    def _stopped(self):
+        return self._stop is not None and self._stop()
+
+    def _parse_diary(self, content):
+        '''
+        Parse a food diary page and return its nutrition values (see get_nutrition)
+
+        parameters:
+            content (bytes) -- html of the food diary page
+        '''
+        self.diary_html = BeautifulSoup(content, 'html.parser')
+        return self.get_nutrition()
 
     # Dictionary of all the logged nutrition data for each food in the diary on the input date
     def get_nutrition(self):
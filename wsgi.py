@@ -1,12 +1,20 @@
+import os
 import sys
+import time
 
-# add your project directory to the sys.path
-project_home = u'/home/djbiega/MFP-Dash'
+# add the project directory to the sys.path
+project_home = os.path.dirname(os.path.abspath(__file__))
 
 if project_home not in sys.path:
     sys.path = [project_home] + sys.path
 
+start = time.perf_counter()
 from app import server as application
+from dashboard.figures import templates
+
+# Validate the figure templates now rather than on the first request
+templates()
+IMPORT_SECONDS = time.perf_counter() - start
 
 if __name__ == '__main__':
-    application.run()
\ No newline at end of file
+    application.run()